@@ -1,21 +1,21 @@
 import base64
-import json
 import os
+import tempfile
 import tkinter as tk
 from tkinter import ttk, filedialog
 from typing import TypeVar, Tuple, Union
 
-import requests
-from matplotlib.figure import Figure
 from pandas import DataFrame
 
-from ecg_analysis.calculations import get_metrics
+from api_client import ServerClient
+from gui_worker import BackgroundRunner
 from ecg_analysis.ecg_reader import preprocess_data
-from server import db, try_intify
+from ecg_analysis.numeric import try_intify
 
 server = "http://localhost:5000"
+api = ServerClient(server)
+db_index = "patient_id"  # index key of the server database
 PathLike = TypeVar("PathLike", str, bytes, os.PathLike)
-i_file = "temp.png"
 
 
 def image_to_b64(img_file: PathLike = "temp.png") -> str:
@@ -52,6 +52,8 @@ def data_to_fig(data: DataFrame, img_file: PathLike = "temp.png"):
     :param img_file: Path string for intended file to write the figure image to
     :type img_file: Pathlike
     """
+    from matplotlib.figure import Figure
+
     fig = Figure()
     ax = fig.subplots()
     ax.plot(data["time"], data["voltage"])
@@ -65,23 +67,32 @@ def photometrics_from_csv(file_name: PathLike) -> Tuple[str, dict]:
     assigning those columns to either the 'time' or 'voltage' column in a
     DataFrame. That DataFrame is then converted to matplotlib figure which is
     converted to a b64 string image and a series of relevant metrics for ECGs.
-    The figure conversion step creates a temporary 'temp.png' file which the
-    img_to_b64 function uses to generate the b64 string. After this is
-    accomplished, the temporary file is deleted.
+    The figure conversion step creates a uniquely named temporary png file
+    which the img_to_b64 function uses to generate the b64 string, so that
+    several files may be processed at once. After this is accomplished, the
+    temporary file is deleted.
 
     :param file_name: The file path of the csv data file to be preprocessed
     :type file_name: Pathlike
     :return: The b64 image and relevant heart rhythm metrics
     :rtype: Tuple[str, dict]
     """
+    # neurokit2 (through get_metrics) is the slowest import of the GUI, so it
+    # is only loaded once the first file is analysed
+    from ecg_analysis.calculations import get_metrics
+
     assert file_name.endswith(".csv")
     data = preprocess_data(file_name, raw_max=300, l_freq=1, h_freq=50,
                            phase="zero-double", fir_window="hann",
                            fir_design="firwin")
-    data_to_fig(data, i_file)
-    b64_img = image_to_b64(i_file)
+    fd, i_file = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    try:
+        data_to_fig(data, i_file)
+        b64_img = image_to_b64(i_file)
+    finally:
+        os.remove(i_file)
     metrics = get_metrics(data, rounding=4)
-    os.remove(i_file)
     return b64_img, metrics
 
 
@@ -135,7 +146,7 @@ def create_output(patient_id: str,
     :rtype: dict
     """
     my_vars = locals()
-    if my_vars[db.Index] == "":
+    if my_vars[db_index] == "":
         return False
     output = dict()
     for key, value in my_vars.items():
@@ -163,7 +174,9 @@ def design_window():
     cancel button which closes the window, an image label which is updated by
     either the browse or retrieve commands and has a top label which displays
     the heart rate of the patient, and lastly a label below the image which
-    displays the server response.
+    displays the server response. Server requests and csv analysis run in the
+    background through a BackgroundRunner so the window never freezes, with a
+    progress bar shown while they run and a stop button to cancel them.
     """
     def send_button_cmd(my_id: str, name: str, b64_img: str, hr: str):
         """The command that send the current GUI to the server
@@ -199,12 +212,51 @@ def design_window():
         elif not try_intify(my_id):
             print_to_gui("Patient ID must be an integer")
         else:
-            # send data to the server
-            r = requests.post(server + "/new_patient", json=patient)
-            response_dict = json.loads(r.text)
-            if "image" in response_dict.keys():
-                response_dict.pop("image")
-            print_to_gui(response_dict)
+            # send data to the server in the background
+            print_to_gui("Sending...")
+            runner.submit("send", api.new_patient, patient,
+                          on_done=show_response, on_error=show_error)
+
+    def show_response(response: Union[dict, str]):
+        """Prints the server response to a POST request without the image
+
+        :param response: The database entry added, or an error message
+        :type response: Union[dict, str]
+        """
+        if isinstance(response, dict) and "image" in response.keys():
+            response.pop("image")
+        print_to_gui(response)
+
+    def show_error(error: Exception):
+        """Prints an exception raised by a background task to the GUI
+
+        :param error: The exception raised by the background task
+        :type error: Exception
+        """
+        if isinstance(error, AssertionError):
+            print_to_gui("GUI only compatible with csv files")
+        else:
+            print_to_gui("Error: {}".format(error))
+
+    def stop_cmd():
+        """The command that cancels all running server requests and analysis
+
+        This command is activated by the stop button. Results of the cancelled
+        tasks are discarded and never shown on the GUI.
+        """
+        runner.cancel()
+        print_to_gui("Cancelled")
+
+    def set_busy(busy: bool):
+        """Starts or stops the progress bar while background tasks run
+
+        :param busy: Whether any background task is running
+        :type busy: bool
+        """
+        if busy:
+            progress.start(10)
+        else:
+            progress.stop()
 
     def cancel_cmd():
         """The command that closes the GUI
@@ -212,6 +264,7 @@ def design_window():
         This command is activated by the cancel button, and effectively closes
         the GUI window.
         """
+        runner.shutdown()
         root.destroy()
 
     def browse_files():
@@ -220,22 +273,27 @@ def design_window():
         This command is accessed by the 'Browse' button, and uses the tkinter
         filedialog method to access the host system's file explorer, as a way
         of selecting the csv data file you wish to load. Once selected, the
-        GUI preprocesses the data, and generates and displays a matplotlib
-        figure of the voltage and time data on the GUI. It also calculates all
-        the relevant metrics, and saves the heart rate data.
-
-        :return: The ECG image and heart rate data as a string
-        :rtype: Tuple[tk.PhotoImage, str]
+        GUI preprocesses the data in the background, and generates and
+        displays a matplotlib figure of the voltage and time data on the GUI.
+        It also calculates all the relevant metrics, and saves the heart rate
+        data.
         """
         file_name = filedialog.askopenfilename(
             initialdir=csv_file.get(), title="Select a File", filetypes=(
                 ("csv files", "*.csv*"), ("all files", "*.*")))
         csv_file.set(file_name)
-        try:
-            b64_img, metrics = photometrics_from_csv(file_name)
-        except AssertionError:
-            print_to_gui("GUI only compatible with csv files")
-            return
+        print_to_gui("Processing {}...".format(os.path.basename(file_name)))
+        runner.submit("browse", photometrics_from_csv, file_name,
+                      on_done=show_photometrics, on_error=show_error)
+
+    def show_photometrics(result: Tuple[str, dict]):
+        """Displays the ECG image and heart rate computed from a csv file
+
+        :param result: The b64 image and metrics from photometrics_from_csv
+        :type result: Tuple[str, dict]
+        """
+        b64_img, metrics = result
+        print_to_gui("")
         img_str.set(b64_img)
         heart_rate.set(str(metrics["mean_hr_bpm"]))
         photo = tk.PhotoImage(data=b64_img)
@@ -260,11 +318,22 @@ def design_window():
 
         This function executes every time a new MRN is added to the server. It
         populates the box next to the 'Retrieve' button with every MRN that
-        exists on the server.
+        exists on the server. The request runs in the background and the
+        values are updated once it returns.
+        """
+        runner.submit("query", api.get_all, on_done=fill_combo_box,
+                      on_error=show_error)
+
+    def fill_combo_box(response_dict: Union[dict, str]):
+        """Fills the retrieve dropdown box with the MRNs from the server
+
+        :param response_dict: Dictionary with mrns as keys and data as values
+        :type response_dict: Union[dict, str]
         """
-        r = requests.get(server + "/get")
+        if not isinstance(response_dict, dict):
+            print_to_gui(response_dict)
+            return
         cache = list()
-        response_dict = json.loads(r.text)
         for row in response_dict.values():
             cache.append(row["patient_id"])
         combo_box['values'] = cache
@@ -273,20 +342,32 @@ def design_window():
         """Retrieves patient data from the database and updates it on the GUI
 
         Takes the mrn from the server file entry box and uses it to retrieve
-        the corresponding patient data from the server via a GET request. It
-        then updates that info to be shown on the gui, filling out entry boxes
-        and replacing images if they exist.
+        the corresponding patient data from the server via a GET request in
+        the background. Once it returns, show_record updates that info to be
+        shown on the gui, filling out entry boxes and replacing images if they
+        exist.
 
         :param mrn: The medical record number of the patient on the server
         :type mrn: str
-        :return: Data from the server
-        :rtype: dict
         """
         if mrn == "":
             print_to_gui("Patient MRN is required")
             return
-        dat = requests.get(server + "/get/{}".format(mrn))
-        data = json.loads(dat.text)
+        # metadata and image come back in a single request
+        print_to_gui("Retrieving {}...".format(mrn))
+        runner.submit("retrieve", api.get_full, mrn, on_done=show_record,
+                      on_error=show_error)
+
+    def show_record(data: Union[dict, str]):
+        """Shows the patient data retrieved from the server on the GUI
+
+        :param data: Patient data and latest image, or an error message
+        :type data: Union[dict, str]
+        """
+        print_to_gui("")
+        if not isinstance(data, dict):
+            print_to_gui(data)
+            return
         id_data.set(data["patient_id"])
         if "patient_name" in data.keys():
             name_data.set(data["patient_name"])
@@ -296,9 +377,10 @@ def design_window():
             heart_rate.set(data["hr"])
             img_label.config(
                 text="Heart Rate: {} (bpm)".format(heart_rate.get()))
-            r = requests.get(
-                server + "/get/{}/image".format(mrn))
-            img = img_from_html(r.text)
+            if "image" in data.keys():
+                img = data["image"][-1]
+            else:
+                img = ""
             img_str.set(img)
             photo = tk.PhotoImage(data=img)
             img_grid.config(image=photo)
@@ -325,6 +407,7 @@ def design_window():
 
     root = tk.Tk()
     root.title("Health Database GUI")
+    runner = BackgroundRunner(root, on_busy=set_busy)
 
     top_label = ttk.Label(root, text="ECG Database")
     top_label.grid(column=3, row=0, columnspan=2)
@@ -380,6 +463,12 @@ def design_window():
     msg_label = ttk.Label(root, text="")
     msg_label.grid(column=3, row=6, columnspan=2)
 
+    progress = ttk.Progressbar(root, mode="indeterminate", length=150)
+    progress.grid(column=1, row=3, columnspan=2)
+
+    stop_button = ttk.Button(root, text="Stop", command=stop_cmd)
+    stop_button.grid(column=6, row=6)
+
     root.mainloop()
 
 
@@ -0,0 +1,299 @@
+import copy
+import json
+import time
+from typing import Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from compression import compress, min_size
+
+
+def make_session(retries: int = 3, backoff: float = 0.3,
+                 pool_size: int = 10) -> requests.Session:
+    """Creates a requests Session with a keep-alive pool and retries
+
+    Creates a Session whose connections are kept alive and reused between
+    requests, so only the first request to the server pays for the TCP (and
+    TLS) handshake. Connection errors and gateway errors (502, 503, 504) are
+    retried up to 'retries' times with an exponential backoff of 'backoff'
+    seconds. Only idempotent methods are retried, so a POST is never sent
+    twice.
+
+    :param retries: Number of times a failed request is retried
+    :type retries: int
+    :param backoff: Backoff factor in seconds between retries
+    :type backoff: float
+    :param pool_size: Number of connections kept alive per host
+    :type pool_size: int
+    :return: The configured session
+    :rtype: requests.Session
+    """
+    retry = Retry(total=retries, connect=retries, read=retries,
+                  backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset({"GET", "HEAD"}),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CacheEntry:
+    """Class that holds one cached server response and its ETag"""
+
+    def __init__(self, etag: str, payload: Union[dict, str]):
+        """Initializes the CacheEntry and records when it was validated
+
+        :param etag: The ETag header of the response
+        :type etag: str
+        :param payload: The decoded body of the response
+        :type payload: Union[dict, str]
+        """
+        self.etag = etag
+        self.payload = payload
+        self.validated = time.monotonic()
+
+
+class RecordCache:
+    """Class that caches server responses for each patient MRN
+
+    RecordCache stores the responses of GET requests along with the ETag the
+    server sent, which changes every time the patient's data is updated. The
+    entries are kept per MRN, so posting new data for a patient invalidates
+    only the cached routes of that patient and the '/get' listing. An entry
+    younger than 'max_age' seconds is served without contacting the server,
+    while older entries are revalidated with a conditional request, which
+    costs a round trip but no download if the data has not changed. The hits
+    and misses attributes count responses served from the cache and responses
+    downloaded from the server, respectively.
+    """
+
+    def __init__(self, max_age: float = 0.0):
+        """Initializes an empty RecordCache
+
+        :param max_age: Seconds during which an entry is served without being
+            revalidated with the server. 0 always revalidates.
+        :type max_age: float
+        """
+        self.max_age = max_age
+        self.entries: Dict[str, Dict[str, CacheEntry]] = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mrn: str, route: str) -> Optional[CacheEntry]:
+        """Returns the cached entry of a route for an MRN, if there is one
+
+        :param mrn: The MRN (or name) the route refers to, '' for '/get'
+        :type mrn: str
+        :param route: The route of the request
+        :type route: str
+        :return: The cached entry or None
+        :rtype: Optional[CacheEntry]
+        """
+        return self.entries.get(str(mrn), dict()).get(route)
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """Checks whether an entry can be served without revalidation
+
+        :param entry: The cached entry
+        :type entry: CacheEntry
+        :return: Whether the entry was validated less than max_age ago
+        :rtype: bool
+        """
+        return time.monotonic() - entry.validated < self.max_age
+
+    def put(self, mrn: str, route: str, etag: str,
+            payload: Union[dict, str]):
+        """Stores the response of a route for an MRN
+
+        :param mrn: The MRN (or name) the route refers to, '' for '/get'
+        :type mrn: str
+        :param route: The route of the request
+        :type route: str
+        :param etag: The ETag header of the response
+        :type etag: str
+        :param payload: The decoded body of the response
+        :type payload: Union[dict, str]
+        """
+        self.entries.setdefault(str(mrn), dict())[route] = CacheEntry(
+            etag, payload)
+
+    def invalidate(self, mrn: str = None):
+        """Removes the entries of an MRN and the listing, or every entry
+
+        :param mrn: The MRN whose entries are removed. If None, the whole
+            cache is cleared.
+        :type mrn: str
+        """
+        if mrn is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(str(mrn), None)
+            self.entries.pop("", None)
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of the cache
+
+        :return: Dictionary with the keys hits, misses, hit_rate and entries
+        :rtype: dict
+        """
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses,
+                    hit_rate=self.hits / total if total else 0.0,
+                    entries=sum(len(e) for e in self.entries.values()))
+
+
+class ServerClient:
+    """Class that wraps every request the GUI makes to the patient server
+
+    ServerClient keeps a single pooled Session for all requests to the server
+    at 'base_url', so the GUI reuses open connections instead of opening a new
+    one per button press. Each method corresponds to a route of the server and
+    returns the decoded JSON body if the request succeeded, or the error
+    message from the server otherwise. GET responses are kept in a RecordCache
+    (the cache attribute) and only downloaded again if the server reports that
+    the patient's data has changed.
+    """
+
+    def __init__(self, base_url: str,
+                 timeout: Union[float, Tuple[float, float]] = (3.05, 30),
+                 retries: int = 3, backoff: float = 0.3, pool_size: int = 10,
+                 max_age: float = 0.0):
+        """Initializes the ServerClient with a pooled session
+
+        :param base_url: Address of the server, e.g. 'http://localhost:5000'
+        :type base_url: str
+        :param timeout: Connect and read timeout in seconds for each request
+        :type timeout: Union[float, Tuple[float, float]]
+        :param retries: Number of times a failed GET request is retried
+        :type retries: int
+        :param backoff: Backoff factor in seconds between retries
+        :type backoff: float
+        :param pool_size: Number of connections kept alive
+        :type pool_size: int
+        :param max_age: Seconds during which cached responses are served
+            without revalidating them with the server
+        :type max_age: float
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = make_session(retries, backoff, pool_size)
+        self.cache = RecordCache(max_age)
+
+    def _request(self, method: str, route: str, **kwargs
+                 ) -> Union[dict, str]:
+        """Sends a request to the server and decodes the response
+
+        :param method: HTTP method, e.g. 'GET' or 'POST'
+        :type method: str
+        :param route: Route of the server starting with '/'
+        :type route: str
+        :param kwargs: Key word arguments passed on to Session.request
+        :type kwargs: dict
+        :return: The decoded JSON body, or the error message of the server
+        :rtype: Union[dict, str]
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        r = self.session.request(method, self.base_url + route, **kwargs)
+        if r.status_code != 200:
+            return r.text
+        return r.json()
+
+    def _cached_get(self, mrn: str, route: str) -> Union[dict, str]:
+        """Sends a GET request unless the response is cached and unchanged
+
+        A fresh cache entry is returned without contacting the server. A stale
+        entry is revalidated by sending its ETag in the If-None-Match header;
+        if the server answers 304 (Not Modified) the cached payload is
+        returned, otherwise the new response replaces it. A copy of the
+        payload is returned so callers may modify it.
+
+        :param mrn: The MRN (or name) the route refers to, '' for '/get'
+        :type mrn: str
+        :param route: Route of the server starting with '/'
+        :type route: str
+        :return: The decoded JSON body, or the error message of the server
+        :rtype: Union[dict, str]
+        """
+        entry = self.cache.get(mrn, route)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.hits += 1
+            return copy.deepcopy(entry.payload)
+        headers = dict()
+        if entry is not None:
+            headers["If-None-Match"] = entry.etag
+        r = self.session.get(self.base_url + route, headers=headers,
+                             timeout=self.timeout)
+        if r.status_code == 304 and entry is not None:
+            self.cache.hits += 1
+            entry.validated = time.monotonic()
+            return copy.deepcopy(entry.payload)
+        self.cache.misses += 1
+        if r.status_code != 200:
+            return r.text
+        payload = r.json()
+        if "ETag" in r.headers:
+            self.cache.put(mrn, route, r.headers["ETag"], payload)
+        return copy.deepcopy(payload)
+
+    def new_patient(self, patient: dict) -> Union[dict, str]:
+        """Posts new patient data to the server ('/new_patient')
+
+        Bodies larger than compression.min_size (i.e. any with an image) are
+        sent gzip compressed, which every version of the server accepts.
+
+        :param patient: Dictionary created by GUI_client.create_output
+        :type patient: dict
+        :return: The database entry added to the database, or an error message
+        :rtype: Union[dict, str]
+        """
+        body = json.dumps(patient).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if len(body) >= min_size:
+            body = compress(body, "gzip")
+            headers["Content-Encoding"] = "gzip"
+        response = self._request("POST", "/new_patient", data=body,
+                                 headers=headers)
+        if isinstance(response, dict):
+            self.cache.invalidate(response["patient_id"])
+        return response
+
+    def get_all(self) -> Union[dict, str]:
+        """Retrieves all patients on the server without images ('/get')
+
+        :return: Dictionary with mrns as keys and data as values
+        :rtype: Union[dict, str]
+        """
+        return self._cached_get("", "/get")
+
+    def get_record(self, mrn: str) -> Union[dict, str]:
+        """Retrieves the data of one patient without images ('/get/<mrn>')
+
+        :param mrn: The medical record number or name of the patient
+        :type mrn: str
+        :return: The patient data, or an error message
+        :rtype: Union[dict, str]
+        """
+        return self._cached_get(mrn, "/get/{}".format(mrn))
+
+    def get_full(self, mrn: str) -> Union[dict, str]:
+        """Retrieves the data and latest image of a patient in one request
+
+        Uses the '/get/<mrn>/full' route, which returns the same data as
+        '/get/<mrn>' plus the latest b64 image, saving the second round trip
+        to '/get/<mrn>/image'.
+
+        :param mrn: The medical record number or name of the patient
+        :type mrn: str
+        :return: The patient data and latest image, or an error message
+        :rtype: Union[dict, str]
+        """
+        return self._cached_get(mrn, "/get/{}/full".format(mrn))
+
+    def close(self):
+        """Closes all pooled connections of the session"""
+        self.session.close()
@@ -0,0 +1,271 @@
+"""Time and peak memory of each stage of the ECG preprocessing pipeline
+
+Runs load_csv, clean_data, filter_data, preprocess_data and get_metrics on
+the test_data csv files and on copies of them made 10 and 100 times longer
+with bad rows injected, then appends the results, tagged with the current git
+commit, to a json lines file so runs can be compared across commits. Run from
+the repository root, e.g.::
+
+    python -m benchmarks.ecg_pipeline test_data1 test_data20 --scale 1 10 100
+    python -m benchmarks.ecg_pipeline --compare HEAD~1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_dir = os.path.join(root, "test_data")
+results_file = os.path.join(root, ".benchmarks", "ecg_pipeline.jsonl")
+stages = ("load_csv", "clean_data", "filter_data", "preprocess_data",
+          "get_metrics")
+bad_values = ("", "nan", "bad")  # missing, nan and non-numeric entries
+
+
+def scale_csv(src: str, dst: str, factor: int, bad_fraction: float = 0.001,
+              seed: int = 0):
+    """Writes a copy of a csv file repeated factor times, with bad rows
+
+    The rows are repeated with the times shifted so they keep increasing, as
+    if the recording were factor times longer. Then bad_fraction of the rows
+    have their time or voltage replaced by an empty, nan or non-numeric
+    entry, which clean_data has to remove.
+
+    :param src: The test_data csv file to scale
+    :type src: str
+    :param dst: The csv file to write
+    :type dst: str
+    :param factor: Number of times the data is repeated
+    :type factor: int
+    :param bad_fraction: Fraction of the rows made invalid
+    :type bad_fraction: float
+    :param seed: Seed of the random generator choosing the bad rows
+    :type seed: int
+    """
+    from ecg_analysis.ecg_reader import clean_data, load_csv
+    data = clean_data(load_csv(src))
+    times = data["time"].to_numpy()
+    period = times[-1] - times[0] + np.median(np.diff(times))
+    times = (times[np.newaxis] + period * np.arange(factor)[:, np.newaxis]
+             ).ravel()
+    rows = np.stack([np.char.mod("%.6g", times), np.char.mod(
+        "%.6g", np.tile(data["voltage"].to_numpy(), factor))], axis=1)
+    rows = rows.astype(object)
+    rng = np.random.default_rng(seed)
+    n_bad = int(len(rows) * bad_fraction)
+    bad = rng.choice(len(rows), n_bad, replace=False)
+    rows[bad, rng.integers(0, 2, n_bad)] = rng.choice(bad_values, n_bad)
+    with open(dst, "w") as fobj:
+        fobj.writelines("{},{}\n".format(*row) for row in rows)
+
+
+def measure(func: Callable, *args, repeat: int = 3, **kwargs
+            ) -> Tuple[float, int, object]:
+    """Runs a function and returns its time, peak memory and output
+
+    The time is the minimum over repeat runs, since it is the least affected
+    by other load on the machine. The peak memory is measured with tracemalloc
+    in one more run, which is not timed because tracing slows it down. NumPy
+    and pandas report their array allocations to tracemalloc, so the peak
+    includes the data.
+
+    :param func: Function to measure
+    :type func: Callable
+    :param args: Positional arguments of func
+    :param repeat: Number of timed runs
+    :type repeat: int
+    :param kwargs: Keyword arguments of func
+    :return: Seconds, peak bytes allocated and the output of func
+    :rtype: Tuple[float, int, object]
+    """
+    best = np.inf
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        out = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - tic)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, out
+
+
+def run_stages(path: str, repeat: int = 3) -> Dict[str, dict]:
+    """Measures every stage of the pipeline on one csv file
+
+    Each stage is given the output of the previous one, as in
+    preprocess_data, which is also measured as a whole.
+
+    :param path: The csv file
+    :type path: str
+    :param repeat: Number of timed runs of each stage
+    :type repeat: int
+    :return: Stage names mapped to their 'seconds' and 'peak_bytes', plus the
+        number of 'rows' of the file
+    :rtype: Dict[str, dict]
+    """
+    from ecg_analysis import ecg_reader as erd
+    from ecg_analysis.calculations import get_metrics
+    results = {}
+    seconds, peak, raw = measure(erd.load_csv, path, repeat=repeat)
+    results["load_csv"] = {"seconds": seconds, "peak_bytes": peak}
+    seconds, peak, cleaned = measure(erd.clean_data, raw, repeat=repeat)
+    results["clean_data"] = {"seconds": seconds, "peak_bytes": peak}
+    seconds, peak, _ = measure(
+        erd.filter_data, cleaned["voltage"], cleaned["time"].iloc[0],
+        cleaned["time"].iloc[-1], 50, 1, repeat=repeat)
+    results["filter_data"] = {"seconds": seconds, "peak_bytes": peak}
+    seconds, peak, pre_data = measure(erd.preprocess_data, path,
+                                      repeat=repeat)
+    results["preprocess_data"] = {"seconds": seconds, "peak_bytes": peak}
+    seconds, peak, _ = measure(get_metrics, pre_data, repeat=repeat)
+    results["get_metrics"] = {"seconds": seconds, "peak_bytes": peak}
+    results["rows"] = len(raw)
+    return results
+
+
+def git_commit() -> str:
+    """The current git commit, with '+' appended if the tree has changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=root, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain",
+                                "--untracked-files=no"], cwd=root,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("+" if dirty else "")
+
+
+def benchmark(names: List[str], scales: List[int] = (1, 10, 100),
+              bad_fraction: float = 0.001, repeat: int = 3) -> dict:
+    """Measures the pipeline on test_data files at several lengths
+
+    :param names: test_data file names, with or without '.csv'
+    :type names: List[str]
+    :param scales: Length factors, 1 being the file itself
+    :type scales: List[int]
+    :param bad_fraction: Fraction of bad rows injected in scaled copies
+    :type bad_fraction: float
+    :param repeat: Number of timed runs of each stage
+    :type repeat: int
+    :return: A record with the 'commit', 'date', 'python', 'machine' and the
+        'results' of every '<name>x<scale>' dataset
+    :rtype: dict
+    """
+    import mne.filter  # imported by the first filter_data call otherwise
+    # the pipeline logs every removed row, which would dominate the timings
+    logging.disable(logging.ERROR)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp, \
+                warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            for name in names:
+                name = name[:-4] if name.endswith(".csv") else name
+                src = os.path.join(data_dir, name + ".csv")
+                for scale in scales:
+                    path = src
+                    if scale != 1:
+                        path = os.path.join(tmp, "{}x{}.csv".format(name,
+                                                                    scale))
+                        scale_csv(src, path, scale, bad_fraction)
+                    results["{}x{}".format(name, scale)] = run_stages(
+                        path, repeat)
+    finally:
+        logging.disable(logging.NOTSET)
+    return {"commit": git_commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(), "results": results}
+
+
+def save(record: dict, fname: str = results_file):
+    """Appends a benchmark record to a json lines file"""
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, "a") as fobj:
+        fobj.write(json.dumps(record) + "\n")
+
+
+def load(fname: str = results_file) -> List[dict]:
+    """Reads every benchmark record saved in a json lines file"""
+    if not os.path.isfile(fname):
+        return []
+    with open(fname) as fobj:
+        return [json.loads(line) for line in fobj if line.strip()]
+
+
+def report(record: dict, baseline: dict = None) -> List[str]:
+    """Formats a record as lines of text, optionally against a baseline
+
+    :param record: Output of benchmark
+    :type record: dict
+    :param baseline: An earlier record; the ratio of the times of every stage
+        to those of the baseline is then shown
+    :type baseline: dict
+    :return: The lines of the report
+    :rtype: List[str]
+    """
+    lines = ["commit {}{}".format(record["commit"], "" if baseline is None
+                                  else " vs " + baseline["commit"])]
+    for dataset, result in record["results"].items():
+        lines.append("{} ({} rows)".format(dataset, result["rows"]))
+        base = {} if baseline is None else \
+            baseline["results"].get(dataset, {})
+        for stage in stages:
+            row = result[stage]
+            line = "  {:<16}{:>10.1f} ms{:>10.1f} MB".format(
+                stage, row["seconds"] * 1000, row["peak_bytes"] / 2 ** 20)
+            if stage in base:
+                line += "{:>8.2f}x".format(row["seconds"] /
+                                           base[stage]["seconds"])
+            lines.append(line)
+    return lines
+
+
+def find(records: List[dict], commit: str) -> dict:
+    """The latest record of a commit, given as a hash prefix or a git ref"""
+    if not any(r["commit"].startswith(commit) for r in records):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", commit], cwd=root,
+                capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    for record in reversed(records):
+        if record["commit"].startswith(commit):
+            return record
+    raise KeyError("no results saved for commit {}".format(commit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", default=["test_data1"])
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--bad-fraction", type=float, default=0.001)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=results_file)
+    parser.add_argument("--compare", metavar="COMMIT",
+                        help="compare with the results saved for a commit")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        baseline = find(load(args.output), args.compare)
+    record = benchmark(args.names, args.scale, args.bad_fraction,
+                       args.repeat)
+    if not args.no_save:
+        save(record, args.output)
+    print("\n".join(report(record, baseline)))
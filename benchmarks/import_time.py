@@ -0,0 +1,107 @@
+"""Startup benchmark based on the interpreter's ``-X importtime`` output
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.import_time server GUI_client --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+heavy = ("mne", "neurokit2", "matplotlib", "pandas", "scipy", "flask")
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """Parses the stderr of ``python -X importtime`` into a dictionary
+
+    Each line of the importtime output has the form
+    ``import time: self [us] | cumulative | imported package``. This function
+    reads every line of that form and returns a dictionary mapping the fully
+    qualified module name to its self and cumulative import time in
+    microseconds. Any other lines (warnings, the header) are skipped.
+
+    :param stderr: The standard error text produced by ``-X importtime``
+    :type stderr: str
+    :return: Module names mapped to (self, cumulative) microseconds
+    :rtype: Dict[str, Tuple[int, int]]
+    """
+    times = dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def measure(module: str, repeat: int = 5) -> Dict[str, Tuple[int, int]]:
+    """Imports a module in a fresh interpreter and returns its import times
+
+    The module is imported ``repeat`` times, each in its own subprocess started
+    from the repository root with ``-X importtime``. The run with the lowest
+    cumulative time for the requested module is returned, since the minimum is
+    the least affected by other load on the machine.
+
+    :param module: Name of the module to import, e.g. 'server'
+    :type module: str
+    :param repeat: Number of fresh interpreters to time
+    :type repeat: int
+    :return: Module names mapped to (self, cumulative) microseconds
+    :rtype: Dict[str, Tuple[int, int]]
+    """
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import {}".format(module)],
+            cwd=root, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise ImportError("could not import {}:\n{}".format(
+                module, proc.stderr))
+        times = parse_importtime(proc.stderr)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    return best
+
+
+def report(module: str, times: Dict[str, Tuple[int, int]],
+           top: int = 10) -> List[str]:
+    """Formats the import times of a module as lines of text
+
+    The report includes the total cumulative import time of the module, which
+    of the known heavy dependencies were loaded, and the ``top`` modules with
+    the largest self time.
+
+    :param module: Name of the module that was imported
+    :type module: str
+    :param times: Output of measure for that module
+    :type times: Dict[str, Tuple[int, int]]
+    :param top: Number of slowest modules to list
+    :type top: int
+    :return: The lines of the report
+    :rtype: List[str]
+    """
+    lines = ["{}: {:.1f} ms".format(module, times[module][1] / 1000)]
+    loaded = [name for name in heavy if name in times]
+    lines.append("  heavy imports: {}".format(", ".join(loaded) or "none"))
+    slowest = sorted(times.items(), key=lambda item: item[1][0],
+                     reverse=True)[:top]
+    for name, (self_us, _) in slowest:
+        lines.append("  {:>9.1f} ms  {}".format(self_us / 1000, name))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*",
+                        default=["server", "GUI_client"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    for mod in args.modules:
+        print("\n".join(report(mod, measure(mod, args.repeat), args.top)))
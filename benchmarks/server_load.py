@@ -0,0 +1,360 @@
+"""Load test measuring the latency and throughput of server.py
+
+Starts ``server.app`` in a separate process behind the Flask development
+server or waitress (``pip install waitress``), seeded with a number of
+patients, and replays a random mix of ``/new_patient``, ``/get``,
+``/get/<mrn>`` and ``/get/<mrn>/image`` requests from concurrent clients.
+Run from the repository root, e.g.::
+
+    python -m benchmarks.server_load --patients 1000 10000 --server dev \
+waitress --concurrency 8 --requests 2000
+
+Latencies that grow with ``--patients`` point at request paths that scale
+with the size of the database.
+"""
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import requests
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+image_file = os.path.join(root, "tests", "b64.txt")
+servers = ("dev", "waitress")
+default_mix = {"new_patient": 2., "get_all": 0.05, "get": 5., "image": 2.}
+Result = Tuple[str, float, int]  # endpoint, seconds, status (0 if failed)
+
+
+def seed_database(db, n_patients: int, image: str,
+                  image_fraction: float = 0.5):
+    """Fills a server Database with patients in one pass
+
+    Database.add_entry searches the database and rebuilds every key attribute
+    on each call, so seeding 100k patients through it (or through
+    /new_patient) would take hours. This builds the same state directly: the
+    entries and the tuple attribute of every key. Patients are numbered from 1
+    to n_patients and the first image_fraction of them have an image.
+
+    :param db: The empty Database of the server
+    :type db: database.Database
+    :param n_patients: Number of patients to add
+    :type n_patients: int
+    :param image: b64 image string given to patients with an image
+    :type image: str
+    :param image_fraction: Fraction of the patients that have an image
+    :type image_fraction: float
+    """
+    n_images = int(n_patients * image_fraction)
+    stamp = time.strftime("%m-%d-%Y %H:%M:%S")
+    entries = [{"patient_id": mrn, "patient_name": "Patient {}".format(mrn),
+                "hr": 60. + mrn % 40, "time": stamp}
+               for mrn in range(1, n_patients + 1)]
+    for entry in entries[:n_images]:
+        entry["image"] = [image]
+    db.extend(entries)
+    for key in ("patient_id", "patient_name", "hr", "time", "image"):
+        vars(db)[key] = tuple(entry.get(key) for entry in db)
+
+
+def serve(server_name: str, port: int, n_patients: int, threads: int = 8):
+    """Seeds server.py and serves it until the process is killed
+
+    Prints a line with the seeding time once the database is filled, which
+    start_server waits for.
+
+    :param server_name: 'dev' for the Flask development server or 'waitress'
+    :type server_name: str
+    :param port: Port to listen on, on localhost
+    :type port: int
+    :param n_patients: Number of patients to seed the database with
+    :type n_patients: int
+    :param threads: Number of request threads of waitress
+    :type threads: int
+    """
+    import server
+    with open(image_file) as fobj:
+        image = fobj.read()
+    tic = time.perf_counter()
+    seed_database(server.db, n_patients, image)
+    server.revisions.update((mrn, 1) for mrn in range(1, n_patients + 1))
+    print("seeded {:.3f}".format(time.perf_counter() - tic), flush=True)
+    if server_name == "waitress":
+        import waitress
+        waitress.serve(server.app, host="127.0.0.1", port=port,
+                       threads=threads, _quiet=True)
+    else:
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        make_server("127.0.0.1", port, server.app,
+                    threaded=True).serve_forever()
+
+
+def free_port() -> int:
+    """Returns a port on localhost that is currently free"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server_name: str, n_patients: int, threads: int = 8,
+                 timeout: float = 600.) -> Tuple[subprocess.Popen, str, float]:
+    """Starts serve in a new process and waits until it answers
+
+    :param server_name: 'dev' or 'waitress'
+    :type server_name: str
+    :param n_patients: Number of patients to seed the database with
+    :type n_patients: int
+    :param threads: Number of request threads of waitress
+    :type threads: int
+    :param timeout: Seconds to wait for the server to be ready
+    :type timeout: float
+    :return: The server process, its base url and the seeding seconds
+    :rtype: Tuple[subprocess.Popen, str, float]
+    """
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.server_load", "--serve",
+         server_name, "--port", str(port), "--patients", str(n_patients),
+         "--threads", str(threads)],
+        cwd=root, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith("seeded"):
+        proc.kill()
+        raise RuntimeError("the {} server did not start".format(server_name))
+    url = "http://127.0.0.1:{}".format(port)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(url + "/", timeout=1.)
+            break
+        except requests.ConnectionError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError("the {} server did not answer".format(
+                    server_name))
+            time.sleep(0.05)
+    return proc, url, float(line.split()[1])
+
+
+def plan(n_requests: int, n_patients: int, mix: Dict[str, float],
+         image: str, seed: int = 0) -> List[Tuple[str, str, str, dict]]:
+    """Draws the requests of a load test
+
+    Reads go to random existing patients. Posts update an existing patient
+    nine times out of ten and add a new one otherwise, and a fifth of them
+    upload an image.
+
+    :param n_requests: Number of requests
+    :type n_requests: int
+    :param n_patients: Number of patients the database was seeded with
+    :type n_patients: int
+    :param mix: Relative frequency of each endpoint: 'new_patient',
+        'get_all' (/get), 'get' (/get/<mrn>) and 'image' (/get/<mrn>/image)
+    :type mix: Dict[str, float]
+    :param image: b64 image string uploaded by posts
+    :type image: str
+    :param seed: Seed of the random generator
+    :type seed: int
+    :return: (endpoint, method, path, json body) of every request
+    :rtype: List[Tuple[str, str, str, dict]]
+    """
+    rng = np.random.default_rng(seed)
+    names = list(mix)
+    weights = np.array([mix[name] for name in names], float)
+    kinds = rng.choice(len(names), n_requests, p=weights / weights.sum())
+    mrns = rng.integers(1, max(n_patients, 1) + 1, n_requests)
+    new_mrn = n_patients
+    out = []
+    for kind, mrn in zip(kinds, mrns.tolist()):
+        endpoint = names[kind]
+        if endpoint == "new_patient":
+            if rng.random() < 0.1:
+                new_mrn += 1
+                mrn = new_mrn
+            body = {"patient_id": mrn, "hr": float(rng.uniform(40, 180))}
+            if rng.random() < 0.2:
+                body["image"] = [image]
+            out.append((endpoint, "POST", "/new_patient", body))
+        elif endpoint == "get_all":
+            out.append((endpoint, "GET", "/get", None))
+        elif endpoint == "get":
+            out.append((endpoint, "GET", "/get/{}".format(mrn), None))
+        elif endpoint == "image":
+            out.append((endpoint, "GET", "/get/{}/image".format(mrn), None))
+        else:
+            raise ValueError("unknown endpoint {}".format(endpoint))
+    return out
+
+
+def run_load(url: str, requests_plan: List[Tuple[str, str, str, dict]],
+             concurrency: int = 8, timeout: float = 30.
+             ) -> Tuple[List[Result], float]:
+    """Sends the planned requests from concurrent clients
+
+    Every client thread keeps its own connection open. Requests that fail or
+    time out are recorded with a status of 0.
+
+    :param url: Base url of the server
+    :type url: str
+    :param requests_plan: Output of plan
+    :type requests_plan: List[Tuple[str, str, str, dict]]
+    :param concurrency: Number of requests in flight at the same time
+    :type concurrency: int
+    :param timeout: Seconds before a request counts as failed
+    :type timeout: float
+    :return: (endpoint, seconds, status) of every request and the wall time
+    :rtype: Tuple[List[Result], float]
+    """
+    local = threading.local()
+
+    def send(item):
+        endpoint, method, path, body = item
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        tic = time.perf_counter()
+        try:
+            r = local.session.request(method, url + path, json=body,
+                                      timeout=timeout)
+            status = r.status_code
+        except requests.RequestException:
+            status = 0
+        return endpoint, time.perf_counter() - tic, status
+
+    tic = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, requests_plan))
+    return results, time.perf_counter() - tic
+
+
+def summarize(results: List[Result], wall: float) -> Dict[str, dict]:
+    """Latency percentiles and throughput per endpoint and overall
+
+    Requests that failed or were answered with a status other than 200 or
+    405 are counted as errors and left out of the latencies. The image
+    endpoint answers 405 for the patients without an image, which is expected
+    and not an error.
+
+    :param results: Output of run_load
+    :type results: List[Result]
+    :param wall: Wall time of the whole load test in seconds
+    :type wall: float
+    :return: For each endpoint and 'all': n, errors, p50, p95 and p99 in ms
+        and rps (requests per second of wall time)
+    :rtype: Dict[str, dict]
+    """
+    groups = {}
+    for endpoint, seconds, status in results:
+        groups.setdefault(endpoint, []).append((seconds, status))
+    groups["all"] = [(seconds, status) for _, seconds, status in results]
+    summary = {}
+    for endpoint, items in groups.items():
+        ok = np.array([seconds for seconds, status in items
+                       if status in (200, 405)]) * 1000
+        p50, p95, p99 = np.percentile(ok, [50, 95, 99]) if ok.size \
+            else (np.nan,) * 3
+        summary[endpoint] = {"n": len(items), "errors": len(items) - ok.size,
+                             "p50": p50, "p95": p95, "p99": p99,
+                             "rps": len(items) / wall if wall else np.nan}
+    return summary
+
+
+def report(title: str, summary: Dict[str, dict]) -> List[str]:
+    """Formats a summary as lines of text
+
+    :param title: First line, e.g. the server and database size
+    :type title: str
+    :param summary: Output of summarize
+    :type summary: Dict[str, dict]
+    :return: The lines of the report
+    :rtype: List[str]
+    """
+    lines = [title, "  {:<12}{:>7}{:>7}{:>10}{:>10}{:>10}{:>9}".format(
+        "endpoint", "n", "errors", "p50 ms", "p95 ms", "p99 ms", "rps")]
+    for endpoint, row in summary.items():
+        lines.append(
+            "  {:<12}{:>7}{:>7}{:>10.1f}{:>10.1f}{:>10.1f}{:>9.1f}".format(
+                endpoint, row["n"], row["errors"], row["p50"], row["p95"],
+                row["p99"], row["rps"]))
+    return lines
+
+
+def benchmark(server_name: str, n_patients: int, n_requests: int = 2000,
+              concurrency: int = 8, mix: Dict[str, float] = None,
+              timeout: float = 30., seed: int = 0) -> Dict[str, dict]:
+    """Starts a seeded server, load tests it and stops it
+
+    :param server_name: 'dev' or 'waitress'
+    :type server_name: str
+    :param n_patients: Number of patients to seed the database with
+    :type n_patients: int
+    :param n_requests: Number of requests sent
+    :type n_requests: int
+    :param concurrency: Number of requests in flight at the same time
+    :type concurrency: int
+    :param mix: Relative frequency of each endpoint, see plan
+    :type mix: Dict[str, float]
+    :param timeout: Seconds before a request counts as failed
+    :type timeout: float
+    :param seed: Seed of the random requests
+    :type seed: int
+    :return: Output of summarize, plus the 'seed_seconds' of the database
+    :rtype: Dict[str, dict]
+    """
+    with open(image_file) as fobj:
+        image = fobj.read()
+    requests_plan = plan(n_requests, n_patients, mix or default_mix, image,
+                         seed)
+    proc, url, seeded = start_server(server_name, n_patients, concurrency)
+    try:
+        summary = summarize(*run_load(url, requests_plan, concurrency,
+                                      timeout))
+    finally:
+        proc.kill()
+        proc.wait()
+    summary["seed_seconds"] = seeded
+    return summary
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parses 'new_patient=2,get=5' into a dictionary of weights"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, nargs="+",
+                        default=[1000, 10000])
+    parser.add_argument("--server", nargs="+", choices=servers,
+                        default=["dev"])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", type=parse_mix, default=default_mix)
+    parser.add_argument("--timeout", type=float, default=30.)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--serve", choices=servers, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--threads", type=int, default=8,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.patients[0], args.threads)
+    for name in args.server:
+        for n in args.patients:
+            result = benchmark(name, n, args.requests, args.concurrency,
+                               args.mix, args.timeout, args.seed)
+            seeded = result.pop("seed_seconds")
+            print("\n".join(report(
+                "{} server, {} patients (seeded in {:.1f} s)".format(
+                    name, n, seeded), result)))
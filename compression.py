@@ -0,0 +1,225 @@
+import gzip
+import io
+import zlib
+from typing import Callable, Iterable, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+min_size = 1024  # responses smaller than this are not worth compressing
+max_body = 64 * 1024 * 1024  # largest decompressed request body accepted
+
+
+class DecompressionError(ValueError):
+    """Raised when a compressed body is corrupt or too large"""
+
+
+def supported_encodings() -> List[str]:
+    """Lists the content encodings available, in order of preference
+
+    zstd is preferred since it compresses faster and smaller than gzip, but it
+    is only available if the optional zstandard package is installed.
+
+    :return: The names of the supported encodings
+    :rtype: List[str]
+    """
+    if zstandard is not None:
+        return ["zstd", "gzip"]
+    return ["gzip"]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compresses bytes with the given content encoding
+
+    :param data: The bytes to compress
+    :type data: bytes
+    :param encoding: Either 'gzip' or 'zstd'
+    :type encoding: str
+    :return: The compressed bytes
+    :rtype: bytes
+    """
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    elif encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError("unsupported content encoding {}".format(encoding))
+
+
+def decompress(data: bytes, encoding: str, max_size: int = max_body) -> bytes:
+    """Decompresses bytes with the given content encoding and size limit
+
+    Decompression stops as soon as the output exceeds max_size, so a small
+    malicious body cannot expand into gigabytes of memory.
+
+    :param data: The compressed bytes
+    :type data: bytes
+    :param encoding: Either 'gzip' or 'zstd'
+    :type encoding: str
+    :param max_size: The maximum number of decompressed bytes allowed
+    :type max_size: int
+    :return: The decompressed bytes
+    :rtype: bytes
+    """
+    try:
+        if encoding == "gzip":
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            out = decoder.decompress(data, max_size + 1)
+            if len(out) <= max_size and not decoder.eof:
+                raise DecompressionError("truncated gzip body")
+        elif encoding == "zstd" and zstandard is not None:
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                io.BytesIO(data))
+            out = reader.read(max_size + 1)
+        else:
+            raise ValueError(
+                "unsupported content encoding {}".format(encoding))
+    except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as e:
+        raise DecompressionError("corrupt {} body: {}".format(encoding, e))
+    if len(out) > max_size:
+        raise DecompressionError(
+            "decompressed body is larger than {} bytes".format(max_size))
+    return out
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks the best supported encoding from an Accept-Encoding header
+
+    Parses the comma separated codings and their optional q-values, e.g.
+    'gzip;q=0.8, zstd', and returns the supported coding with the highest
+    q-value, breaking ties by the order of supported_encodings. Codings with a
+    q-value of 0 are refused and '*' matches any supported coding.
+
+    :param accept_encoding: The value of the Accept-Encoding header
+    :type accept_encoding: str
+    :return: The chosen encoding, or None if the client accepts none
+    :rtype: Optional[str]
+    """
+    weights = dict()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            weights[name.strip()] = q
+    best, best_q = None, 0.0
+    for coding in supported_encodings():
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress_response(response, accept_encoding: str,
+                      threshold: int = min_size):
+    """Compresses a Flask response body if the client accepts it
+
+    Responses smaller than threshold, streamed responses, responses that are
+    already encoded and responses without a body (e.g. 304) are returned as
+    they are. Compressed responses get the Content-Encoding header, and their
+    ETag is made weak since the bytes no longer match the uncompressed
+    representation. 'Vary: Accept-Encoding' is added so caches keep the
+    encodings apart.
+
+    :param response: The response returned by a route
+    :type response: flask.Response
+    :param accept_encoding: The value of the request Accept-Encoding header
+    :type accept_encoding: str
+    :param threshold: The minimum body size in bytes worth compressing
+    :type threshold: int
+    :return: The (possibly compressed) response
+    :rtype: flask.Response
+    """
+    if (response.direct_passthrough or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < threshold:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+class DecompressMiddleware:
+    """WSGI middleware that decompresses gzip and zstd request bodies
+
+    Wraps a WSGI application (e.g. app.wsgi_app) so that requests sent with a
+    'Content-Encoding: gzip' or 'Content-Encoding: zstd' header reach the
+    application with their body already decompressed, which lets the routes
+    keep using request.get_json unchanged. Corrupt or oversized bodies are
+    rejected with a 400 response, and unknown encodings with a 415 response.
+    """
+
+    def __init__(self, wsgi_app: Callable, max_size: int = max_body):
+        """Initializes the middleware around a WSGI application
+
+        :param wsgi_app: The WSGI application to wrap
+        :type wsgi_app: Callable
+        :param max_size: The maximum number of decompressed bytes allowed
+        :type max_size: int
+        """
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+
+    def __call__(self, environ: dict, start_response: Callable
+                 ) -> Iterable[bytes]:
+        """Decompresses the request body, if needed, and calls the app
+
+        :param environ: The WSGI environment of the request
+        :type environ: dict
+        :param start_response: The WSGI start_response callable
+        :type start_response: Callable
+        :return: The body of the response
+        :rtype: Iterable[bytes]
+        """
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding in ("", "identity"):
+            return self.wsgi_app(environ, start_response)
+        if encoding not in supported_encodings():
+            return self._error(start_response, "415 Unsupported Media Type",
+                               "unsupported content encoding {}".format(
+                                   encoding))
+        length = environ.get("CONTENT_LENGTH")
+        stream = environ["wsgi.input"]
+        body = stream.read(int(length)) if length else stream.read()
+        try:
+            body = decompress(body, encoding, self.max_size)
+        except DecompressionError as e:
+            return self._error(start_response, "400 Bad Request", str(e))
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        del environ["HTTP_CONTENT_ENCODING"]
+        return self.wsgi_app(environ, start_response)
+
+    @staticmethod
+    def _error(start_response: Callable, status: str, msg: str
+               ) -> List[bytes]:
+        """Sends a plain text error response
+
+        :param start_response: The WSGI start_response callable
+        :type start_response: Callable
+        :param status: The status line, e.g. '400 Bad Request'
+        :type status: str
+        :param msg: The error message sent as the body
+        :type msg: str
+        :return: The body of the response
+        :rtype: List[bytes]
+        """
+        body = msg.encode("utf-8")
+        start_response(status, [("Content-Type", "text/plain; charset=utf-8"),
+                                ("Content-Length", str(len(body)))])
+        return [body]
@@ -0,0 +1,410 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import requests
+
+
+class Outbox(object):
+    def __init__(self, path: str):
+        """A persistent sqlite table of alerts waiting to be delivered
+
+        Every alert is written to the outbox before any attempt is made to
+        deliver it, and is only marked as sent once the receiving server
+        answered. Alerts still pending when the server stops are therefore
+        delivered after the next start instead of being lost. An alert is
+        claimed (marked 'sending') before it is posted, so it is never
+        posted twice at once; alerts left 'sending' by a server that stopped
+        mid delivery are pending again once the outbox is reopened.
+
+        path: the sqlite database file (':memory:' for a temporary outbox)
+        """
+        super(Outbox, self).__init__()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, url TEXT, "
+                "body TEXT, is_json INTEGER, timeout REAL, "
+                "attempts INTEGER DEFAULT 0, status TEXT DEFAULT 'pending', "
+                "response TEXT, error TEXT, created REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS outbox_status "
+                             "ON outbox (status)")
+            self._db.execute("UPDATE outbox SET status = 'pending' "
+                             "WHERE status = 'sending'")
+
+    def put(self, kind: str, url: str, body, timeout: float) -> int:
+        """Stores a new pending alert and returns its id
+
+        kind: name of the alert type, used to find its handler
+        url: address the alert is posted to
+        body: dictionary (sent as json) or string (sent as data)
+        timeout: seconds to wait for the receiving server
+        """
+        is_json = not isinstance(body, (str, bytes))
+        if is_json:
+            body = json.dumps(body)
+        elif isinstance(body, bytes):
+            body = body.decode("utf-8")
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO outbox (kind, url, body, is_json, timeout, "
+                "created) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, url, body, int(is_json), timeout, time.time()))
+        return cur.lastrowid
+
+    def get(self, alert_id: int) -> Optional[dict]:
+        """Returns an alert as a dictionary, or None if it does not exist
+
+        alert_id: id returned by put
+        """
+        with self._lock:
+            cur = self._db.execute("SELECT * FROM outbox WHERE id = ?",
+                                   (alert_id,))
+            row = cur.fetchone()
+            names = [col[0] for col in cur.description]
+        if row is None:
+            return None
+        alert = dict(zip(names, row))
+        if alert["is_json"]:
+            alert["body"] = json.loads(alert["body"])
+        return alert
+
+    def pending(self) -> List[int]:
+        """Ids of every alert that still has to be delivered"""
+        return [alert_id for alert_id, _ in self.pending_kinds()]
+
+    def pending_kinds(self) -> List[Tuple[int, str]]:
+        """(id, kind) of every alert that still has to be delivered"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, kind FROM outbox WHERE status = 'pending' "
+                "ORDER BY id").fetchall()
+
+    def claim(self, alert_id: int) -> bool:
+        """Marks a pending alert as being delivered
+
+        alert_id: id of the alert
+
+        returns: whether the alert was pending, i.e. whether the caller
+        now has to deliver it
+        """
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "UPDATE outbox SET status = 'sending' "
+                "WHERE id = ? AND status = 'pending'", (alert_id,))
+        return cur.rowcount == 1
+
+    def mark_sent(self, alert_id: int, response: str):
+        """Marks an alert as delivered and stores the response text"""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET status = 'sent', response = ?, "
+                "attempts = attempts + 1 WHERE id = ?", (response, alert_id))
+
+    def mark_failed(self, alert_id: int, error: str, dead: bool = False):
+        """Records a failed delivery attempt
+
+        alert_id: id of the alert
+        error: description of the failure
+        dead: whether the alert should not be attempted again
+        """
+        status = "dead" if dead else "pending"
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET status = ?, error = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (status, error, alert_id))
+
+    def close(self):
+        """Closes the database connection"""
+        with self._lock:
+            self._db.close()
+
+
+class AlertDispatcher(object):
+    def __init__(self, outbox: Outbox, workers: int = 4,
+                 max_attempts: int = 5, backoff: float = 1.):
+        """Delivers alerts in background threads with retries
+
+        send() only stores the alert in the outbox and queues it, so the
+        request that raised the alert returns right away. Worker threads
+        post the alerts concurrently. Each kind of alert has its own queue
+        and workers, so slow alerts (e.g. nurse alerts waiting for an
+        answer) never hold up the others. Connection errors, timeouts and 5xx
+        responses are retried after backoff * 2 ** (attempt - 1) seconds,
+        up to max_attempts times. 4xx responses are not retried. Once an
+        alert is delivered, the handler registered for its kind is called
+        with the alert and the response text.
+
+        outbox: where alerts are persisted until delivered
+        workers: number of alerts of each kind delivered at the same time
+        max_attempts: number of attempts before an alert is given up on
+        backoff: seconds before the first retry
+        """
+        super(AlertDispatcher, self).__init__()
+        self.outbox = outbox
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.handlers: Dict[str, Callable[[dict, str], None]] = {}
+        self.session = requests.Session()
+        self._queues: Dict[str, queue.Queue] = {}
+        self._threads: List[threading.Thread] = []
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Queues the undelivered alerts left in the outbox"""
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        """Queues the undelivered alerts, called with the lock held"""
+        if self._started:
+            return
+        self._started = True
+        for alert_id, kind in self.outbox.pending_kinds():
+            self._enqueue(kind, alert_id)
+
+    def _enqueue(self, kind: str, alert_id: int):
+        """Queues an alert, starting the workers of its kind if needed
+
+        Called with the lock held.
+        """
+        if kind not in self._queues:
+            self._queues[kind] = queue.Queue()
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          args=(self._queues[kind],),
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._queues[kind].put(alert_id)
+
+    def _requeue(self, kind: str, alert_id: int):
+        """Queues an alert again once its retry delay has passed"""
+        with self._lock:
+            if self._started:
+                self._enqueue(kind, alert_id)
+
+    def send(self, kind: str, url: str, body, timeout: float = 10.) -> int:
+        """Persists an alert and queues it for delivery
+
+        kind: name of the alert type, used to find its handler
+        url: address the alert is posted to
+        body: dictionary (sent as json) or string (sent as data)
+        timeout: seconds to wait for the receiving server
+
+        returns: the id of the alert in the outbox
+        """
+        alert_id = self.outbox.put(kind, url, body, timeout)
+        with self._lock:
+            if self._started:
+                self._enqueue(kind, alert_id)
+            else:
+                self._start()  # also queues the new alert
+        return alert_id
+
+    def _work(self, alerts: queue.Queue):
+        """Worker thread loop delivering the alerts of a queue"""
+        while True:
+            alert_id = alerts.get()
+            if alert_id is None:
+                alerts.task_done()
+                break
+            try:
+                self._deliver(alert_id)
+            except Exception:
+                logging.exception("Alert {} could not be delivered".format(
+                    alert_id))
+            finally:
+                alerts.task_done()
+
+    def _deliver(self, alert_id: int):
+        """Posts one alert and records the outcome in the outbox"""
+        if not self.outbox.claim(alert_id):
+            return  # delivered, given up on or being delivered already
+        alert = self.outbox.get(alert_id)
+        kwargs = {"json" if alert["is_json"] else "data": alert["body"]}
+        try:
+            r = self.session.post(alert["url"], timeout=alert["timeout"],
+                                  **kwargs)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            response = getattr(e, "response", None)
+            attempts = alert["attempts"] + 1
+            dead = attempts >= self.max_attempts or (
+                response is not None and 400 <= response.status_code < 500)
+            self.outbox.mark_failed(alert_id, str(e), dead)
+            if dead:
+                logging.error("Giving up on {} alert {} to {}: {}".format(
+                    alert["kind"], alert_id, alert["url"], e))
+            else:
+                timer = threading.Timer(
+                    self.backoff * 2 ** (attempts - 1), self._requeue,
+                    [alert["kind"], alert_id])
+                timer.daemon = True
+                timer.start()
+            return
+        self.outbox.mark_sent(alert_id, r.text)
+        if alert["kind"] in self.handlers:
+            self.handlers[alert["kind"]](alert, r.text)
+
+    def flush(self, timeout: float = 10.) -> bool:
+        """Waits until no alert is pending, for tests and shutdown
+
+        timeout: maximum seconds to wait
+
+        returns: whether every alert was delivered or given up on
+        """
+        end = time.time() + timeout
+        while time.time() < end:
+            with self._lock:
+                queued = sum(alerts.unfinished_tasks
+                             for alerts in self._queues.values())
+            if not queued and not self.outbox.pending():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stop(self):
+        """Stops the worker threads after their current alert"""
+        with self._lock:
+            for alerts in self._queues.values():
+                for _ in range(self.workers):
+                    alerts.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._queues, self._threads = {}, []
+            self._started = False
+
+
+class AlertAggregator(object):
+    def __init__(self, dispatcher: AlertDispatcher, window: float = 60.):
+        """Coalesces bursts of alerts before handing them to a dispatcher
+
+        Alerts are grouped by (kind, url, group), where group is e.g. the
+        patient for nurse alerts or the recipient and patient for emails,
+        so an alert about one patient never waits for another's. The first
+        alert of a group is sent right away and opens a window of 'window'
+        seconds. Alerts of the same group arriving during the window are
+        collected, identical ones being dropped, and sent together as a
+        single batch when the window closes, after which a new window opens
+        if anything was sent. A seizure cluster therefore costs at most one
+        alert per group per window instead of one per recording.
+
+        The body of a batch is built by the formatter registered for its
+        kind, which is called with the list of collected alerts. Without a
+        formatter a single alert is sent as is and a batch as a list.
+
+        dispatcher: delivers the alerts that are not suppressed
+        window: seconds during which alerts of a group are coalesced
+        """
+        super(AlertAggregator, self).__init__()
+        self.dispatcher = dispatcher
+        self.window = window
+        self.formatters: Dict[str, Callable[[list], object]] = {}
+        self.counts = {"events": 0, "sent": 0, "duplicates": 0,
+                       "coalesced": 0}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, url: str, group: Hashable, alert,
+            timeout: float = 10.) -> Optional[int]:
+        """Sends an alert now, or collects it into the open window
+
+        kind: name of the alert type, see AlertDispatcher.send
+        url: address the alert is posted to
+        group: alerts of the same kind, url and group are coalesced; any
+        hashable value, e.g. a (recipient, patient) tuple
+        alert: json serializable content of the alert
+        timeout: seconds to wait for the receiving server
+
+        returns: the outbox id if the alert was sent right away
+        """
+        key = (kind, url, group)
+        fingerprint = json.dumps(alert, sort_keys=True)
+        with self._lock:
+            self.counts["events"] += 1
+            window = self._windows.get(key)
+            if window is not None:
+                if fingerprint in window["seen"]:
+                    self.counts["duplicates"] += 1
+                else:
+                    window["seen"].add(fingerprint)
+                    window["alerts"].append(alert)
+                return None
+            self._windows[key] = {"alerts": [], "seen": {fingerprint},
+                                  "timeout": timeout,
+                                  "timer": self._start_timer(key)}
+        return self._send(key, [alert], timeout)
+
+    def _start_timer(self, key: tuple) -> threading.Timer:
+        """Closes the window of key once it has been open for self.window"""
+        timer = threading.Timer(self.window, self._close, [key])
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _close(self, key: tuple, reopen: bool = True):
+        """Sends the alerts collected in a window as one batch
+
+        key: (kind, url, group) of the window
+        reopen: whether a new window opens if a batch was sent
+        """
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                return
+            alerts = window["alerts"]
+            if alerts and reopen:
+                window["alerts"], window["seen"] = [], set()
+                window["timer"] = self._start_timer(key)
+            else:
+                del self._windows[key]
+        if alerts:
+            self._send(key, alerts, window["timeout"])
+
+    def _send(self, key: tuple, alerts: list, timeout: float) -> int:
+        """Formats a batch of alerts and hands it to the dispatcher"""
+        kind, url, _ = key
+        if kind in self.formatters:
+            body = self.formatters[kind](alerts)
+        else:
+            body = alerts[0] if len(alerts) == 1 else alerts
+        with self._lock:
+            self.counts["sent"] += 1
+            self.counts["coalesced"] += len(alerts) - 1
+        return self.dispatcher.send(kind, url, body, timeout)
+
+    def flush(self):
+        """Sends every collected alert now and closes all windows"""
+        with self._lock:
+            keys = list(self._windows)
+        for key in keys:
+            window = self._windows.get(key)
+            if window is not None:
+                window["timer"].cancel()
+            self._close(key, reopen=False)
+
+    def stats(self) -> dict:
+        """Counts of received, sent and suppressed alerts
+
+        events: alerts received by add
+        sent: alerts and batches handed to the dispatcher
+        duplicates: alerts dropped for repeating one in the same window
+        coalesced: alerts merged into a batch with another alert
+        suppressed: duplicates + coalesced, i.e. events - sent
+        open_windows: groups currently coalescing alerts
+        """
+        with self._lock:
+            stats = dict(self.counts)
+            stats["open_windows"] = len(self._windows)
+        stats["suppressed"] = stats["duplicates"] + stats["coalesced"]
+        return stats
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import List, Optional
+
+default_chunk_size = 8 * 1024 * 1024
+max_chunk_size = 64 * 1024 * 1024
+data_name = "upload_ieeg.fif"  # MNE expects fif files to end in _ieeg.fif
+default_ttl = 24 * 3600.  # seconds an idle upload is kept
+
+
+class UploadError(ValueError):
+    def __init__(self, msg: str, status: int = 400):
+        """An invalid request to ChunkedUploads
+
+        msg: description of the problem, returned to the client
+        status: http status code of the response
+        """
+        super(UploadError, self).__init__(msg)
+        self.status = status
+
+
+def sha256(data: bytes) -> str:
+    """Hex sha256 digest of bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path: str, block: int = default_chunk_size) -> str:
+    """Hex sha256 digest of a file, read block bytes at a time"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fobj:
+        for data in iter(lambda: fobj.read(block), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class ChunkedUploads(object):
+    def __init__(self, directory: str, max_size: int = None,
+                 ttl: float = default_ttl):
+        """Uploads received as checksummed chunks, in any order
+
+        Every upload gets a folder in 'directory' holding its session
+        (size, checksum and chunk size), the data file, preallocated to
+        its final size, and one marker file per chunk received. Chunks are
+        written straight to their offset in the data file, so an upload
+        never has to be held in memory, and since everything lives on
+        disk an interrupted upload can be resumed by sending the missing
+        chunks, even after a server restart.
+
+        Uploads nobody sent a chunk to for 'ttl' seconds are deleted when
+        a new upload is created, since each one holds a preallocated file.
+        A finished upload keeps its session and result (see finish) for
+        as long, so a client that retries completing it gets the same
+        answer. Completing is claimed with an exclusively created marker
+        file (see claim), so a retry sent while the first request is
+        still verifying the upload cannot complete it a second time, even
+        from another server process.
+
+        directory: folder the uploads are written to
+        max_size: largest upload accepted, in bytes
+        ttl: seconds an idle or finished upload is kept
+        """
+        super(ChunkedUploads, self).__init__()
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+
+    def _folder(self, upload_id: str) -> str:
+        """Folder of an existing upload, checking the id"""
+        if not re.fullmatch("[0-9a-f]{32}", upload_id):
+            raise UploadError("Invalid upload id {}".format(upload_id))
+        folder = os.path.join(self.directory, upload_id)
+        if not os.path.isfile(os.path.join(folder, "session.json")):
+            raise UploadError("Upload {} not found".format(upload_id), 404)
+        return folder
+
+    def create(self, size: int, checksum: str,
+               chunk_size: int = default_chunk_size) -> dict:
+        """Starts a new upload and returns its session
+
+        size: bytes of the whole file
+        checksum: hex sha256 digest of the whole file
+        chunk_size: bytes of every chunk but the last one
+        """
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("size must be a positive integer")
+        if self.max_size is not None and size > self.max_size:
+            raise UploadError("Upload is larger than {} bytes".format(
+                self.max_size), 413)
+        if not isinstance(chunk_size, int) or \
+                not 0 < chunk_size <= max_chunk_size:
+            raise UploadError("chunk_size must be between 1 and {}".format(
+                max_chunk_size))
+        if not isinstance(checksum, str) or \
+                not re.fullmatch("[0-9a-f]{64}", checksum):
+            raise UploadError("sha256 must be a hex sha256 digest")
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        folder = os.path.join(self.directory, upload_id)
+        os.makedirs(os.path.join(folder, "received"))
+        with open(os.path.join(folder, data_name), "wb") as fobj:
+            fobj.truncate(size)
+        session = {"upload_id": upload_id, "size": size, "sha256": checksum,
+                   "chunk_size": chunk_size,
+                   "n_chunks": -(-size // chunk_size)}
+        with open(os.path.join(folder, "session.json"), "w") as fobj:
+            json.dump(session, fobj)
+        return session
+
+    def session(self, upload_id: str) -> dict:
+        """The session of an upload with its received and missing chunks
+
+        Besides the fields given by create, "completing" tells whether a
+        request is completing the upload and "completed" whether it is
+        done.
+        """
+        folder = self._folder(upload_id)
+        with open(os.path.join(folder, "session.json")) as fobj:
+            session = json.load(fobj)
+        session["completing"] = os.path.isfile(os.path.join(folder,
+                                                            "completing"))
+        session["completed"] = os.path.isfile(os.path.join(folder,
+                                                           "result.json"))
+        if session["completed"]:
+            session["received"] = list(range(session["n_chunks"]))
+            session["missing"] = []
+            return session
+        received = sorted(int(name) for name in
+                          os.listdir(os.path.join(folder, "received")))
+        session["received"] = received
+        session["missing"] = sorted(set(range(session["n_chunks"])) -
+                                    set(received))
+        return session
+
+    def missing(self, upload_id: str) -> List[int]:
+        """Indices of the chunks of an upload not received yet"""
+        return self.session(upload_id)["missing"]
+
+    def put(self, upload_id: str, index: int, data: bytes, checksum: str):
+        """Verifies a chunk and writes it at its offset in the data file
+
+        Sending a chunk again overwrites it, so retrying is always safe.
+
+        upload_id: id returned by create
+        index: position of the chunk, starting from 0
+        data: bytes of the chunk
+        checksum: hex sha256 digest of data
+        """
+        session = self.session(upload_id)
+        if session["completed"] or session["completing"]:
+            raise UploadError("Upload {} is already being completed".format(
+                upload_id), 409)
+        if not 0 <= index < session["n_chunks"]:
+            raise UploadError("Chunk {} is out of range".format(index))
+        offset = index * session["chunk_size"]
+        expected = min(session["chunk_size"], session["size"] - offset)
+        if len(data) != expected:
+            raise UploadError("Chunk {} should be {} bytes, not {}".format(
+                index, expected, len(data)))
+        if sha256(data) != checksum:
+            raise UploadError("Checksum of chunk {} does not match".format(
+                index), 422)
+        folder = self._folder(upload_id)
+        with open(os.path.join(folder, data_name), "r+b") as fobj:
+            fobj.seek(offset)
+            fobj.write(data)
+            fobj.flush()
+            os.fsync(fobj.fileno())
+        open(os.path.join(folder, "received", str(index)), "w").close()
+        os.utime(os.path.join(folder, "session.json"))  # see expire
+
+    def claim(self, upload_id: str) -> bool:
+        """Marks an upload as being completed, unless it already is
+
+        The marker is created with O_EXCL, so of concurrent claims only
+        one succeeds. It stays after finish and goes with the upload on
+        discard; release it to let the upload be completed again.
+
+        upload_id: id returned by create
+
+        returns: whether this call claimed the upload
+        """
+        folder = self._folder(upload_id)
+        try:
+            os.close(os.open(os.path.join(folder, "completing"),
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        os.utime(os.path.join(folder, "session.json"))
+        return True
+
+    def release(self, upload_id: str):
+        """Undoes claim, e.g. when the upload turned out to be incomplete"""
+        try:
+            os.remove(os.path.join(self._folder(upload_id), "completing"))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, upload_id: str) -> str:
+        """Checks that an upload is whole and returns its data file
+
+        Call it once claim succeeded.
+
+        upload_id: id returned by create
+        """
+        session = self.session(upload_id)
+        if session["completed"]:
+            raise UploadError("Upload {} is already complete".format(
+                upload_id), 409)
+        if session["missing"]:
+            raise UploadError("Upload {} is missing {} chunks".format(
+                upload_id, len(session["missing"])), 409)
+        path = os.path.join(self._folder(upload_id), data_name)
+        if file_sha256(path) != session["sha256"]:
+            raise UploadError("Checksum of upload {} does not match".format(
+                upload_id), 422)
+        return path
+
+    def finish(self, upload_id: str, result: dict):
+        """Deletes the data of a completed upload, keeping its result
+
+        upload_id: id returned by create
+        result: json serializable answer to the completed upload,
+        returned by completed until the upload expires
+        """
+        folder = self._folder(upload_id)
+        with open(os.path.join(folder, "result.json.tmp"), "w") as fobj:
+            json.dump(result, fobj)
+        os.replace(os.path.join(folder, "result.json.tmp"),
+                   os.path.join(folder, "result.json"))
+        os.utime(os.path.join(folder, "session.json"))
+        try:
+            os.remove(os.path.join(folder, data_name))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(os.path.join(folder, "received"), ignore_errors=True)
+
+    def completed(self, upload_id: str) -> Optional[dict]:
+        """The result given to finish, or None if the upload is not done"""
+        path = os.path.join(self._folder(upload_id), "result.json")
+        if not os.path.isfile(path):
+            return None
+        with open(path) as fobj:
+            return json.load(fobj)
+
+    def discard(self, upload_id: str):
+        """Deletes an upload and its data file"""
+        shutil.rmtree(self._folder(upload_id))
+
+    def expire(self):
+        """Deletes the uploads that were idle or finished for over ttl
+
+        An upload is idle since its session was last touched, i.e. since
+        it was created, one of its chunks was received or it finished.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        oldest = time.time() - self.ttl
+        for upload_id in os.listdir(self.directory):
+            if not re.fullmatch("[0-9a-f]{32}", upload_id):
+                continue
+            folder = os.path.join(self.directory, upload_id)
+            try:
+                touched = os.path.getmtime(os.path.join(folder,
+                                                        "session.json"))
+            except OSError:  # create was interrupted
+                touched = os.path.getmtime(folder)
+            if touched < oldest:
+                shutil.rmtree(folder, ignore_errors=True)
@@ -1,9 +1,16 @@
 import os
-from typing import Dict, TypeVar, List
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    as_completed
+from typing import Dict, Iterator, TypeVar, List, Tuple
 import mne
 from mne.io.fiff.raw import read_raw_fif
 import requests
-import defaults
+from dev import defaults, transport
+from dev.chunked_upload import default_chunk_size, file_sha256, sha256
+from dev.layout_cache import cached_layout
 from bids import BIDSLayout
 from bids.layout import BIDSFile
 from mne_bids import BIDSPath, read_raw_bids
@@ -25,27 +32,46 @@ def download_data(dataset: str, subjects: List[str],
             bids_root = os.path.join(Path.home(), "bids")
     download(dataset=dataset, target_dir=bids_root,
              include=[f'sub-{subject}' for subject in subjects])
-    layout = BIDSLayout(root=bids_root)
+    layout = cached_layout(bids_root)
     return layout
 
 
-def bids_to_raw(bids_file: BIDSFile) -> mne.io.BaseRaw:
+def bids_to_raw(bids_file: BIDSFile, preload: bool = True
+                ) -> mne.io.BaseRaw:
     entities = bids_file.get_entities()
     root = bids_file.path.split("sub-" + entities["subject"])[0]
+    return entities_to_raw(root, entities, preload)
+
+
+def entities_to_raw(root: PathLike, entities: dict, preload: bool = True
+                    ) -> mne.io.BaseRaw:
+    """Reads the recording of a BIDS dataset matching some entities
+
+    Unlike BIDSFile objects, which hold on to their whole layout, the
+    root and entities are cheap to send to another process.
+
+    root: root folder of the BIDS dataset
+    entities: entities of the recording, e.g. from BIDSFile.get_entities
+    preload: whether the data is loaded, or only read when needed
+    """
     bids_path = BIDSPath(root=root, **entities)
-    raw = read_raw_bids(bids_path=bids_path)
-    raw.load_data()
+    raw = read_raw_bids(bids_path=bids_path, verbose=False)
+    if preload:
+        raw.load_data()
     return raw
 
 
-def layout_to_raw_dict(layout: BIDSLayout, **kwargs) -> \
-        Dict[str, Dict[int, mne.io.BaseRaw]]:
+def layout_recordings(layout: BIDSLayout, **kwargs) -> \
+        List[Tuple[str, int, BIDSFile]]:
+    """Lists the (subject, run, BIDSFile) of every recording in a layout
+
+    kwargs: search terms, see defaults.layout
+    """
     kwargs = defaults.layout(kwargs)
     sub_ids = layout.get_subjects()
     runs = layout.get_runs()
-    data = {}
+    recordings = []
     for sub_id in sub_ids:
-        data[sub_id] = {}
         if len(runs) == 0:
             runs = [1]
         for run in runs:
@@ -55,23 +81,231 @@ def layout_to_raw_dict(layout: BIDSLayout, **kwargs) -> \
             if len(BIDSFiles) != 1:
                 raise IndexError("only one run and session can match search"
                                  " terms")
-            raw = bids_to_raw(BIDSFiles[0])
-            data[sub_id][run] = raw
+            recordings.append((sub_id, run, BIDSFiles[0]))
+    return recordings
+
+
+def iter_layout_raws(layout: BIDSLayout, max_workers: int = None,
+                     preload: bool = False, **kwargs) -> \
+        Iterator[Tuple[str, int, mne.io.BaseRaw]]:
+    """Reads the recordings of a layout in parallel, as they are ready
+
+    Every recording is parsed in a process pool and yielded as
+    (subject, run, raw) as soon as it is read, in whichever order they
+    finish. By default the data is not loaded: the raw objects sent back
+    from the workers only hold the file names and headers, and the data
+    is read when it is needed, e.g. by raw.save in send_raw.
+
+    layout: the BIDS layout to read
+    max_workers: number of processes, the number of cpus by default
+    preload: whether the workers load the data
+    kwargs: search terms, see defaults.layout
+    """
+    recordings = layout_recordings(layout, **kwargs)
+    root = layout.root
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(entities_to_raw, root,
+                               bids_file.get_entities(), preload):
+                   (sub_id, run) for sub_id, run, bids_file in recordings}
+        for future in as_completed(futures):
+            sub_id, run = futures[future]
+            yield sub_id, run, future.result()
+
+
+def layout_to_raw_dict(layout: BIDSLayout, max_workers: int = None,
+                       **kwargs) -> Dict[str, Dict[int, mne.io.BaseRaw]]:
+    data = {sub_id: {} for sub_id in layout.get_subjects()}
+    for sub_id, run, raw in iter_layout_raws(layout, max_workers, True,
+                                             **kwargs):
+        data[sub_id][run] = raw
+    for sub_id in data:  # keep the runs in order
+        data[sub_id] = dict(sorted(data[sub_id].items()))
     return data
 
 
 def send_raw(raw_obj: mne.io.BaseRaw, serv_address: str) -> str:
     # filename = r"{}".format(
     #    os.path.splitext(os.path.basename(raw_obj.filenames[0]))[0] + ".fif")
+    folder = tempfile.mkdtemp()  # unique, so uploads can run concurrently
     filename = 'raw_ieeg.fif'
-    raw_obj.save(filename, overwrite=True)
-    with open(r'raw_ieeg.fif', 'rb') as filedata:
-        r = requests.post(serv_address, files={filename: filedata})
+    try:
+        raw_obj.save(os.path.join(folder, filename), overwrite=True)
+        with open(os.path.join(folder, filename), 'rb') as filedata:
+            r = requests.post(serv_address, files={filename: filedata})
+    finally:
+        shutil.rmtree(folder)
+    return r.text
+
+
+def send_raw_binary(raw_obj: mne.io.BaseRaw, serv_address: str,
+                    dtype: str = "float32", compression: str = None) -> str:
+    """Sends a raw object in the compact binary transport format
+
+    Instead of saving a fif file and uploading it, the samples are packed
+    in memory by transport.encode and posted to /database/binary, which
+    decodes them without MNE's file reader. int16 and compression shrink
+    the upload further, see transport.encode.
 
-    os.remove(filename)
+    raw_obj: the raw object to send
+    serv_address: address of the server, e.g. server + "5000"
+    dtype: "float32" or "int16"
+    compression: None, "gzip" or "zstd"
+
+    returns: the text of the server response
+    """
+    r = requests.post(serv_address + "/database/binary",
+                      data=transport.encode(raw_obj, dtype, compression),
+                      headers={"Content-Type": transport.content_type})
     return r.text
 
 
+def send_layout(layout: BIDSLayout, serv_address: str,
+                max_workers: int = None, upload_workers: int = 2,
+                chunked: bool = False, **kwargs) -> \
+        Dict[str, Dict[int, str]]:
+    """Reads and sends every recording of a layout, overlapping the two
+
+    Recordings are read lazily by iter_layout_raws and each one is handed
+    to a thread pool sending it as soon as it is ready, so parsing the
+    next recordings, reading the data from disk and sending it over the
+    network all happen at the same time.
+
+    layout: the BIDS layout to send
+    serv_address: with chunked, the server address, e.g. server + "5000",
+    otherwise the /database url
+    max_workers: number of processes reading recordings
+    upload_workers: number of recordings sent at the same time
+    chunked: whether to send with send_raw_chunked instead of send_raw
+    kwargs: search terms, see defaults.layout
+
+    returns: {subject: {run: server response}}
+    """
+    send = send_raw_chunked if chunked else send_raw
+    answers = {}
+    with ThreadPoolExecutor(max_workers=upload_workers) as uploads:
+        futures = {}
+        for sub_id, run, raw in iter_layout_raws(layout, max_workers,
+                                                 **kwargs):
+            futures[uploads.submit(send, raw, serv_address)] = (sub_id, run)
+        for future in as_completed(futures):
+            sub_id, run = futures[future]
+            answers.setdefault(sub_id, {})[run] = future.result()
+    return answers
+
+
+class UploadInterrupted(IOError):
+    def __init__(self, msg: str, upload_id: str):
+        """A chunked upload that gave up, and can be resumed
+
+        upload_id: pass to send_file_chunked to send only what is missing
+        """
+        super(UploadInterrupted, self).__init__(msg)
+        self.upload_id = upload_id
+
+
+def send_file_chunked(path: PathLike, serv_address: str,
+                      chunk_size: int = default_chunk_size,
+                      upload_id: str = None, retries: int = 5,
+                      backoff: float = 1., poll: float = 1.,
+                      session: requests.Session = None) -> str:
+    """Sends a fif file to the server in checksummed chunks
+
+    The file is read and sent chunk_size bytes at a time, so it never has
+    to fit in memory. Each chunk carries its sha256 digest and is retried
+    with exponential backoff when the connection fails, times out or the
+    server reports a corrupted chunk. If a chunk still fails, the
+    UploadInterrupted raised holds the upload id: calling this function
+    again with it asks the server which chunks are missing and only sends
+    those, even after the server or the client restarted. Completing a
+    large upload can outlast the read timeout; the retried request is
+    then told the upload is still being completed (202), and the session
+    is polled until it is done rather than completing it again.
+
+    path: the fif file to send
+    serv_address: address of the server, e.g. server + "5000"
+    chunk_size: bytes sent per request
+    upload_id: id of an interrupted upload of the same file to resume
+    retries: attempts per request before giving up
+    backoff: seconds before the first retry, doubled after each one
+    poll: seconds between checks of an upload being completed
+    session: requests session to send with, a new one by default
+
+    returns: the text of the server response once the upload is complete
+    """
+    if session is None:
+        session = requests.Session()
+    size = os.path.getsize(path)
+
+    def call(method, url, **kwargs):
+        for attempt in range(retries):
+            try:
+                r = session.request(method, url, timeout=(3.05, 60),
+                                    **kwargs)
+                if r.status_code != 422 and r.status_code < 500:
+                    return r
+                error = r.text
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < retries - 1:
+                time.sleep(backoff * 2 ** attempt)
+        raise UploadInterrupted("{} {} failed: {}".format(
+            method, url, error), upload_id)
+
+    if upload_id is None:
+        r = call("POST", serv_address + "/upload", json={
+            "size": size, "sha256": file_sha256(path),
+            "chunk_size": chunk_size})
+        r.raise_for_status()
+        upload_id = r.json()["upload_id"]
+    r = call("GET", "{}/upload/{}".format(serv_address, upload_id))
+    r.raise_for_status()
+    info = r.json()
+    with open(path, "rb") as fobj:
+        for index in info["missing"]:
+            fobj.seek(index * info["chunk_size"])
+            data = fobj.read(info["chunk_size"])
+            r = call("PUT", "{}/upload/{}/{}".format(
+                serv_address, upload_id, index), data=data,
+                headers={"X-Chunk-Sha256": sha256(data)})
+            r.raise_for_status()
+    url = "{}/upload/{}".format(serv_address, upload_id)
+    r = call("POST", url + "/complete")
+    while r.status_code == 202:  # an earlier attempt is still completing
+        time.sleep(poll)
+        info = call("GET", url)
+        if info.status_code == 200 and info.json()["completing"] and \
+                not info.json()["completed"]:
+            continue
+        r = call("POST", url + "/complete")  # the stored answer or error
+    r.raise_for_status()
+    return r.text
+
+
+def send_raw_chunked(raw_obj: mne.io.BaseRaw, serv_address: str,
+                     **kwargs) -> str:
+    """Saves a raw object to a temporary fif file and sends it in chunks
+
+    MNE writes fif files by seeking back to fill in the file directory,
+    so raw.save needs a real file and cannot write into a request. The
+    file is saved in a unique temporary folder and deleted once sent;
+    files already on disk can be sent without a copy with
+    send_file_chunked.
+
+    raw_obj: the raw object to send
+    serv_address: address of the server, e.g. server + "5000"
+    kwargs: passed on to send_file_chunked
+
+    returns: the text of the server response once the upload is complete
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(folder, "raw_ieeg.fif")
+        raw_obj.save(filename, overwrite=True)
+        return send_file_chunked(filename, serv_address, **kwargs)
+    finally:
+        shutil.rmtree(folder)
+
+
 if __name__ == "__main__":
     misc_path = mne.datasets.misc.data_path()
     raw = mne.io.read_raw(os.path.join(
@@ -0,0 +1,132 @@
+import re
+from typing import Optional, Sequence
+
+import mne
+import numpy as np
+from mne.transforms import apply_trans
+from scipy.spatial import cKDTree
+
+
+def contact_positions(info: mne.Info, head_mri_t: np.ndarray) -> np.ndarray:
+    """Positions of every channel in surface RAS, in one transform
+
+    info: measurement info whose channel locations are in head coordinates
+    head_mri_t: 4 x 4 head to MRI transform
+
+    returns: (n_channels, 3) positions in mm, nan for unplaced channels
+    """
+    locs = np.array([ch["loc"][:3] for ch in info["chs"]], float)
+    return apply_trans(head_mri_t, locs.reshape(-1, 3)) * 1000
+
+
+def group_names(names: Sequence[str]) -> np.ndarray:
+    """Group of each channel from its name without digits or spaces
+
+    Channels of the same electrode, e.g. "LAMY 1" and "LAMY 2", share a
+    group. Groups are numbered in the order their first channel appears.
+
+    names: channel names
+
+    returns: (n_channels,) group numbers
+    """
+    bases = [re.sub(r"[\d ]", "", name) for name in names]
+    if not bases:
+        return np.zeros(0, int)
+    _, first, inverse = np.unique(bases, return_index=True,
+                                  return_inverse=True)
+    rank = np.empty(len(first), int)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse.ravel()]
+
+
+def contact_image(vox: np.ndarray, groups: np.ndarray, center: np.ndarray,
+                  voxel_sizes: np.ndarray, xy_idx: Sequence[int],
+                  radius: int, size: int, proj: bool = False) -> np.ndarray:
+    """Image of the contacts around a slice, colored by group
+
+    Same image as IntracranialElectrodeLocator._make_ch_image, but the
+    distances and the pixels of the discs of all the contacts are computed
+    at once instead of one contact at a time.
+
+    vox: (n_channels, 3) voxel coordinates of the contacts, nan if unplaced
+    groups: (n_channels,) group of each contact
+    center: voxel of the current slice
+    voxel_sizes: number of voxels along each axis
+    xy_idx: the two axes of the volume shown along x and y
+    radius: radius of a contact on the slice it is centered on, in pixels
+    size: width and height of the image in pixels
+    proj: draw every contact at full radius (max intensity projection)
+
+    returns: (size, size) image, nan where there is no contact
+    """
+    image = np.full((size, size), np.nan)
+    dist = np.linalg.norm(vox - center, axis=1)
+    keep = ~np.isnan(dist) & (proj | (dist < radius))
+    if not keep.any():
+        return image
+    radii = np.full(keep.sum(), radius) if proj else \
+        radius - np.round(dist[keep]).astype(int)
+    ex, ey = np.round(vox[keep][:, list(xy_idx)] /
+                      voxel_sizes[list(xy_idx)] * size).astype(int).T
+    ii = np.arange(-radius, radius + 1)
+    dx, dy = [offset.ravel() for offset in np.meshgrid(ii, ii,
+                                                       indexing="ij")]
+    xs = ex[:, np.newaxis] + dx
+    ys = ey[:, np.newaxis] + dy
+    # discs of contacts near the border are cut at it, rather than indexing
+    # past the image or wrapping around to its other side
+    inside = (dx * dx + dy * dy < (radii * radii)[:, np.newaxis]) & \
+        (xs >= 0) & (xs < size) & (ys >= 0) & (ys < size)
+    rows = -ys  # negative y because y is inverted
+    cols = xs
+    colors = np.broadcast_to(groups[keep][:, np.newaxis], inside.shape)
+    image[rows[inside], cols[inside]] = colors[inside]
+    return image
+
+
+class ContactIndex(object):
+    def __init__(self, positions: np.ndarray):
+        """KD-tree of the placed contacts for nearest contact queries
+
+        The tree is built from 'positions' when first queried and built
+        again whenever the positions have changed since, so contacts can be
+        marked or removed in place without telling the index.
+
+        positions: (n_channels, 3) positions, nan for unplaced contacts
+        """
+        super(ContactIndex, self).__init__()
+        self.positions = positions
+        self._snapshot = None
+        self._placed = None
+        self._tree = None
+
+    def _refresh(self):
+        """Builds the tree again if the positions changed"""
+        if self._snapshot is not None and np.array_equal(
+                self._snapshot, self.positions, equal_nan=True):
+            return
+        self._snapshot = self.positions.copy()
+        self._placed = np.flatnonzero(~np.isnan(self.positions).any(axis=1))
+        self._tree = cKDTree(self.positions[self._placed]) \
+            if len(self._placed) else None
+
+    def nearest(self, point: np.ndarray,
+                max_dist: float = np.inf) -> Optional[int]:
+        """Index of the contact nearest to point, None if none is in reach
+
+        point: (3,) position
+        max_dist: contacts further than this are ignored
+        """
+        self._refresh()
+        if self._tree is None:
+            return None
+        dist, index = self._tree.query(point, distance_upper_bound=max_dist)
+        return None if np.isinf(dist) else int(self._placed[index])
+
+    def within(self, point: np.ndarray, radius: float) -> np.ndarray:
+        """Sorted indices of the contacts within radius of point"""
+        self._refresh()
+        if self._tree is None:
+            return np.zeros(0, int)
+        return np.sort(self._placed[self._tree.query_ball_point(point,
+                                                                radius)])
@@ -1,8 +1,12 @@
 """ A script that details the default values for many functions and tests"""
 
+from datetime import datetime, timezone
+
 import mne
 import bids
+import numpy as np
 from mne_bids import BIDSPath, read_raw_bids
+from dev.layout_cache import cached_layout
 
 
 def layout(kwargs: dict = None) -> dict:
@@ -39,10 +43,46 @@ class DefaultData(object):
         """
         super(DefaultData, self).__init__()
         self.root = mne.datasets.epilepsy_ecog.data_path()
-        self.layout = bids.BIDSLayout(self.root)
+        self.layout = cached_layout(self.root)
         self.file = self.layout.get(**layout())[0]
         self.file: bids.layout.BIDSFile
         self.entities = self.file.get_entities()
         self.path = BIDSPath(root=self.root, **self.entities)
         self.raw = read_raw_bids(bids_path=self.path, verbose=False)
         self.raw.load_data()
+
+
+def synthetic_raw(sub_id: str = "sub-1", n_channels: int = 4,
+                  sfreq: float = 256., duration: float = 2.,
+                  meas_date: datetime = None, seed: int = 0,
+                  bursts: list = None):
+    """ A small random ieeg raw object that needs no dataset download
+
+    Many server tests only need a raw object with a subject id and a
+    measurement date. This function builds one from gaussian noise (in
+    volts) so those tests do not depend on the mne datasets.
+
+    sub_id: the his_id stored in the subject info
+    n_channels: number of seeg channels
+    sfreq: sampling frequency in Hz
+    duration: length of the recording in seconds
+    meas_date: measurement date, 2020-01-01 UTC by default
+    seed: seed of the random number generator
+    bursts: (channel index, onset, duration) of 8 Hz oscillations twenty
+    times larger than the noise, standing in for seizure activity
+    """
+    if meas_date is None:
+        meas_date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    info = mne.create_info(["LA{}".format(i + 1) for i in range(n_channels)],
+                           sfreq, "seeg")
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((n_channels, int(sfreq * duration))) * 1e-5
+    for ch, onset, length in bursts or []:
+        start, stop = int(onset * sfreq), int((onset + length) * sfreq)
+        times = np.arange(stop - start) / sfreq
+        data[ch, start:stop] += 2e-4 * np.sin(2 * np.pi * 8. * times)
+    raw = mne.io.RawArray(data, info, verbose=False)
+    raw.set_meas_date(meas_date)
+    with raw.info._unlock():
+        raw.info["subject_info"] = {"his_id": sub_id}
+    return raw
@@ -0,0 +1,139 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+window_sec = 2.  # length of the analysis windows in seconds
+step_sec = 1.  # seconds between the starts of two windows
+band = (4., 30.)  # frequency band (Hz) of the band power feature
+threshold = 5.  # robust z-score both features must exceed
+channel_block = 16  # channels whose windows are held in memory at once
+window_block = 64  # windows of a channel block held in memory at once
+
+
+def windows(data: np.ndarray, n_window: int, n_step: int) -> np.ndarray:
+    """Sliding windows over the last axis without copying the data
+
+    data: (n_channels, n_times) samples
+    n_window: samples per window
+    n_step: samples between the starts of two windows
+
+    returns: read only (n_channels, n_windows, n_window) view of data
+    """
+    return sliding_window_view(data, n_window, axis=-1)[:, ::n_step]
+
+
+def line_length(wins: np.ndarray) -> np.ndarray:
+    """Sum of the absolute differences of consecutive samples per window
+
+    wins: (n_channels, n_windows, n_window) windows
+
+    returns: (n_channels, n_windows) line lengths
+    """
+    return np.abs(np.diff(wins, axis=-1)).sum(axis=-1)
+
+
+def band_power(wins: np.ndarray, sfreq: float,
+               fband: Tuple[float, float] = band) -> np.ndarray:
+    """Power of each Hann tapered window within a frequency band
+
+    wins: (n_channels, n_windows, n_window) windows
+    sfreq: sampling frequency in Hz
+    fband: (low, high) edges of the band in Hz
+
+    returns: (n_channels, n_windows) band powers
+    """
+    n_window = wins.shape[-1]
+    freqs = np.fft.rfftfreq(n_window, 1. / sfreq)
+    in_band = (freqs >= fband[0]) & (freqs <= fband[1])
+    spectrum = np.fft.rfft(wins * np.hanning(n_window), axis=-1)
+    return (np.abs(spectrum[..., in_band]) ** 2).sum(axis=-1) / n_window
+
+
+def robust_z(features: np.ndarray) -> np.ndarray:
+    """Z-scores of features per channel using the median and the MAD
+
+    The median absolute deviation is barely affected by the few windows
+    holding an event, unlike the standard deviation, so events stand out
+    against the background of their own channel. Channels without any
+    variation get a score of 0.
+
+    features: (n_channels, n_windows) features
+
+    returns: (n_channels, n_windows) robust z-scores
+    """
+    median = np.median(features, axis=-1, keepdims=True)
+    mad = 1.4826 * np.median(np.abs(features - median), axis=-1,
+                             keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (features - median) / mad
+    return np.where(mad > 0, z, 0.)
+
+
+def detect(data: np.ndarray, sfreq: float, ch_names: Sequence[str],
+           window: float = window_sec, step: float = step_sec,
+           fband: Tuple[float, float] = band, z_thresh: float = threshold,
+           picks: Sequence[int] = None) -> List[dict]:
+    """Finds candidate seizure events in multichannel data
+
+    Line length and band power are computed for channel_block channels
+    and window_block windows at a time, reading only the samples of those
+    windows (consecutive reads overlap by n_window - n_step samples), so
+    the memory used does not grow with the number of channels or the
+    length of the recording; picking channels with picks rather than
+    indexing data beforehand keeps a memory map from being copied in
+    full. Only the two features of every window of a channel block are
+    kept, to z-score them. Windows where both features have a robust
+    z-score above z_thresh are flagged, and overlapping flagged windows
+    of a channel are merged into one event.
+
+    data: (n_channels, n_times) samples, e.g. a memory map
+    sfreq: sampling frequency in Hz
+    ch_names: names of the channels in data, including those not picked
+    window: length of the analysis windows in seconds
+    step: seconds between the starts of two windows
+    fband: (low, high) edges of the band power in Hz
+    z_thresh: robust z-score both features must exceed
+    picks: indices of the channels of data to analyze, all by default
+
+    returns: list of {"channel", "onset", "duration", "score"} events,
+    with times in seconds and score the highest line length z-score
+    """
+    n_window = int(round(window * sfreq))
+    n_step = max(int(round(step * sfreq)), 1)
+    length = n_window / sfreq  # the window as actually analyzed
+    if picks is None:
+        picks = range(data.shape[0])
+    picks = list(picks)
+    if data.shape[-1] < n_window:
+        return []
+    n_windows = (data.shape[-1] - n_window) // n_step + 1
+    events = []
+    for start in range(0, len(picks), channel_block):
+        rows = picks[start:start + channel_block]
+        ll = np.empty((len(rows), n_windows))
+        bp = np.empty((len(rows), n_windows))
+        for lo in range(0, n_windows, window_block):
+            hi = min(lo + window_block, n_windows)
+            block = np.asarray(data[rows, lo * n_step:
+                                    (hi - 1) * n_step + n_window],
+                               dtype=np.float64)
+            wins = windows(block, n_window, n_step)
+            ll[:, lo:hi] = line_length(wins)
+            bp[:, lo:hi] = band_power(wins, sfreq, fband)
+        ll, bp = robust_z(ll), robust_z(bp)
+        flagged = (ll > z_thresh) & (bp > z_thresh)
+        for ch, win in zip(*np.nonzero(flagged)):
+            onset = win * n_step / sfreq
+            name = ch_names[rows[ch]]
+            if events and events[-1]["channel"] == name \
+                    and onset <= events[-1]["onset"] + \
+                    events[-1]["duration"]:
+                last = events[-1]
+                last["duration"] = onset + length - last["onset"]
+                last["score"] = max(last["score"], float(ll[ch, win]))
+            else:
+                events.append({"channel": name,
+                               "onset": float(onset), "duration": length,
+                               "score": float(ll[ch, win])})
+    return events
@@ -1,10 +1,92 @@
+import io
+import os
+import tempfile
 import mne
 import logging
-from flask import Flask, request
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Request, request
+from dev import detection, transport
+from dev.chunked_upload import ChunkedUploads, UploadError, \
+    default_chunk_size
+from dev.alerts import AlertAggregator, AlertDispatcher, Outbox
+from dev.recording_store import RecordingStore
+from dev.selections import SelectionStore
+
+in_memory_size = 16 * 1024 * 1024  # uploads up to this size stay in memory
+max_upload_size = 4 * 1024 * 1024 * 1024
+upload_dir = os.path.join(tempfile.gettempdir(), "eeg_uploads")
+chunk_dir = os.path.join(tempfile.gettempdir(), "eeg_chunks")
+store_dir = os.path.join(tempfile.gettempdir(), "eeg_recordings")
+memory_budget = 512 * 1024 * 1024  # bytes of recordings kept in memory
+outbox_path = os.path.join(tempfile.gettempdir(), "eeg_outbox.sqlite")
+selections_path = os.path.join(tempfile.gettempdir(),
+                               "eeg_selections.sqlite")
+email_url = "http://vcm-7631.vm.duke.edu:5007/hrss/send_email"
+nurse_port = 6000
+nurse_timeout = 600.  # the nurse gui answers once its window is closed
+alert_window = 60.  # seconds during which alerts of a patient are coalesced
+analysis_workers = 2  # recordings analyzed at the same time
+
+
+class UploadRequest(Request):
+    """Request class that spools uploaded files to unique temporary files
+
+    Flask parses multipart uploads into a stream returned by
+    _get_file_stream. This class keeps requests no larger than in_memory_size
+    in a BytesIO, which MNE can parse without touching the disk, and writes
+    larger ones directly into a uniquely named file in upload_dir, so
+    concurrent uploads never share a file name. The file backs the lazily
+    loaded raw object until it is spilled to pat_data, and is deleted when
+    the request is closed whatever happened, e.g. when the form held the
+    wrong field or extra files.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(UploadRequest, self).__init__(*args, **kwargs)
+        self.spooled = []  # paths of the files written to upload_dir
+
+    def close(self):
+        """Closes the request and deletes the files it spooled"""
+        try:
+            super(UploadRequest, self).close()
+        finally:
+            for path in self.spooled:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:  # e.g. removed by discard_upload
+                    pass
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        """Returns the stream that the uploaded file is written into
+
+        :param total_content_length: Length of the whole request body
+        :param content_type: Mimetype of the uploaded file
+        :param filename: Name of the uploaded file
+        :param content_length: Length of the file, if the client sent it
+
+        :returns: BytesIO for small uploads, named temporary file otherwise
+        """
+        if total_content_length is not None and \
+                total_content_length <= in_memory_size:
+            return io.BytesIO()
+        os.makedirs(upload_dir, exist_ok=True)
+        stream = tempfile.NamedTemporaryFile(mode="w+b", dir=upload_dir,
+                                             suffix="_ieeg.fif", delete=False)
+        self.spooled.append(stream.name)
+        return stream
+
+
 app = Flask(__name__)
-pat_data = {}
+app.request_class = UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = max_upload_size
+pat_data = RecordingStore(store_dir, memory_budget)
+uploads = ChunkedUploads(chunk_dir, max_upload_size)
 patient_statuses = {}
+dispatcher = AlertDispatcher(Outbox(outbox_path))
+aggregator = AlertAggregator(dispatcher, alert_window)
+analysis_pool = ThreadPoolExecutor(max_workers=analysis_workers)
+selections = SelectionStore(selections_path)
 
 
 @app.route("/", methods=["GET"])
@@ -30,32 +112,437 @@ def add_data():  # no test needed!
 
     This route fnx is a post request that checks the file type and
     determines its correctness for further code use, requests the file
-    and saves it, then uses databasing to extract certain dictionary elements
-    and send an email when there is a problem. The requets acesses the other
-    server nurse gui and inputs the written data from nurse notes for the
-    respective patient. This is appended to the pre made dictionary of
-    dictionaries for the patient and the request is returned.
-    jsonified string that says "Server is on".
+    and saves it, then uses databasing to extract certain dictionary
+    elements. The recording is then analyzed in the analysis_pool, so
+    the request returns as soon as the data is stored. Only if the
+    analysis finds candidate events is an email sent and an alert
+    queued for the other server nurse gui, which inputs the written
+    data from nurse notes for the respective patient; once the nurse
+    answers, record_status appends the notes to the pre made
+    dictionary of dictionaries for the patient. Alerts for the same
+    patient within alert_window seconds are sent to the nurse once.
 
     :param: N/A
 
-    :returns: dictionary of sent email information
+    :returns: dictionary of the stored recording
     """
     infofile = validate_file_input(request.files)
     if infofile[0] is not True:
         return infofile
     file = request.files["raw_ieeg.fif"]
 
-    file.save(file.filename)
-    email = databasing(file.filename)
-    patient1 = email["subject"]
-    email["gui_resp"] = requests.post("http://" +
-        request.remote_addr + ":6000/annotations", data=patient1).text
-    add_element(patient_statuses, patient1, email["gui_resp"])
-    logging_patient(patient1)
+    raw = read_upload(file.stream)
+    try:
+        return ingest(raw), 200
+    except Exception:
+        discard_upload(raw)
+        raise
+
+
+@app.route("/database/binary", methods=["POST"])
+def add_binary():
+    """Adds a recording sent in the compact binary transport format
+
+    This route fnx is like /database, but the body of the request
+    is a recording encoded by transport.encode instead of a fif
+    file. The samples are decoded straight from the request body
+    into a NumPy view, without a temporary file or MNE's file
+    reader, and spilled to pat_data.
+
+    :param: N/A
+
+    :returns: dictionary of the stored recording, or an error str
+    and 400 code
+    """
+    try:
+        header, data = transport.decode(request.get_data())
+    except ValueError as e:
+        return "The input was not a binary recording: {}".format(e), 400
+    if header.get("his_id") is None or header.get("meas_date") is None:
+        return "The recording has no his_id or measurement date", 400
+    info = transport.header_to_info(header)
+    scan_time = info["meas_date"].strftime("%m/%d/%Y, %H:%M:%S")
+    recording = pat_data.add_array(
+        header["his_id"], scan_time, info, data, header["scales"],
+        header["first_samp"], transport.header_to_annotations(header))
+    return start_analysis(recording), 200
+
+
+@app.route("/upload", methods=["POST"])
+def create_upload():
+    """Starts a chunked upload of a fif file
+
+    This route fnx takes a json dictionary with the "size" and
+    "sha256" of the file and optionally the "chunk_size" the client
+    will send it in. The client then PUTs every chunk to
+    /upload/<upload_id>/<index> and POSTs /upload/<upload_id>/complete.
+
+    :returns: dictionary of the upload session, or an error str and
+    error code
+    """
+    info = request.get_json(silent=True)
+    if not isinstance(info, dict):
+        return "The input was not a json dictionary", 400
+    try:
+        session = uploads.create(info.get("size"), info.get("sha256"),
+                                 info.get("chunk_size", default_chunk_size))
+    except UploadError as e:
+        return str(e), e.status
+    return session, 200
+
+
+@app.route("/upload/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
+    """Returns the received and missing chunks of an upload
+
+    A client resuming an interrupted upload only sends the chunks
+    listed as missing. "completing" is true while a request to
+    /upload/<upload_id>/complete is verifying and storing it.
+
+    :param upload_id: str id returned by /upload
+
+    :returns: dictionary of the upload session, or an error str and
+    error code
+    """
+    try:
+        return uploads.session(upload_id), 200
+    except UploadError as e:
+        return str(e), e.status
+
+
+@app.route("/upload/<upload_id>/<int:index>", methods=["PUT"])
+def put_chunk(upload_id, index):
+    """Stores one chunk of an upload
+
+    The body of the request is the chunk and its sha256 digest is
+    sent in the X-Chunk-Sha256 header. Chunks can be sent in any
+    order and sent again.
+
+    :param upload_id: str id returned by /upload
+    :param index: int position of the chunk, starting from 0
+
+    :returns: str and 200 code, or an error str and error code
+    """
+    try:
+        uploads.put(upload_id, index, request.get_data(),
+                    request.headers.get("X-Chunk-Sha256", ""))
+    except UploadError as e:
+        return str(e), e.status
+    return "Chunk {} received".format(index), 200
+
+
+@app.route("/upload/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    """Verifies a finished upload and adds it like /database
+
+    Completing an upload again returns the same dictionary, so a
+    client may retry when it did not get the answer. While another
+    request is still completing it, the answer is 202 and the client
+    polls /upload/<upload_id> until "completing" is over.
+
+    :param upload_id: str id returned by /upload
+
+    :returns: dictionary of the stored recording, or an error str
+    and error code
+    """
+    try:
+        out = uploads.completed(upload_id)
+        if out is None and not uploads.claim(upload_id):
+            out = uploads.completed(upload_id)  # it may have just finished
+            if out is None:
+                return "Upload {} is being completed".format(upload_id), 202
+        if out is not None:  # the client retries after a lost answer
+            return out, 200
+    except UploadError as e:
+        return str(e), e.status
+    try:
+        path = uploads.complete(upload_id)
+    except UploadError as e:
+        uploads.release(upload_id)  # e.g. to send the missing chunks
+        return str(e), e.status
+    except Exception:
+        uploads.release(upload_id)
+        raise
+    try:
+        raw = mne.io.read_raw_fif(path, preload=False)
+    except Exception as e:  # mne fails in many ways on a corrupt file
+        uploads.discard(upload_id)
+        return "The upload is not a valid fif file: {}".format(e), 400
+    try:
+        out = ingest(raw)
+    except Exception:
+        uploads.discard(upload_id)
+        raise
+    uploads.finish(upload_id, out)
+    return out, 200
+
+
+def ingest(raw):
+    """Stores an uploaded raw object and starts its analysis
+
+    This fnx adds the raw object to pat_data with databasing,
+    deletes the upload file backing it and submits the analysis
+    to the analysis_pool, alerting the nurse gui of the client
+    that sent it if candidate events are found.
+
+    :param raw: raw object of the uploaded eeg data
+
+    :returns: dictionary of the stored recording
+    """
+    recording = databasing(raw)
+    discard_upload(raw)
+    return start_analysis(recording)
+
+
+def start_analysis(recording):
+    """Submits the analysis of a stored recording to the analysis_pool
+
+    The nurse gui of the client that sent the recording is alerted
+    if candidate events are found.
+
+    :param recording: Recording of pat_data to analyze
+
+    :returns: dictionary of the stored recording
+    """
+    nurse_url = "http://{}:{}/annotations".format(request.remote_addr,
+                                                  nurse_port)
+    future = analysis_pool.submit(analyze, recording, nurse_url)
+    future.add_done_callback(logging_analysis)
+    logging_patient(recording.sub_id)
+    return {"subject": recording.sub_id, "scan_time": recording.scan_time,
+            "analysis": "pending"}
+
+
+@app.route("/analysis/<sub_id>", methods=["GET"])
+def get_analysis(sub_id):
+    """Returns the candidate events found in a patient's recordings
+
+    :param sub_id: str of the his_id of the patient
+
+    :returns: dictionary of {scan_time: list of events} where the
+    events are "pending" while the analysis runs, or an error
+    str and 404 if the patient is unknown
+    """
+    recordings = pat_data.recordings(sub_id)
+    if not recordings:
+        return "Patient {} not found".format(sub_id), 404
+    return {scan_time: "pending" if rec.candidates is None
+            else rec.candidates
+            for scan_time, rec in recordings.items()}, 200
+
+
+def analyze(recording, nurse_url=None):
+    """Looks for candidate seizure events and alerts if there are any
+
+    This fnx runs the detection on the samples of a stored
+    recording, read from its memory map a block of channels at a
+    time. If any events are found, the attending is emailed and,
+    given the nurse_url, the nurse gui is alerted. The events are
+    stored on the recording once the alerts are queued, so a
+    client seeing them can wait for the alerts (see
+    AlertDispatcher.flush). It runs in the analysis_pool.
+
+    :param recording: Recording of pat_data to analyze
+    :param nurse_url: str address of the nurse gui annotations
+
+    :returns: list of the candidate events
+    """
+    picks = mne.pick_types(recording.info, meg=False, eeg=True, seeg=True,
+                           ecog=True, exclude="bads")
+    candidates = detection.detect(recording.get_data(),
+                                  recording.info["sfreq"],
+                                  recording.info["ch_names"], picks=picks)
+    try:
+        if candidates:
+            alert_candidates(recording, candidates, nurse_url)
+    finally:
+        # only shown once the alerts are queued, see get_analysis
+        recording.candidates = candidates
+    return candidates
+
+
+def alert_candidates(recording, candidates, nurse_url=None):
+    """Emails the attending and alerts the nurse gui about events
+
+    :param recording: Recording of pat_data the events were found in
+    :param candidates: list of the candidate events
+    :param nurse_url: str address of the nurse gui annotations
+    """
+    channels = sorted({event["channel"] for event in candidates})
+    status = "{} candidate events on {}".format(len(candidates),
+                                                ", ".join(channels))
+    email = emailing(recording.sub_id, "nurse/dockool@gmail.com", status,
+                     recording.scan_time)
+    if nurse_url is not None:
+        aggregator.add("nurse", nurse_url, email["subject"],
+                       {"subject": email["subject"],
+                        "content": email["content"]}, nurse_timeout)
+
+
+@app.route("/alerts", methods=["GET"])
+def alert_stats():
+    """Returns the counts of received, sent and suppressed alerts
+
+    :returns: dictionary of alert counts, see AlertAggregator.stats
+    """
+    return aggregator.stats(), 200
+
+
+@app.route("/selections/<sub_id>", methods=["POST"])
+def add_selections(sub_id):
+    """Stores the electrodes the epileptologist selected in a recording
+
+    This route fnx takes a json dictionary with the "scan_time" of
+    the recording, a list of "selections", each with a "channel", a
+    "label" (e.g. "soz") and optionally an "onset", "duration" and
+    "note", and optionally the "author" of the review. If "replace"
+    is true, the selections of the recording with the same labels
+    are deleted first, so a review can be saved again.
+
+    :param sub_id: str of the his_id of the patient
+
+    :returns: dictionary with the number of selections stored, or
+    an error str and 400 code
+    """
+    info = request.get_json(silent=True)
+    if not isinstance(info, dict) or \
+            not isinstance(info.get("selections"), list):
+        return "The input was not a json dictionary with selections", 400
+    try:
+        stored = selections.add(sub_id, info.get("scan_time"),
+                                info["selections"], info.get("author"),
+                                bool(info.get("replace", False)))
+    except ValueError as e:
+        return str(e), 400
+    return {"subject": sub_id, "scan_time": info["scan_time"],
+            "stored": stored}, 200
+
+
+@app.route("/selections/<sub_id>", methods=["GET"])
+def get_selections(sub_id):
+    """Returns the selections of a patient's recordings
+
+    The query string can filter by "scan_time", "channel" and
+    "label", restrict to the recordings made from "start" to before
+    "stop" (both scan_times) and page with "limit" and "offset".
+
+    :param sub_id: str of the his_id of the patient
+
+    :returns: list of selection dictionaries, or an error str and
+    400 code
+    """
+    args = request.args
+    try:
+        return {"selections": selections.query(
+            sub_id, args.get("scan_time"), args.get("channel"),
+            args.get("label"), args.get("start"), args.get("stop"),
+            args.get("limit", 1000, int), args.get("offset", 0, int))}, 200
+    except ValueError as e:
+        return str(e), 400
+
+
+@app.route("/selections/<sub_id>/channels", methods=["GET"])
+def get_selected_channels(sub_id):
+    """Returns every channel selected across a patient's recordings
+
+    E.g. /selections/<sub_id>/channels?label=soz lists all the
+    contacts flagged as seizure onset in any recording of the
+    patient, with how many recordings each was flagged in. The
+    query string can also have "start" and "stop" scan_times.
+
+    :param sub_id: str of the his_id of the patient
+
+    :returns: list of channel dictionaries, see
+    SelectionStore.channels, or an error str and 400 code
+    """
+    args = request.args
+    try:
+        return {"channels": selections.channels(
+            sub_id, args.get("label"), args.get("start"),
+            args.get("stop"))}, 200
+    except ValueError as e:
+        return str(e), 400
+
+
+@app.route("/selections/<sub_id>", methods=["DELETE"])
+def delete_selections(sub_id):
+    """Deletes the selections of a recording
+
+    The query string must have the "scan_time" of the recording
+    and can have a "channel" and a "label" to delete only those.
+
+    :param sub_id: str of the his_id of the patient
+
+    :returns: dictionary with the number of selections deleted, or
+    an error str and 400 code
+    """
+    args = request.args
+    if args.get("scan_time") is None:
+        return "The scan_time of the recording is required", 400
+    try:
+        deleted = selections.delete(sub_id, args["scan_time"],
+                                    args.get("channel"), args.get("label"))
+    except ValueError as e:
+        return str(e), 400
+    return {"deleted": deleted}, 200
+
+
+def batch_nurse(alerts):
+    """Builds the body of a nurse alert from coalesced alerts
+
+    All alerts of a batch are for the same patient, so the nurse
+    gui is only sent the patient once.
+
+    :param alerts: list of dictionaries with subject and content
+
+    :returns: str of the patient sent to the nurse gui
+    """
+    return alerts[0]["subject"]
+
+
+def batch_email(alerts):
+    """Builds one email from the emails coalesced for a recipient
+
+    :param alerts: list of email dictionaries made by emailing
+
+    :returns: the email itself if there is one, otherwise an email
+    listing the subjects and contents of all of them
+    """
+    if len(alerts) == 1:
+        return alerts[0]
+    subjects = []
+    for alert in alerts:
+        if alert["subject"] not in subjects:
+            subjects.append(alert["subject"])
+    return {"from_email": alerts[0]["from_email"],
+            "to_email": alerts[0]["to_email"],
+            "subject": "{} alerts: {}".format(len(alerts),
+                                              "; ".join(subjects)),
+            "content": "\n".join(alert["content"] for alert in alerts)}
+
+
+def record_status(alert, response):
+    """Stores the notes the nurse gui answered an alert with
+
+    This fnx is the handler of delivered "nurse" alerts. It is
+    called from an alert dispatcher thread with the delivered
+    alert, whose body is the patient sent to the nurse gui, and
+    the text of the response holding the written notes.
+
+    :param alert: dictionary of the delivered alert
+    :param response: str of the nurse gui response
+    """
+    add_element(patient_statuses, alert["body"], response)
     logging_inf(patient_statuses)
-    print(patient_statuses)
-    return email, 200
+
+
+def record_email(alert, response):
+    """Prints the answer of the email service to a delivered email
+
+    :param alert: dictionary of the delivered alert
+    :param response: str of the email service response
+    """
+    print(response)
 
 
 def add_element(dict, key, value):
@@ -79,27 +566,69 @@ def add_element(dict, key, value):
     dict[key].append(value)
 
 
+def read_upload(stream):
+    """Reads the raw object of an uploaded fif file stream
+
+    This fnx takes the stream an upload was written into by
+    UploadRequest. Small uploads are parsed straight from the
+    in memory buffer (MNE must preload data from file-like
+    objects). Large uploads were already written to a unique
+    file, so only its header and metadata are read
+    (preload=False) and the data stays on disk until needed.
+    If the file cannot be parsed it is removed.
+
+    :param stream: BytesIO or named temporary file of the upload
+
+    :returns: raw object of the uploaded eeg data
+    """
+    if isinstance(stream, io.BytesIO):
+        stream.seek(0)
+        return mne.io.read_raw_fif(stream, preload=True)
+    path = stream.name
+    stream.close()
+    try:
+        return mne.io.read_raw_fif(path, preload=False)
+    except Exception:
+        os.remove(path)
+        raise
+
+
+def discard_upload(raw):
+    """Deletes the upload file backing a raw object, if there is one
+
+    Once databasing has spilled the recording into pat_data, the
+    file the upload was spooled into is no longer needed. Files
+    outside of upload_dir (e.g. given by path) are never deleted.
+
+    :param raw: raw object returned by read_upload
+    """
+    for fname in raw.filenames:
+        if fname and os.path.dirname(str(fname)) == upload_dir and \
+                os.path.isfile(fname):
+            os.remove(fname)
+
+
 def databasing(file):
-    """Extracts patient data and sends email
+    """Extracts patient data and stores the recording
 
     This fnx takes in raw fif file and extracts patient info
     as well as adding time of patient scanning. These are added to
-    a patient dictionary with accompanying values. The function
-    emailing is called which sends a pseudo email to alert the
-    doctor or nurse (depending on choice) of a issue.
+    the pat_data recording store, which keeps the samples on disk
+    and only the metadata in memory. Alerts are left to analyze,
+    which only sends them if the signal holds candidate events.
 
-    :param file: fif file with raw object eeg data
+    :param file: fif file path or already read raw object with
+    eeg data
 
-    :returns: dictionary of data that was sent in pseudo
-    email
+    :returns: the Recording added to pat_data
     """
-    raw = mne.io.read_raw_fif(file)
+    if isinstance(file, mne.io.BaseRaw):
+        raw = file
+    else:
+        raw = mne.io.read_raw_fif(file)
     sub_id = raw.info["subject_info"]["his_id"]
     scan_time = raw.info["meas_date"].strftime("%m/%d/%Y, %H:%M:%S")
-    pat_data[sub_id] = {}
-    pat_data[sub_id][scan_time] = raw
-    sent = emailing(sub_id, "nurse/dockool@gmail.com", pat_data, scan_time)
-    return sent
+    return pat_data.add(sub_id, scan_time, raw)
 
 
 def validate_file_input(file: dict):
@@ -122,12 +651,15 @@ def emailing(my_id: str, email: str, status: str, time: str):  # no test!
     """Sends a pseudo email to attending if the patient is found
     to be in trouble.
 
-    The emailing fnx uses an inline route post
-    method to send an email with information on the patient and
-    that they need help. The dictionary it outputs contains
-    from email, to email, and content (id, status, and time/date).
-    It uses the inputs my_id, email, status, and time
-    in order to populate these "email" sections.
+    The emailing fnx queues a post to the email service with
+    information on the patient and that they need help, which the
+    alert dispatcher delivers in the background. The first email
+    about a patient is sent right away, and further emails about
+    that patient to the same address within alert_window seconds
+    are sent as one batch, see batch_email. The dictionary it
+    outputs contains from email, to email, and content (id, status,
+    and time/date). It uses the inputs my_id, email, status, and
+    time in order to populate these "email" sections.
 
     :param my_id: str value of patient id
     :param email: str of attending email
@@ -141,16 +673,14 @@ def emailing(my_id: str, email: str, status: str, time: str):  # no test!
            "subject": "Patient {} needs assistance".format(my_id),
            "content": "ID: {}, Status: {},"
                       " Time/Date: {}!".format(my_id, status, time)}
-    r = requests.post("http://vcm-7631.vm.duke.edu:5007/hrss/send_email",
-                      json=out)
-    print(r.text)
+    aggregator.add("email", email_url, (email, my_id), out)
     logging_email(my_id, status, email)
     return out
 
 
 def logging_patient(pat1):
     """Logs when a new patient is added
-    
+
     This function takes in a dictionary of the new patient
     addition then uses logging info and puts in the patient id
     value into the log string using the patient_id key
@@ -163,6 +693,19 @@ def logging_patient(pat1):
                  " patient id {}".format(pat1))
 
 
+def logging_analysis(future):
+    """Logs the error of an analysis that failed
+
+    This function is called with the future of every analysis
+    once it is done, since errors raised in the analysis_pool
+    would otherwise go unnoticed.
+
+    :param future: future of an analyze call
+    """
+    if future.exception() is not None:
+        logging.error("Analysis failed: {!r}".format(future.exception()))
+
+
 def logging_inf(pat_stat):
     """Logs when a new patient info is added
 
@@ -196,7 +739,14 @@ def logging_email(my_id, status, email):
                  " email {}".format(my_id, status, email))
 
 
+dispatcher.handlers["nurse"] = record_status
+dispatcher.handlers["email"] = record_email
+aggregator.formatters["nurse"] = batch_nurse
+aggregator.formatters["email"] = batch_email
+
+
 if __name__ == '__main__':
     logging.basicConfig(filename="Information.log", filemode="w",
                         level=logging.INFO)
+    dispatcher.start()  # delivers alerts left over from the last run
     app.run(host="0.0.0.0", port=5000)
@@ -1,42 +1,114 @@
 # This Python file uses the following encoding: utf-8
 import os.path as op
+from weakref import WeakKeyDictionary
 import matplotlib.pyplot as plt
 import mne
 import mne.viz as vfig
 import nibabel as nib
 import numpy as np
 from PyQt5 import Qt
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import (QGridLayout, QHBoxLayout, QVBoxLayout,
-                             QListView, QApplication, QWidget)
+                             QListView, QApplication, QScrollBar, QWidget)
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.collections import LineCollection
 from mne._freesurfer import _check_subject_dir
 from mne.gui._ieeg_locate_gui import (IntracranialElectrodeLocator,
                                       _CH_PLOT_SIZE, _make_slice_plot)
+from mne.surface import _read_mri_surface
 from mne.transforms import (apply_trans, _get_trans, invert_transform,
-                            apply_volume_registration)
+                            _frame_to_str)
+from mne.utils import warn
 from mne.viz.backends.renderer import _get_renderer
+from dev.contacts import (ContactIndex, contact_image, contact_positions,
+                          group_names)
+from dev.preview import MinMaxPyramid, envelope_segments
+from dev.volume_cache import SliceCache, VolumeCache
+from gui_worker import BackgroundRunner
+
+_PICK_DIST = 5.  # mm from a picked point to the contact it selects
 
 app = QApplication.instance()
 if app is None:
     app = QApplication(["Intracranial Electrode Locator"])
 
 
+class _QtRoot(object):
+    """The 'after' of a tkinter root, for a BackgroundRunner in Qt"""
+
+    @staticmethod
+    def after(ms, func):
+        """Calls func on the Qt event loop in ms milliseconds"""
+        QTimer.singleShot(ms, func)
+
+
 class Canvas(FigureCanvasQTAgg):
-    def __init__(self, parent, raw):
+    def __init__(self, parent, raw, duration=10., n_channels=20):
         """Class that inherits the matplotlib conversion to pyQT funcitonality
 
         This class takes a matplotlib figure and converts it's properties to
-        mesh well with pyQT's libraries
+        mesh well with pyQT's libraries. Instead of plotting every sample of
+        the recording, it draws the min/max envelopes of a MinMaxPyramid for
+        the visible window only, at the resolution of the screen, so the
+        time it takes to draw does not grow with the length of the recording.
+        Building the pyramid reads the whole recording, so it is done by a
+        BackgroundRunner; until it is ready, the visible window is reduced
+        from its samples.
 
         parent: the class that will be inherited by Canvas after it's
         initial __init__ raw: a raw object of eeg data
+        duration: seconds of data visible at once
+        n_channels: number of channels visible at once
         """
         fig, self.ax = plt.subplots(figsize=(5, 4), dpi=100)
-        fig = raw.plot(show=False)
         super().__init__(fig)
         self.setParent(parent)
-        self.ax.plot()
+        self.raw = raw
+        self.pyramid = MinMaxPyramid.from_raw(raw, build=False)
+        self.spacing = 2 * self.pyramid.spacing()
+        self.duration = min(duration, raw.times[-1])
+        self.n_channels = min(n_channels, len(raw.ch_names))
+        self.start = 0.
+        self.first_channel = 0
+        self.lines = LineCollection([], linewidths=0.5, colors="k")
+        self.ax.add_collection(self.lines)
         self.ax.grid()
+        self.draw_window()
+        self.runner = BackgroundRunner(_QtRoot(), max_workers=1)
+        self.runner.submit("pyramid", MinMaxPyramid.from_raw, raw,
+                           on_done=self._pyramid_ready)
+
+    def _pyramid_ready(self, pyramid):
+        """Draws from the built pyramid from now on"""
+        self.pyramid = pyramid
+        self.draw_window()
+
+    def draw_window(self):
+        """Draws the visible channels and time window"""
+        picks = np.arange(self.first_channel,
+                          self.first_channel + self.n_channels)
+        width = max(int(self.ax.bbox.width), 100)
+        times, mins, maxs = self.pyramid.window(
+            self.start, self.start + self.duration, width, picks)
+        offsets = -np.arange(len(picks)) * self.spacing
+        self.lines.set_segments(envelope_segments(times, mins, maxs,
+                                                  offsets))
+        self.ax.set_xlim(self.start, self.start + self.duration)
+        self.ax.set_ylim(offsets[-1] - self.spacing, self.spacing)
+        self.ax.set_yticks(offsets)
+        self.ax.set_yticklabels([self.raw.ch_names[i] for i in picks])
+        self.draw_idle()
+
+    def scroll_time(self, start):
+        """Shows the window starting at 'start' seconds"""
+        self.start = min(max(start, 0.), self.raw.times[-1] - self.duration)
+        self.draw_window()
+
+    def scroll_channels(self, first):
+        """Shows the channels starting at index 'first'"""
+        self.first_channel = min(max(int(first), 0),
+                                 len(self.raw.ch_names) - self.n_channels)
+        self.draw_window()
 
 
 class App(QWidget):
@@ -46,16 +118,35 @@ class App(QWidget):
 
         This class inherits the QWidget class so it can be seamlessely
         integrated into the pyqt framework. It also calls the Canvas class
+        and adds scroll bars moving through time (in tenths of a second)
+        and through channels.
         """
         super().__init__()
         self.resize(1600, 800)
 
-        chart = Canvas(self, raw)
+        self.chart = Canvas(self, raw)
+        time_bar = QScrollBar(Qt.Qt.Horizontal)
+        time_bar.setMaximum(int(10 * (raw.times[-1] - self.chart.duration)))
+        time_bar.setPageStep(int(10 * self.chart.duration))
+        time_bar.valueChanged.connect(
+            lambda value: self.chart.scroll_time(value / 10.))
+        channel_bar = QScrollBar(Qt.Qt.Vertical)
+        channel_bar.setMaximum(len(raw.ch_names) - self.chart.n_channels)
+        channel_bar.setPageStep(self.chart.n_channels)
+        channel_bar.valueChanged.connect(self.chart.scroll_channels)
+
+        plot_hbox = QHBoxLayout()
+        plot_hbox.addWidget(self.chart)
+        plot_hbox.addWidget(channel_bar)
+        main_vbox = QVBoxLayout()
+        main_vbox.addLayout(plot_hbox)
+        main_vbox.addWidget(time_bar)
+        self.setLayout(main_vbox)
 
 
 class Locator(IntracranialElectrodeLocator):
     def __init__(self, raw, trans, aligned_ct, subject=None,
-                 subjects_dir=None, groups=None, verbose=None):
+                 subjects_dir=None, groups=None, verbose=None, cache=None):
         """GUI for locating intracranial electrodes. Inherited from MNE Class
 
         A class inherited from the MNE toolbox to locate and reconstruct
@@ -71,6 +162,8 @@ class Locator(IntracranialElectrodeLocator):
         subjects_dir: directory of all of the subjects as a string
         groups: study group that a subject can be categorized as
         verbose: verbosity of code execution
+        cache: VolumeCache the reoriented MRI and CT are read from, so they
+            are only computed on the first launch for a subject
 
         .. note:: Images will be displayed using orientation information
                   obtained from the image header. Images will be resampled to
@@ -87,6 +180,7 @@ class Locator(IntracranialElectrodeLocator):
         # store info for modification
         self._info = raw.info
         self._verbose = verbose
+        self._cache = VolumeCache() if cache is None else cache
 
         # load imaging data
         self._subject_dir = _check_subject_dir(subject, subjects_dir)
@@ -99,10 +193,13 @@ class Locator(IntracranialElectrodeLocator):
         # load data, apply trans
         self._head_mri_t = _get_trans(trans, 'head', 'mri')[0]
         self._mri_head_t = invert_transform(self._head_mri_t)
-        # load channels, convert from m to mm
-        self._chs = {name: apply_trans(self._head_mri_t, ch['loc'][:3]) * 1000
-                     for name, ch in zip(raw.info.ch_names, raw.info['chs'])}
-        self._ch_names = list(self._chs.keys())
+        # load channels, convert from m to mm. The values of self._chs are
+        # rows of self._ch_pos, so the in place edits of MNE's methods keep
+        # the array up to date
+        self._ch_pos = contact_positions(raw.info, self._head_mri_t)
+        self._ch_names = list(raw.info.ch_names)
+        self._chs = dict(zip(self._ch_names, self._ch_pos))
+        self._contacts = ContactIndex(self._ch_pos)
         # set current position
         if np.isnan(self._chs[self._ch_names[self._ch_index]]).any():
             self._ras = np.array([0., 0., 0.])
@@ -121,6 +218,8 @@ class Locator(IntracranialElectrodeLocator):
         # plt_grid.addWidget(plts[2][0], 1, 0)
         self._renderer = _get_renderer(
             name='IEEG Locator', size=(400, 400), bgcolor='w')
+        self._renderer.plotter.enable_point_picking(
+            callback=self._on_pick_3d, show_message=False)
 
         # Channel selector
         self._ch_list = QListView()
@@ -151,6 +250,177 @@ class Locator(IntracranialElectrodeLocator):
         # ready for user
         self._ch_list.setFocus()  # always focus on list
 
+    def _load_image_data(self, ct):
+        """Get MRI and CT data to display and transforms to/from vox/RAS.
+
+        Same as the MNE method, except that the reoriented volumes are read
+        from the VolumeCache as memory maps instead of being computed again.
+        """
+        # allows recon-all not to be finished (T1 made in a few minutes)
+        mri_img = 'brain' if op.isfile(op.join(
+            self._subject_dir, 'mri', 'brain.mgz')) else 'T1'
+        self._mri_data, self._vox_ras_t = self._cache.image(
+            op.join(self._subject_dir, 'mri', f'{mri_img}.mgz'))
+        self._ras_vox_t = np.linalg.inv(self._vox_ras_t)
+
+        self._voxel_sizes = np.array(self._mri_data.shape)
+        # We need our extents to land the centers of each pixel on the voxel
+        # number. This code assumes 1mm isotropic...
+        img_delta = 0.5
+        self._img_extents = list(
+            [-img_delta, self._voxel_sizes[idx[0]] - img_delta,
+             -img_delta, self._voxel_sizes[idx[1]] - img_delta]
+            for idx in self._xy_idx)
+        ch_deltas = list(img_delta * (self._voxel_sizes[ii] / _CH_PLOT_SIZE)
+                         for ii in range(3))
+        self._ch_extents = list(
+            [-ch_delta, self._voxel_sizes[idx[0]] - ch_delta,
+             -ch_delta, self._voxel_sizes[idx[1]] - ch_delta]
+            for idx, ch_delta in zip(self._xy_idx, ch_deltas))
+
+        # ready ct
+        self._ct_data, vox_ras_t = self._cache.image(ct)
+        if self._mri_data.shape != self._ct_data.shape or \
+                not np.allclose(self._vox_ras_t, vox_ras_t, rtol=1e-6):
+            raise ValueError('CT is not aligned to MRI, got '
+                             f'CT shape={self._ct_data.shape}, '
+                             f'MRI shape={self._mri_data.shape}, '
+                             f'CT affine={vox_ras_t} and '
+                             f'MRI affine={self._vox_ras_t}')
+        self._ct_maxima = None  # don't compute until turned on
+        self._slices = dict(ct=SliceCache(self._ct_data),
+                            mri=SliceCache(self._mri_data))
+        # what each image currently shows, to skip updates that change
+        # nothing. Keyed by artist so images made again by a toggle are
+        # always updated
+        self._shown = WeakKeyDictionary()
+
+        if op.exists(op.join(self._subject_dir, 'surf', 'lh.seghead')):
+            self._head = _read_mri_surface(
+                op.join(self._subject_dir, 'surf', 'lh.seghead'))
+            assert _frame_to_str[self._head['coord_frame']] == 'mri'
+        else:
+            warn('`seghead` not found, using marching cubes on CT for '
+                 'head plot, use :ref:`mne.bem.make_scalp_surfaces` '
+                 'to add the scalp surface instead of skull from the CT')
+            self._head = None
+        if op.exists(op.join(self._subject_dir, 'surf', 'lh.pial')):
+            self._lh = _read_mri_surface(
+                op.join(self._subject_dir, 'surf', 'lh.pial'))
+            assert _frame_to_str[self._lh['coord_frame']] == 'mri'
+            self._rh = _read_mri_surface(
+                op.join(self._subject_dir, 'surf', 'rh.pial'))
+            assert _frame_to_str[self._rh['coord_frame']] == 'mri'
+        else:
+            warn('`pial` surface not found, skipping adding to 3D '
+                 'plot. This indicates the Freesurfer recon-all '
+                 'has not finished or has been modified and '
+                 'these files have been deleted.')
+            self._lh = self._rh = None
+
+    def _group_channels(self, groups):
+        """Find a group for every channel from its name, all at once."""
+        if groups is not None:
+            for name in self._ch_names:
+                if name not in groups:
+                    raise ValueError(f'{name} not found in ``groups``')
+            self._groups = {name: groups[name] for name in self._ch_names}
+        else:
+            self._groups = dict(zip(self._ch_names,
+                                    group_names(self._ch_names).tolist()))
+
+    def _make_ch_image(self, axis, proj=False):
+        """Make a plot to display the channel locations."""
+        groups = np.fromiter((self._groups[name] for name in self._ch_names),
+                             float, len(self._ch_names))
+        return contact_image(
+            apply_trans(self._ras_vox_t, self._ch_pos), groups,
+            self._current_slice, self._voxel_sizes, self._xy_idx[axis],
+            self._radius, _CH_PLOT_SIZE, proj=proj)
+
+    def _save_ch_coords(self, info=None, verbose=None):
+        """Save the location of the electrode contacts."""
+        if info is None:
+            info = self._info
+        locs = apply_trans(self._mri_head_t, self._ch_pos / 1000)  # mm->m
+        with info._unlock():
+            for ch, loc in zip(info['chs'], locs):
+                ch['loc'][:3] = loc
+
+    def _on_pick_3d(self, point):
+        """Select the contact nearest to a point picked in the 3D view."""
+        index = self._contacts.nearest(point, max_dist=_PICK_DIST)
+        if index is not None:
+            self._ch_index = index
+            self._update_ch_selection()
+
+    def _set_image(self, image, state, make_data):
+        """Sets the data of an image unless it already shows 'state'
+
+        returns: whether the image was changed
+        """
+        if self._shown.get(image) == state:
+            return False
+        image.set_data(make_data())
+        self._shown[image] = state
+        return True
+
+    def _draw(self, axis=None):
+        """Update the figures, coalescing draws until Qt is idle."""
+        for axis in (range(3) if axis is None else [axis]):
+            self._figs[axis].canvas.draw_idle()
+
+    def _update_ct_images(self, axis=None, draw=False):
+        """Update the CT image(s) whose slice or thresholds changed."""
+        ct_min = self._ct_min_slider.value()
+        ct_max = self._ct_max_slider.value()
+        for axis in range(3) if axis is None else [axis]:
+            index = self._current_slice[axis]
+            changed = self._set_image(
+                self._images['ct'][axis], (index, ct_min, ct_max),
+                lambda: self._threshold_ct(axis, index, ct_min, ct_max))
+            if 'local_max' in self._images:
+                changed |= self._set_image(
+                    self._images['local_max'][axis],
+                    (index, id(self._ct_maxima)),
+                    lambda: np.take(self._ct_maxima, index, axis=axis).T)
+            if draw and changed:
+                self._draw(axis)
+
+    def _threshold_ct(self, axis, index, ct_min, ct_max):
+        """CT slice where only bright objects (electrodes) are visible"""
+        ct_data = self._slices['ct'].get(axis, index)
+        return np.where((ct_data < ct_min) | (ct_data > ct_max),
+                        np.nan, ct_data)
+
+    def _update_mri_images(self, axis=None, draw=False):
+        """Update the MRI image(s) whose slice changed."""
+        if 'mri' in self._images:
+            for axis in range(3) if axis is None else [axis]:
+                index = self._current_slice[axis]
+                changed = self._set_image(
+                    self._images['mri'][axis], index,
+                    lambda: self._slices['mri'].get(axis, index))
+                if draw and changed:
+                    self._draw(axis)
+
+    def _update_images(self, axis=None, draw=True):
+        """Update the images of the planes whose slice changed.
+
+        A channel image shows the contacts around the whole cursor
+        position at the current radius, so it is made again when either
+        changes. Marking or removing a channel sets it directly. Every
+        plane is still drawn as the cursors move in all of them.
+        """
+        self._update_ct_images(axis=axis)
+        state = (tuple(self._current_slice), self._radius)
+        for ii in range(3) if axis is None else [axis]:
+            self._set_image(self._images['chs'][ii], state,
+                            lambda: self._make_ch_image(ii))
+        self._update_mri_images(axis=axis)
+        if draw:
+            self._draw(axis)
+
 
 if __name__ == "__main__":
     # file paths seeg
@@ -159,25 +429,23 @@ if __name__ == "__main__":
     T1 = nib.load(op.join(misc_path, 'seeg', 'sample_seeg', 'mri', 'T1.mgz'))
 
     # For 3D ieeg
-    reg_affine = np.array([
-        [0.99270756, -0.03243313, 0.11610254, -133.094156],
-        [0.04374389, 0.99439665, -0.09623816, -97.58320673],
-        [-0.11233068, 0.10061512, 0.98856381, -84.45551601],
-        [0., 0., 0., 1.]])
-    # The above matrix is a pre computed solution to the registraion command
-    # below. this matrix is provided given the below command often takes
-    # upward of 15 minutes to run reg_affine,
-    # _ = mne.transforms.compute_volume_registration( CT_orig, T1,
-    # pipeline='rigids')
-    CT_aligned = apply_volume_registration(CT_orig, T1, reg_affine)
+    # registering the CT to the MRI often takes upward of 15 minutes, so the
+    # affine and the aligned CT are cached. The known solution for the
+    # sample data is imported so that even the first launch is a cache hit.
+    cache = VolumeCache()
+    cache.add_known_registrations(misc_path)
+    reg_affine = cache.registration(CT_orig, T1, pipeline='rigids')
+    CT_aligned = cache.aligned(CT_orig, T1, reg_affine)
     my_raw = mne.io.read_raw(
         op.join(misc_path, 'seeg', 'sample_seeg_ieeg.fif'))
     subj_trans = mne.coreg.estimate_head_mri_t(
         'sample_seeg', op.join(misc_path, 'seeg'))
     gui = Locator(my_raw, subj_trans, CT_aligned,
                   subject='sample_seeg',
-                  subjects_dir=op.join(misc_path, 'seeg'))
+                  subjects_dir=op.join(misc_path, 'seeg'), cache=cache)
     gui.show()
 
     # for 2d ieeg
-    App(my_raw).plot()
+    viewer = App(my_raw)
+    viewer.show()
+    app.exec_()
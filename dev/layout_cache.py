@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from bids import BIDSLayout
+
+cache_dir = os.path.join(Path.home(), ".cache", "bids_layouts")
+metadata_ext = (".json", ".tsv")  # files pybids reads the contents of
+
+
+def layout_fingerprint(root: str, **kwargs) -> str:
+    """Hash of everything a BIDSLayout of root depends on
+
+    Adding, removing or renaming a file changes the modification time of
+    its folder, so the modification times of all the folders catch changes
+    to the files indexed. The contents of data files are never read by
+    pybids, but those of the json and tsv sidecars are, so their own
+    modification times and sizes are included too. Walking the tree only
+    stats files, which is far cheaper than parsing them again.
+
+    root: root folder of the BIDS dataset
+    kwargs: arguments the layout is built with
+    """
+    digest = hashlib.sha256(json.dumps(
+        [os.path.abspath(root), kwargs], sort_keys=True,
+        default=str).encode("utf-8"))
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        if ".pybids" in dirs:
+            dirs.remove(".pybids")
+        stat = os.stat(folder)
+        digest.update("{}|{}\n".format(os.path.relpath(folder, root),
+                                       stat.st_mtime_ns).encode("utf-8"))
+        for name in sorted(files):
+            if name.endswith(metadata_ext):
+                stat = os.stat(os.path.join(folder, name))
+                digest.update("{}|{}|{}\n".format(
+                    name, stat.st_mtime_ns, stat.st_size).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def cached_layout(root: str, database_path: str = None,
+                  **kwargs) -> BIDSLayout:
+    """A BIDSLayout of root, reusing the index of a previous run if valid
+
+    pybids can store the index of a layout in a sqlite database and load
+    it back instead of walking and parsing the dataset again. The
+    fingerprint of the dataset is saved next to the database, and the
+    database is only reused if the fingerprint still matches. Otherwise
+    the whole layout is indexed again, since pybids cannot update part of
+    an existing index.
+
+    root: root folder of the BIDS dataset
+    database_path: folder of the database, by default one per root in
+    cache_dir
+    kwargs: passed on to BIDSLayout
+    """
+    if database_path is None:
+        database_path = os.path.join(cache_dir, hashlib.sha1(
+            os.path.abspath(root).encode("utf-8")).hexdigest())
+    fingerprint = layout_fingerprint(root, **kwargs)
+    stamp = os.path.join(database_path, "fingerprint.txt")
+    reuse = False
+    if os.path.isfile(stamp):
+        with open(stamp) as fobj:
+            reuse = fobj.read() == fingerprint
+    layout = BIDSLayout(root, database_path=database_path,
+                        reset_database=not reuse, **kwargs)
+    if not reuse:
+        with open(stamp, "w") as fobj:
+            fobj.write(fingerprint)
+    return layout
@@ -0,0 +1,186 @@
+from typing import Callable, Sequence, Tuple
+
+import mne
+import numpy as np
+
+chunk_samples = 2 ** 18  # samples per channel read at a time when building
+
+
+def reduce_minmax(mins: np.ndarray, maxs: np.ndarray, factor: int
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+    """Merges every 'factor' consecutive bins into one min/max bin
+
+    A last incomplete bin is padded with its own edge values, so it keeps
+    the extremes of the samples it does have.
+
+    mins: (n_channels, n_bins) minimum of each bin
+    maxs: (n_channels, n_bins) maximum of each bin
+    factor: number of bins merged together
+
+    returns: (n_channels, ceil(n_bins / factor)) mins and maxs
+    """
+    n_bins = mins.shape[1]
+    n_out = -(-n_bins // factor)
+    pad = n_out * factor - n_bins
+    if pad:
+        mins = np.pad(mins, ((0, 0), (0, pad)), mode="edge")
+        maxs = np.pad(maxs, ((0, 0), (0, pad)), mode="edge")
+    shape = (mins.shape[0], n_out, factor)
+    return mins.reshape(shape).min(axis=-1), maxs.reshape(shape).max(axis=-1)
+
+
+class MinMaxPyramid(object):
+    def __init__(self, read: Callable[[int, int], np.ndarray],
+                 n_channels: int, n_times: int, sfreq: float,
+                 base_bin: int = 256, factor: int = 4, min_bins: int = 1024,
+                 build: bool = True):
+        """Multi-resolution min/max envelopes of a multichannel recording
+
+        Drawing a trace at screen resolution only needs the minimum and
+        maximum of the samples falling in each pixel column. Level 0 holds
+        the min and max of every 'base_bin' samples and each following
+        level merges 'factor' bins of the previous one, down to the first
+        level with no more than 'min_bins' bins. The levels are built in one
+        pass over the data, chunk_samples at a time, and kept in memory as
+        float32: about 2 / base_bin of the size of the data.
+
+        Views finer than level 0 are computed from the samples when they
+        are requested, reading only the visible window, so hours of data
+        can be browsed without ever loading it all. A pyramid made with
+        build=False skips the pass over the data and reduces every window
+        from its samples instead, which is slower per window but ready at
+        once, e.g. to draw while the full pyramid is built elsewhere.
+
+        read: read(start, stop) returns samples [start, stop) of every
+        channel as an (n_channels, stop - start) array
+        n_channels: number of channels
+        n_times: number of samples per channel
+        sfreq: sampling frequency in Hz
+        base_bin: samples per bin of the finest precomputed level
+        factor: bins of a level merged into one bin of the next
+        min_bins: the coarsest level has at most this many bins
+        build: precompute the levels
+        """
+        super(MinMaxPyramid, self).__init__()
+        self.read = read
+        self.n_channels = n_channels
+        self.n_times = n_times
+        self.sfreq = sfreq
+        self.base_bin = base_bin
+        self.factor = factor
+        self.levels = []
+        if not build:
+            return
+        step = max(chunk_samples // base_bin, 1) * base_bin
+        mins, maxs = [], []
+        for start in range(0, n_times, step):
+            data = read(start, min(start + step, n_times))
+            lo, hi = reduce_minmax(data, data, base_bin)
+            mins.append(lo.astype(np.float32))
+            maxs.append(hi.astype(np.float32))
+        mins = np.concatenate(mins, axis=1) if mins else \
+            np.zeros((n_channels, 0), np.float32)
+        maxs = np.concatenate(maxs, axis=1) if maxs else mins
+        self.levels = [(base_bin, mins, maxs)]
+        while mins.shape[1] > min_bins:
+            mins, maxs = reduce_minmax(mins, maxs, factor)
+            self.levels.append((self.levels[-1][0] * factor, mins, maxs))
+
+    @classmethod
+    def from_raw(cls, raw: mne.io.BaseRaw, **kwargs) -> "MinMaxPyramid":
+        """Pyramid of a raw object, read lazily if it is not preloaded"""
+        return cls(lambda start, stop: raw.get_data(start=start, stop=stop),
+                   len(raw.ch_names), raw.n_times, raw.info["sfreq"],
+                   **kwargs)
+
+    @classmethod
+    def from_array(cls, data: np.ndarray, sfreq: float,
+                   **kwargs) -> "MinMaxPyramid":
+        """Pyramid of an (n_channels, n_times) array, e.g. a memory map"""
+        return cls(lambda start, stop: np.asarray(data[:, start:stop]),
+                   data.shape[0], data.shape[1], sfreq, **kwargs)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes taken by the precomputed levels"""
+        return sum(lo.nbytes + hi.nbytes for _, lo, hi in self.levels)
+
+    def spacing(self) -> float:
+        """Typical peak to peak amplitude of a channel, to space traces"""
+        if self.levels:
+            _, mins, maxs = self.levels[-1]
+        else:  # the first samples stand for the recording
+            data = self.read(0, min(self.n_times, chunk_samples))
+            mins, maxs = reduce_minmax(data, data, self.base_bin)
+        ptp = np.median(maxs - mins, axis=1) if mins.size else [0.]
+        spacing = float(np.median(ptp))
+        return spacing if spacing > 0 else 1.
+
+    def window(self, start: float, stop: float, width: int,
+               picks: Sequence[int] = None
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Min/max envelopes of a time window at a given resolution
+
+        The coarsest level whose bins are no wider than the window divided
+        by 'width' is used, merging its bins further so that no more than
+        about 'width' bins are returned. Windows short enough to need finer
+        bins than the precomputed levels are reduced from the samples; for
+        fewer samples than 'width' the samples themselves are returned as
+        both the mins and the maxs. Without levels (build=False) every
+        window is reduced from its samples.
+
+        start: start of the window in seconds
+        stop: end of the window in seconds
+        width: number of bins wanted, e.g. the width of the plot in pixels
+        picks: indices of the channels, all of them by default
+
+        returns: (n_bins,) times of the start of the bins in seconds and
+        (n_picks, n_bins) mins and maxs
+        """
+        picks = np.arange(self.n_channels) if picks is None \
+            else np.asarray(picks)
+        first = min(max(int(start * self.sfreq), 0), self.n_times)
+        last = min(max(int(np.ceil(stop * self.sfreq)), first),
+                   self.n_times)
+        ideal = (last - first) / max(width, 1)
+        if ideal < self.base_bin or not self.levels:
+            data = self.read(first, last)[picks] if last > first else \
+                np.zeros((len(picks), 0))
+            n_bin = max(int(ideal), 1)
+            if n_bin == 1:
+                mins = maxs = data
+            else:
+                mins, maxs = reduce_minmax(data, data, n_bin)
+            times = (first + np.arange(mins.shape[1]) * n_bin) / self.sfreq
+            return times, mins, maxs
+        n_bin, mins, maxs = [level for level in self.levels
+                             if level[0] <= ideal][-1]
+        lo, hi = first // n_bin, -(-last // n_bin)
+        mins, maxs = mins[picks, lo:hi], maxs[picks, lo:hi]
+        merge = int(ideal // n_bin)
+        if merge > 1:
+            mins, maxs = reduce_minmax(mins, maxs, merge)
+        times = (lo * n_bin + np.arange(mins.shape[1]) * n_bin * max(
+            merge, 1)) / self.sfreq
+        return times, mins, maxs
+
+
+def envelope_segments(times: np.ndarray, mins: np.ndarray,
+                      maxs: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Line segments drawing min/max envelopes, one per channel
+
+    Each bin becomes a vertical stroke from its min to its max, and the
+    strokes of a channel are joined into one zigzag line, which at screen
+    resolution looks exactly like the trace of every sample.
+
+    times: (n_bins,) times of the bins
+    mins: (n_channels, n_bins) minimum of each bin
+    maxs: (n_channels, n_bins) maximum of each bin
+    offsets: (n_channels,) vertical offset of each channel
+
+    returns: (n_channels, 2 * n_bins, 2) x, y points for a LineCollection
+    """
+    x = np.repeat(times, 2)
+    y = np.stack([mins, maxs], axis=-1).reshape(len(mins), -1)
+    y = y + np.asarray(offsets)[:, np.newaxis]
+    return np.stack([np.broadcast_to(x, y.shape), y], axis=-1)
@@ -0,0 +1,264 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import mne
+import numpy as np
+from numpy.lib.format import open_memmap
+
+chunk_samples = 100000  # samples per channel copied at a time when spilling
+
+
+class Recording(object):
+    def __init__(self, sub_id: str, scan_time: str, info: mne.Info,
+                 data_file: str, shape: Tuple[int, int], first_samp: int,
+                 annotations: mne.Annotations, store: "RecordingStore"):
+        """A stored recording: metadata in memory, samples on disk
+
+        Only the measurement info, annotations and the shape of the data
+        are kept in memory. The samples live in a .npy file which is
+        memory mapped when read, so holding a Recording costs kilobytes no
+        matter how long the recording is.
+
+        sub_id: the his_id of the patient
+        scan_time: the formatted measurement date of the recording
+        info: the measurement info of the raw object
+        data_file: path of the .npy file holding the samples
+        shape: (n_channels, n_times) of the samples
+        first_samp: first sample of the original raw object
+        annotations: annotations of the original raw object
+        store: the RecordingStore the recording belongs to
+        """
+        self.sub_id = sub_id
+        self.scan_time = scan_time
+        self.info = info
+        self.data_file = data_file
+        self.shape = shape
+        self.first_samp = first_samp
+        self.annotations = annotations
+        self.candidates = None  # events found by the analysis, once run
+        self._store = store
+
+    def __repr__(self) -> str:
+        return "<Recording {} {} | {} x {}>".format(
+            self.sub_id, self.scan_time, *self.shape)
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """(sub_id, scan_time) identifying the recording in its store"""
+        return self.sub_id, self.scan_time
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes taken by the samples once loaded into memory"""
+        return self.shape[0] * self.shape[1] * np.dtype(np.float64).itemsize
+
+    def get_data(self) -> np.ndarray:
+        """Read only memory map of the samples (n_channels, n_times)
+
+        Nothing is read from disk until the returned array is indexed, and
+        the operating system may drop the pages again at any time.
+        """
+        return np.load(self.data_file, mmap_mode="r")
+
+    @property
+    def raw(self) -> mne.io.RawArray:
+        """The recording as a preloaded raw object
+
+        The raw object is cached by the store until it is evicted to stay
+        within the store's memory budget.
+        """
+        return self._store.load(self)
+
+
+def _running(pid: int) -> bool:
+    """Whether a process is running, assumed when it cannot be told"""
+    if os.name != "posix":  # os.kill would terminate the process
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # it runs as another user
+        return True
+    return True
+
+
+class RecordingStore(Dict[str, Dict[str, Recording]]):
+    def __init__(self, root: str, memory_budget: int = 512 * 2 ** 20):
+        """Patient recordings with a bounded amount of data in memory
+
+        A dictionary of {sub_id: {scan_time: Recording}}. Adding a raw
+        object spills its samples to a .npy file, so only metadata stays
+        in the dictionary. Raw objects requested through
+        Recording.raw are cached in memory, evicting the least recently
+        used ones once their total size exceeds 'memory_budget' bytes.
+        The store is used from request threads and the analysis pool at
+        once, so the dictionary and the cache are changed under a lock.
+
+        Every store writes into its own folder of 'root', named after the
+        process id, since several server processes may share 'root'. The
+        metadata only lives in memory, so the folders of processes that
+        have exited are deleted.
+
+        root: folder the store makes its folder of .npy files in
+        memory_budget: maximum bytes of loaded raw objects kept in memory
+        """
+        super(RecordingStore, self).__init__()
+        self.root = root
+        self.memory_budget = memory_budget
+        self._loaded = OrderedDict()
+        self._lock = threading.RLock()
+        self._remove_orphans()
+        os.makedirs(root, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix="{}-".format(os.getpid()),
+                                          dir=root)
+
+    def _remove_orphans(self):
+        """Deletes the folders of stores whose process has exited"""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            match = re.fullmatch(r"(\d+)-\w+", name)
+            if match and not _running(int(match.group(1))):
+                shutil.rmtree(os.path.join(self.root, name),
+                              ignore_errors=True)
+
+    @property
+    def memory_used(self) -> int:
+        """Bytes of the raw objects currently cached in memory"""
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._loaded.values())
+
+    def add(self, sub_id: str, scan_time: str,
+            raw: mne.io.BaseRaw) -> Recording:
+        """Spills a raw object to disk and stores its metadata
+
+        The samples are copied into a memory mapped .npy file
+        chunk_samples at a time, so a raw object that was read with
+        preload=False never has to be fully loaded into memory. A
+        recording with the same sub_id and scan_time is replaced.
+
+        sub_id: the his_id of the patient
+        scan_time: the formatted measurement date of the recording
+        raw: the raw object to store
+        """
+        return self._spill(sub_id, scan_time, raw.info,
+                           (len(raw.ch_names), raw.n_times), raw.first_samp,
+                           raw.annotations,
+                           lambda start, stop: raw.get_data(start=start,
+                                                            stop=stop))
+
+    def add_array(self, sub_id: str, scan_time: str, info: mne.Info,
+                  data: np.ndarray, scales: np.ndarray = None,
+                  first_samp: int = 0,
+                  annotations: mne.Annotations = None) -> Recording:
+        """Spills an array of samples to disk and stores its metadata
+
+        Like add, for samples that are not in a raw object, e.g. decoded
+        from the binary transport format. The samples may have any dtype;
+        they are multiplied by their channel's scale chunk_samples at a
+        time while being written, so data is never converted as a whole.
+
+        sub_id: the his_id of the patient
+        scan_time: the formatted measurement date of the recording
+        info: the measurement info of the samples
+        data: (n_channels, n_times) samples
+        scales: factor of each channel converting data to volts
+        first_samp: first sample of the recording
+        annotations: annotations of the recording
+        """
+        if scales is None:
+            scales = np.ones(len(data))
+        scales = np.asarray(scales, dtype=np.float64)[:, np.newaxis]
+        if annotations is None:
+            annotations = mne.Annotations([], [], [],
+                                          orig_time=info["meas_date"])
+        return self._spill(sub_id, scan_time, info, data.shape, first_samp,
+                           annotations,
+                           lambda start, stop: data[:, start:stop] * scales)
+
+    def _spill(self, sub_id: str, scan_time: str, info: mne.Info,
+               shape: Tuple[int, int], first_samp: int,
+               annotations: mne.Annotations, read) -> Recording:
+        """Writes samples given by read(start, stop) to a new .npy file"""
+        data_file = os.path.join(self.directory, "{}.npy".format(
+            uuid.uuid4().hex))
+        out = open_memmap(data_file, mode="w+", dtype=np.float64,
+                          shape=shape)
+        for start in range(0, shape[1], chunk_samples):
+            stop = min(start + chunk_samples, shape[1])
+            out[:, start:stop] = read(start, stop)
+        out.flush()
+        del out
+        recording = Recording(sub_id, scan_time, info.copy(), data_file,
+                              tuple(shape), first_samp, annotations.copy(),
+                              self)
+        with self._lock:
+            if sub_id in self and scan_time in self[sub_id]:
+                self.remove(sub_id, scan_time)
+            self.setdefault(sub_id, {})[scan_time] = recording
+        return recording
+
+    def load(self, recording: Recording) -> mne.io.RawArray:
+        """Returns a recording as a raw object, evicting old ones as needed
+
+        recording: a recording of this store
+        """
+        key = recording.key
+        with self._lock:
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+                return self._loaded[key][0]
+        # read outside of the lock, so other recordings stay available
+        raw = mne.io.RawArray(np.array(recording.get_data()),
+                              recording.info, first_samp=recording.first_samp,
+                              verbose=False)
+        raw.set_annotations(recording.annotations)
+        with self._lock:
+            if key in self._loaded:  # loaded by another thread meanwhile
+                self._loaded.move_to_end(key)
+                return self._loaded[key][0]
+            self._loaded[key] = (raw, recording.nbytes)
+            self._evict()
+        return raw
+
+    def _evict(self):
+        """Drops least recently used raw objects until within the budget
+
+        The most recently loaded raw object is always kept, even if it is
+        larger than the budget on its own. Called with the lock held.
+        """
+        used = sum(nbytes for _, nbytes in self._loaded.values())
+        while len(self._loaded) > 1 and used > self.memory_budget:
+            used -= self._loaded.popitem(last=False)[1][1]
+
+    def recordings(self, sub_id: str) -> Dict[str, Recording]:
+        """Copy of the {scan_time: Recording} of a patient, empty if unknown
+
+        The copy is taken under the lock, so it can be iterated while
+        other threads add recordings.
+
+        sub_id: the his_id of the patient
+        """
+        with self._lock:
+            return dict(self.get(sub_id, {}))
+
+    def remove(self, sub_id: str, scan_time: str):
+        """Removes a recording and deletes its data file
+
+        sub_id: the his_id of the patient
+        scan_time: the formatted measurement date of the recording
+        """
+        with self._lock:
+            recording = self[sub_id].pop(scan_time)
+            self._loaded.pop(recording.key, None)
+            if not self[sub_id]:
+                del self[sub_id]
+        if os.path.isfile(recording.data_file):
+            os.remove(recording.data_file)
@@ -0,0 +1,201 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import List, Sequence
+
+scan_time_format = "%m/%d/%Y, %H:%M:%S"  # scan_time of pat_data recordings
+
+
+def scan_time_key(scan_time: str) -> str:
+    """ISO form of a scan_time, which sorts in time order
+
+    scan_time: time of a recording as stored in pat_data
+    """
+    try:
+        return datetime.strptime(scan_time, scan_time_format).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError("scan_time must be formatted as {}".format(
+            scan_time_format))
+
+
+class SelectionStore(object):
+    def __init__(self, path: str):
+        """A persistent sqlite table of the electrodes selected in reviews
+
+        Every row is one channel of one recording that the epileptologist
+        selected, with a label (e.g. "soz" for seizure onset zone), and
+        optionally the onset and duration of the event in seconds and a
+        note. Rows are indexed by patient, recording and channel and by
+        patient, label and channel, so both the selection of a recording
+        and the channels flagged across all the recordings of a patient
+        are read from an index instead of scanning the table. Recordings
+        are also indexed by the ISO form of their scan_time, so ranges of
+        recordings can be queried.
+
+        path: the sqlite database file (':memory:' for a temporary store)
+        """
+        super(SelectionStore, self).__init__()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS selections ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, sub_id TEXT NOT NULL, "
+                "scan_time TEXT NOT NULL, recorded TEXT NOT NULL, "
+                "channel TEXT NOT NULL, label TEXT NOT NULL, onset REAL, "
+                "duration REAL, note TEXT, author TEXT, created REAL)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS selections_recording ON "
+                "selections (sub_id, recorded, channel)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS selections_label ON "
+                "selections (sub_id, label, channel, recorded)")
+
+    def add(self, sub_id: str, scan_time: str, selections: Sequence[dict],
+            author: str = None, replace: bool = False) -> int:
+        """Stores the selected channels of a recording
+
+        sub_id: his_id of the patient
+        scan_time: time of the recording as stored in pat_data
+        selections: dictionaries with a "channel", a "label" and optionally
+        an "onset" and a "duration" (numbers) and a "note" (str)
+        author: who made the selection
+        replace: first delete the rows of the recording with the labels
+        in selections, so a review can be saved again
+
+        returns: number of rows stored
+        """
+        recorded = scan_time_key(scan_time)
+        rows = []
+        for selection in selections:
+            if not isinstance(selection, dict) or \
+                    not isinstance(selection.get("channel"), str) or \
+                    not isinstance(selection.get("label"), str):
+                raise ValueError("every selection needs a channel and a "
+                                 "label")
+            for key in ("onset", "duration"):
+                value = selection.get(key)
+                if value is not None and (
+                        not isinstance(value, (int, float)) or
+                        isinstance(value, bool)):
+                    raise ValueError("the {} of a selection must be a "
+                                     "number of seconds".format(key))
+            if not isinstance(selection.get("note"), (str, type(None))):
+                raise ValueError("the note of a selection must be a string")
+            rows.append((sub_id, scan_time, recorded, selection["channel"],
+                         selection["label"], selection.get("onset"),
+                         selection.get("duration"), selection.get("note"),
+                         author, time.time()))
+        with self._lock, self._db:
+            if replace:
+                self._db.executemany(
+                    "DELETE FROM selections WHERE sub_id = ? AND "
+                    "recorded = ? AND label = ?",
+                    {(sub_id, recorded, row[4]) for row in rows})
+            self._db.executemany(
+                "INSERT INTO selections (sub_id, scan_time, recorded, "
+                "channel, label, onset, duration, note, author, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    @staticmethod
+    def _where(sub_id: str, scan_time: str = None, channel: str = None,
+               label: str = None, start: str = None, stop: str = None):
+        """WHERE clause and parameters of the filters that are given"""
+        clauses, params = ["sub_id = ?"], [sub_id]
+        if scan_time is not None:
+            clauses.append("recorded = ?")
+            params.append(scan_time_key(scan_time))
+        if start is not None:
+            clauses.append("recorded >= ?")
+            params.append(scan_time_key(start))
+        if stop is not None:
+            clauses.append("recorded < ?")
+            params.append(scan_time_key(stop))
+        if channel is not None:
+            clauses.append("channel = ?")
+            params.append(channel)
+        if label is not None:
+            clauses.append("label = ?")
+            params.append(label)
+        return " AND ".join(clauses), params
+
+    def query(self, sub_id: str, scan_time: str = None, channel: str = None,
+              label: str = None, start: str = None, stop: str = None,
+              limit: int = 1000, offset: int = 0) -> List[dict]:
+        """Selections of a patient, in recording and channel order
+
+        sub_id: his_id of the patient
+        scan_time: only this recording
+        channel: only this channel
+        label: only this label
+        start: only recordings made at or after this scan_time
+        stop: only recordings made before this scan_time
+        limit: largest number of rows returned
+        offset: number of rows skipped, to page through results
+        """
+        where, params = self._where(sub_id, scan_time, channel, label,
+                                    start, stop)
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT scan_time, channel, label, onset, duration, note, "
+                "author FROM selections WHERE {} ORDER BY recorded, "
+                "channel, onset, id LIMIT ? OFFSET ?".format(where),
+                params + [limit, offset])
+            rows = cur.fetchall()
+            names = [col[0] for col in cur.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def channels(self, sub_id: str, label: str = None, start: str = None,
+                 stop: str = None) -> List[dict]:
+        """Every channel selected across the recordings of a patient
+
+        sub_id: his_id of the patient
+        label: only count selections with this label
+        start: only recordings made at or after this scan_time
+        stop: only recordings made before this scan_time
+
+        returns: one dictionary per channel with its number of
+        "selections", the number of "recordings" it was selected in and the
+        "first" and "last" scan_time it was selected in, most selected first
+        """
+        where, params = self._where(sub_id, label=label, start=start,
+                                    stop=stop)
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT channel, COUNT(*) AS selections, "
+                "COUNT(DISTINCT recorded) AS recordings, "
+                "MIN(recorded) AS first, MAX(recorded) AS last "
+                "FROM selections WHERE {} GROUP BY channel "
+                "ORDER BY recordings DESC, selections DESC, channel".format(
+                    where), params)
+            rows = cur.fetchall()
+            names = [col[0] for col in cur.description]
+        out = [dict(zip(names, row)) for row in rows]
+        for row in out:
+            for key in ("first", "last"):
+                row[key] = datetime.fromisoformat(row[key]).strftime(
+                    scan_time_format)
+        return out
+
+    def delete(self, sub_id: str, scan_time: str, channel: str = None,
+               label: str = None) -> int:
+        """Deletes selections of a recording and returns how many
+
+        sub_id: his_id of the patient
+        scan_time: time of the recording
+        channel: only this channel
+        label: only this label
+        """
+        where, params = self._where(sub_id, scan_time, channel, label)
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "DELETE FROM selections WHERE {}".format(where), params)
+        return cur.rowcount
+
+    def close(self):
+        """Closes the database connection"""
+        with self._lock:
+            self._db.close()
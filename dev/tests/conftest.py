@@ -0,0 +1,46 @@
+import json
+import os.path as op
+import threading
+
+import pytest
+from mne_bids import BIDSPath
+from werkzeug.serving import make_server
+
+from dev.chunked_upload import ChunkedUploads
+from dev.defaults import synthetic_raw
+
+
+class BIDSRoot(str):
+    """Root folder of a test dataset, with the raws written to it"""
+    raws = None
+
+
+@pytest.fixture
+def bids_root(tmp_path):
+    root = BIDSRoot(tmp_path / "bids")
+    root.raws = {}
+    for sub in ["01", "02"]:
+        for run in [1, 2]:
+            raw = synthetic_raw("sub-" + sub, duration=5., seed=run)
+            path = BIDSPath(subject=sub, run=run, task="rest", root=root,
+                            datatype="ieeg", suffix="ieeg", extension=".fif")
+            path.mkdir()
+            raw.save(path.fpath)
+            root.raws[(sub, run)] = raw
+    with open(op.join(root, "dataset_description.json"), "w") as fobj:
+        json.dump({"Name": "test", "BIDSVersion": "1.6.0"}, fobj)
+    with open(op.join(root, "participants.tsv"), "w") as fobj:
+        fobj.write("participant_id\nsub-01\nsub-02\n")
+    return root
+
+
+@pytest.fixture
+def eeg_server(tmp_path, monkeypatch):
+    from dev import eeg_final
+    monkeypatch.setattr(eeg_final, "uploads",
+                        ChunkedUploads(str(tmp_path / "chunks")))
+    server = make_server("127.0.0.1", 0, eeg_final.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_port)
+    server.shutdown()
@@ -0,0 +1,274 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from dev.alerts import AlertAggregator, AlertDispatcher, Outbox
+from dev.recording_store import RecordingStore
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers posts with the next queued status, recording the bodies"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append(body)
+        status = self.server.statuses.pop(0) if self.server.statuses \
+            else 200
+        time.sleep(self.server.delay)
+        try:
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(b"ok " + body)
+        except ConnectionError:  # the client timed out
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.received, server.statuses, server.delay = [], [], 0.
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:{}/".format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_delivery(tmp_path, stub):
+    dispatcher = AlertDispatcher(Outbox(str(tmp_path / "outbox.sqlite")))
+    delivered = []
+    dispatcher.handlers["nurse"] = lambda a, r: delivered.append((a, r))
+    stub.delay = 0.2
+    start = time.time()
+    ids = [dispatcher.send("nurse", stub.url, "pt{}".format(i))
+           for i in range(4)]
+    dispatcher.send("email", stub.url, {"to_email": "a@b.c"})
+    assert time.time() - start < 0.2  # sending does not wait for delivery
+    assert dispatcher.flush(5)
+    assert time.time() - start < 0.6  # the posts were made concurrently
+    assert sorted(a["body"] for a, _ in delivered) == \
+        ["pt0", "pt1", "pt2", "pt3"]
+    assert {a["id"] for a, _ in delivered} == set(ids)
+    assert ("pt0", "ok pt0") in [(a["body"], r) for a, r in delivered]
+    assert {"to_email": "a@b.c"} in [json.loads(body) for body in
+                                     stub.received if body[:1] == b"{"]
+    assert dispatcher.outbox.get(ids[0])["status"] == "sent"
+    dispatcher.stop()
+
+
+def test_retries(tmp_path, stub):
+    dispatcher = AlertDispatcher(Outbox(str(tmp_path / "outbox.sqlite")),
+                                 max_attempts=3, backoff=0.01)
+    stub.statuses = [503, 503]
+    alert_id = dispatcher.send("email", stub.url, "retry me")
+    assert dispatcher.flush(5)
+    alert = dispatcher.outbox.get(alert_id)
+    assert (alert["status"], alert["attempts"]) == ("sent", 3)
+    assert alert["response"] == "ok retry me"
+
+    # client errors and unreachable servers are given up on
+    stub.statuses = [400]
+    bad = dispatcher.send("email", stub.url, "bad")
+    gone = dispatcher.send("email", "http://127.0.0.1:1/", "gone", 1.)
+    assert dispatcher.flush(5)
+    assert dispatcher.outbox.get(bad)["attempts"] == 1
+    assert dispatcher.outbox.get(bad)["status"] == "dead"
+    assert dispatcher.outbox.get(gone)["attempts"] == 3
+    assert dispatcher.outbox.get(gone)["status"] == "dead"
+    dispatcher.stop()
+
+
+def test_timeout(tmp_path, stub):
+    dispatcher = AlertDispatcher(Outbox(str(tmp_path / "outbox.sqlite")),
+                                 max_attempts=1)
+    stub.delay = 0.5
+    alert_id = dispatcher.send("nurse", stub.url, "slow", timeout=0.1)
+    assert dispatcher.flush(5)
+    assert "timed out" in dispatcher.outbox.get(alert_id)["error"].lower()
+    dispatcher.stop()
+
+
+def test_outbox_survives_restart(tmp_path, stub):
+    path = str(tmp_path / "outbox.sqlite")
+    outbox = Outbox(path)
+    alert_id = outbox.put("email", stub.url, {"subject": "left over"}, 5.)
+    outbox.close()
+
+    dispatcher = AlertDispatcher(Outbox(path))
+    delivered = []
+    dispatcher.handlers["email"] = lambda a, r: delivered.append(a["id"])
+    dispatcher.start()
+    assert dispatcher.flush(5)
+    assert delivered == [alert_id]
+    assert json.loads(stub.received[0]) == {"subject": "left over"}
+    dispatcher.stop()
+
+
+def test_add_data_returns_before_alerts(tmp_path, stub, monkeypatch):
+    import io
+    from dev import eeg_final
+    from dev.defaults import synthetic_raw
+    raw = synthetic_raw("sub-33", duration=30., bursts=[(0, 10., 4.)])
+    raw.save(str(tmp_path / "up_ieeg.fif"))
+    with open(str(tmp_path / "up_ieeg.fif"), "rb") as fobj:
+        data = fobj.read()
+
+    dispatcher = AlertDispatcher(Outbox(str(tmp_path / "outbox.sqlite")))
+    dispatcher.handlers = dict(eeg_final.dispatcher.handlers)
+    aggregator = AlertAggregator(dispatcher, 0.1)
+    aggregator.formatters = dict(eeg_final.aggregator.formatters)
+    monkeypatch.setattr(eeg_final, "pat_data",
+                        RecordingStore(str(tmp_path / "store")))
+    monkeypatch.setattr(eeg_final, "dispatcher", dispatcher)
+    monkeypatch.setattr(eeg_final, "aggregator", aggregator)
+    monkeypatch.setattr(eeg_final, "email_url", stub.url)
+    monkeypatch.setattr(eeg_final, "nurse_port", stub.server_port)
+    monkeypatch.setattr(eeg_final, "patient_statuses", {})
+    stub.delay = 0.5
+    client = eeg_final.app.test_client()
+    start = time.time()
+    r = client.post("/database", data={
+        "raw_ieeg.fif": (io.BytesIO(data), "raw_ieeg.fif")})
+    assert r.status_code == 200
+    assert time.time() - start < 0.5
+    assert r.get_json()["analysis"] == "pending"
+    subject = "Patient sub-33 needs assistance"
+    assert eeg_final.patient_statuses == {}
+    for _ in range(500):
+        found = client.get("/analysis/sub-33").get_json()
+        if found != {r.get_json()["scan_time"]: "pending"}:
+            break
+        time.sleep(0.01)
+    assert [e["channel"] for e in found[r.get_json()["scan_time"]]] == \
+        ["LA1"]
+    assert dispatcher.flush(5)
+    assert eeg_final.patient_statuses == {
+        subject: ["ok " + subject]}
+    assert client.get("/alerts").get_json()["sent"] == 2
+    dispatcher.stop()
+
+
+def test_aggregator(tmp_path, stub):
+    dispatcher = AlertDispatcher(Outbox(str(tmp_path / "outbox.sqlite")))
+    aggregator = AlertAggregator(dispatcher, 0.3)
+    aggregator.formatters["email"] = lambda alerts: {"n": len(alerts)}
+
+    # the first alert of a group goes out right away
+    assert aggregator.add("email", stub.url, "a@b.c", {"t": 0}) is not None
+    assert dispatcher.flush(5)
+    assert json.loads(stub.received[0]) == {"n": 1}
+
+    # the rest of the burst is deduplicated and sent as one batch
+    for t in [1, 2, 2, 3, 1]:
+        assert aggregator.add("email", stub.url, "a@b.c", {"t": t}) is None
+    aggregator.add("email", stub.url, "d@e.f", {"t": 1})
+    assert aggregator.stats()["open_windows"] == 2
+    time.sleep(0.4)
+    assert dispatcher.flush(5)
+    assert sorted(json.loads(body)["n"] for body in stub.received) == \
+        [1, 1, 3]
+    assert aggregator.stats() == {
+        "events": 7, "sent": 3, "duplicates": 2, "coalesced": 2,
+        "suppressed": 4, "open_windows": 1}
+
+    # the window reopened after the batch, flush sends what it holds
+    aggregator.add("email", stub.url, "a@b.c", {"t": 4})
+    aggregator.add("email", stub.url, "a@b.c", {"t": 5})
+    aggregator.flush()
+    assert dispatcher.flush(5)
+    assert json.loads(stub.received[-1]) == {"n": 2}
+    assert aggregator.stats()["open_windows"] == 0
+    dispatcher.stop()
+
+
+def test_batch_email():
+    from dev.eeg_final import batch_email, batch_nurse
+    one = {"from_email": "f", "to_email": "t", "subject": "Patient 1",
+           "content": "ID: 1"}
+    two = dict(one, content="ID: 1 again")
+    three = dict(one, subject="Patient 2", content="ID: 2")
+    assert batch_email([one]) == one
+    assert batch_email([one, two, three]) == {
+        "from_email": "f", "to_email": "t",
+        "subject": "3 alerts: Patient 1; Patient 2",
+        "content": "ID: 1\nID: 1 again\nID: 2"}
+    assert batch_nurse([one, two]) == "Patient 1"
+
+
+def test_claims_and_kinds(tmp_path, stub):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    alert_id = outbox.put("email", stub.url, "once", 5.)
+    assert outbox.claim(alert_id)
+    assert not outbox.claim(alert_id)
+    assert outbox.pending() == []
+    outbox.close()
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))  # stopped mid delivery
+    assert outbox.pending() == [alert_id]
+
+    # an alert queued twice (restart and send at once) is posted once
+    dispatcher = AlertDispatcher(outbox, workers=2)
+    threads = [threading.Thread(target=dispatcher.start) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    dispatcher._enqueue("email", alert_id)
+    for thread in threads:
+        thread.join()
+    assert dispatcher.flush(5)
+    assert stub.received == [b"once"]
+
+    # slow nurse alerts do not hold up emails
+    stub.delay = 0.5
+    for i in range(3):
+        dispatcher.send("nurse", stub.url, "slow {}".format(i))
+    start = time.time()
+    email = dispatcher.send("email", stub.url, "fast")
+    while dispatcher.outbox.get(email)["status"] != "sent":
+        time.sleep(0.01)
+    assert time.time() - start < 0.8  # not after a nurse alert
+    assert dispatcher.flush(5)
+    dispatcher.stop()
+
+
+def test_emails_per_patient(tmp_path, stub, monkeypatch):
+    from dev import eeg_final
+    dispatcher = AlertDispatcher(Outbox(str(tmp_path / "outbox.sqlite")))
+    aggregator = AlertAggregator(dispatcher, 60.)
+    aggregator.formatters = dict(eeg_final.aggregator.formatters)
+    monkeypatch.setattr(eeg_final, "aggregator", aggregator)
+    monkeypatch.setattr(eeg_final, "email_url", stub.url)
+    for my_id, status in [("sub-a", "1"), ("sub-b", "1"), ("sub-a", "2")]:
+        eeg_final.emailing(my_id, "doc@duke.edu", status, "now")
+    assert dispatcher.flush(5)
+    # the first alert of another patient is not held by the open window
+    assert sorted(json.loads(body)["subject"] for body in stub.received) == \
+        ["Patient sub-a needs assistance", "Patient sub-b needs assistance"]
+    assert aggregator.stats()["coalesced"] == 0
+    aggregator.flush()
+    assert dispatcher.flush(5)
+    assert len(stub.received) == 3
+    dispatcher.stop()
+
+
+def test_candidates_after_alerts(tmp_path, monkeypatch):
+    from dev import eeg_final
+    from dev.defaults import synthetic_raw
+    store = RecordingStore(str(tmp_path / "store"))
+    recording = store.add("sub-35", "t", synthetic_raw(
+        "sub-35", duration=30., bursts=[(0, 10., 4.)]))
+    queued = []
+
+    def add(kind, url, group, alert, timeout=10.):
+        queued.append((kind, recording.candidates))
+
+    monkeypatch.setattr(eeg_final.aggregator, "add", add)
+    candidates = eeg_final.analyze(recording, "http://nurse/")
+    assert [kind for kind, _ in queued] == ["email", "nurse"]
+    assert all(seen is None for _, seen in queued)
+    assert recording.candidates == candidates != []
@@ -0,0 +1,45 @@
+import bids
+import numpy as np
+import pytest
+
+search = {"extension": "fif"}
+
+
+@pytest.fixture
+def layout(bids_root):
+    layout = bids.BIDSLayout(bids_root, validate=False)
+    layout.raws = bids_root.raws
+    return layout
+
+
+def test_iter_layout_raws(layout):
+    from dev.client import iter_layout_raws
+    found = {(sub, run): raw for sub, run, raw in
+             iter_layout_raws(layout, max_workers=2, **search)}
+    assert sorted(found) == sorted(layout.raws)
+    for key, raw in found.items():
+        assert not raw.preload
+        assert np.allclose(raw.get_data(), layout.raws[key].get_data())
+
+
+def test_layout_to_raw_dict(layout):
+    from dev.client import layout_to_raw_dict
+    data = layout_to_raw_dict(layout, max_workers=2, **search)
+    assert list(data) == ["01", "02"]
+    assert list(data["02"]) == [1, 2]
+    assert data["02"][2].preload
+    assert np.allclose(data["02"][2].get_data(),
+                       layout.raws[("02", 2)].get_data())
+
+
+def test_send_layout(layout, eeg_server):
+    from dev.client import send_layout
+    from dev.eeg_final import pat_data
+    answers = send_layout(layout, eeg_server + "/database", max_workers=2,
+                          **search)
+    assert sorted(answers) == ["01", "02"]
+    assert '"analysis":"pending"' in answers["01"][1].replace(" ", "")
+    answers = send_layout(layout, eeg_server, max_workers=2, chunked=True,
+                          **search)
+    assert sorted(answers["02"]) == [1, 2]
+    assert "sub-02" in pat_data
@@ -0,0 +1,99 @@
+import mne
+import numpy as np
+import pytest
+
+from dev.contacts import (ContactIndex, contact_image, contact_positions,
+                          group_names)
+
+
+def loop_image(vox, groups, center, voxel_sizes, xy_idx, radius, size,
+               proj=False):
+    """IntracranialElectrodeLocator._make_ch_image, one contact at a time"""
+    image = np.full((size, size), np.nan)
+    for xyz, group in zip(vox, groups):
+        if np.isnan(xyz).any():
+            continue
+        dist = np.linalg.norm(xyz - center)
+        if proj or dist < radius:
+            r = radius if proj else radius - np.round(abs(dist)).astype(int)
+            xf, yf = (xyz / voxel_sizes)[list(xy_idx)]
+            ex, ey = np.round(np.array([xf, yf]) * size).astype(int)
+            ii = np.arange(-r, r + 1)
+            ii_sq = ii * ii
+            idx = np.where(ii_sq + ii_sq[:, np.newaxis] < r * r)
+            image[-(ey + ii[idx[1]]), ex + ii[idx[0]]] = group
+    return image
+
+
+def test_contact_positions():
+    info = mne.create_info(["A1", "A2", "B1"], 1000., "seeg")
+    locs = np.array([[0.01, 0.02, 0.03], [-0.01, 0., 0.02],
+                     [np.nan, np.nan, np.nan]])
+    for ch, loc in zip(info["chs"], locs):
+        ch["loc"][:3] = loc
+    trans = np.eye(4)
+    trans[:3, 3] = [0.001, 0.002, 0.003]
+    pos = contact_positions(info, trans)
+    assert pos.shape == (3, 3)
+    np.testing.assert_allclose(pos[:2], (locs[:2] + trans[:3, 3]) * 1000)
+    assert np.isnan(pos[2]).all()
+
+
+def test_group_names():
+    names = ["RAMY 1", "LAMY1", "RAMY 2", "LAMY2", "X 10", "RAMY3"]
+    np.testing.assert_array_equal(group_names(names), [0, 1, 0, 1, 2, 0])
+    assert group_names([]).shape == (0,)
+
+
+@pytest.mark.parametrize("proj", [False, True])
+def test_contact_image_matches_loop(proj):
+    rng = np.random.default_rng(0)
+    vox = rng.uniform(40, 60, (200, 3))
+    vox[::7] = np.nan
+    groups = np.arange(200) % 9
+    center = np.array([50, 50, 50])
+    sizes = np.array([100, 100, 100])
+    for axis, xy_idx in enumerate([(1, 2), (0, 2), (0, 1)]):
+        expected = loop_image(vox, groups, center, sizes, xy_idx, 8, 256,
+                              proj)
+        image = contact_image(vox, groups, center, sizes, xy_idx, 8, 256,
+                              proj)
+        np.testing.assert_array_equal(image, expected)
+    empty = contact_image(vox + 100, groups, center, sizes, (0, 1), 8, 256)
+    assert np.isnan(empty).all()
+
+
+def test_contact_image_edges():
+    # contacts on the last and the first voxels have discs cut by the border
+    vox = np.array([[255., 255., 128.], [0., 0., 128.]])
+    sizes = np.array([256, 256, 256])
+    ii = np.arange(8)
+    quarter = (ii * ii + ii[:, np.newaxis] ** 2 < 64).sum()
+    image = contact_image(vox[:1], np.array([1.]), vox[0], sizes, (0, 1), 8,
+                          256)
+    assert image[-255, 255] == 1
+    assert (~np.isnan(image)).sum() == quarter
+    image = contact_image(vox[1:], np.array([2.]), vox[1], sizes, (0, 1), 8,
+                          256)
+    assert image[0, 0] == 2
+    assert np.isnan(image[:, -7:]).all()  # no wrapping around
+    assert (~np.isnan(image)).sum() == quarter
+    image = contact_image(vox, np.array([1., 2.]), vox[0], sizes, (0, 1), 8,
+                          256, proj=True)
+    assert image[-255, 255] == 1 and image[0, 0] == 2
+
+
+def test_contact_index():
+    pos = np.array([[0., 0., 0.], [10., 0., 0.], [np.nan] * 3,
+                    [0., 20., 0.]])
+    index = ContactIndex(pos)
+    assert index.nearest([9., 1., 0.]) == 1
+    assert index.nearest([0., 14., 0.], max_dist=5.) is None
+    np.testing.assert_array_equal(index.within([5., 0., 0.], 6.), [0, 1])
+    pos[2] = [9., 0., 0.]  # placed in place, as Locator does
+    pos[1] *= np.nan
+    assert index.nearest([9., 1., 0.]) == 2
+    np.testing.assert_array_equal(index.within([5., 0., 0.], 6.), [0, 2])
+    pos *= np.nan
+    assert index.nearest([0., 0., 0.]) is None
+    assert index.within([0., 0., 0.], 100.).size == 0
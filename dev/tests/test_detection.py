@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from dev import detection
+from dev.defaults import synthetic_raw
+
+
+def test_windows():
+    data = np.arange(20.).reshape(2, 10)
+    wins = detection.windows(data, 4, 3)
+    assert wins.shape == (2, 3, 4)
+    assert (wins[1, 2] == [16, 17, 18, 19]).all()
+    assert np.shares_memory(wins, data)
+
+
+def test_features():
+    sfreq = 100.
+    times = np.arange(200) / sfreq
+    data = np.array([np.sin(2 * np.pi * 10 * times),
+                     np.sin(2 * np.pi * 45 * times)])
+    wins = detection.windows(data, 100, 100)
+    power = detection.band_power(wins, sfreq, (4., 30.))
+    assert (power[0] > 100 * power[1]).all()
+    ll = detection.line_length(wins)
+    assert ll.shape == (2, 2)
+    assert (ll[1] > ll[0]).all()
+    z = detection.robust_z(np.array([[1., 2., 3., 100.], [5., 5., 5., 5.]]))
+    assert z[0, 3] > 50
+    assert (z[1] == 0).all()
+
+
+@pytest.mark.parametrize("block, wins", [(1, 64), (16, 1), (16, 7)])
+def test_detect(block, wins, monkeypatch):
+    monkeypatch.setattr(detection, "channel_block", block)
+    monkeypatch.setattr(detection, "window_block", wins)
+    raw = synthetic_raw(n_channels=3, duration=60.,
+                        bursts=[(1, 20., 5.), (2, 40., 3.)])
+    events = detection.detect(raw.get_data(), raw.info["sfreq"],
+                              raw.ch_names)
+    assert [e["channel"] for e in events] == ["LA2", "LA3"]
+    assert 17. <= events[0]["onset"] <= 20.
+    assert 25. <= events[0]["onset"] + events[0]["duration"] <= 28.
+    assert 37. <= events[1]["onset"] <= 40.
+    assert all(e["score"] > detection.threshold for e in events)
+
+
+def test_detect_noise():
+    raw = synthetic_raw(n_channels=8, duration=120.)
+    assert detection.detect(raw.get_data(), raw.info["sfreq"],
+                            raw.ch_names) == []
+    assert detection.detect(raw.get_data()[:, :100], raw.info["sfreq"],
+                            raw.ch_names) == []
+
+
+def test_detect_picks(tmp_path):
+    from numpy.lib.format import open_memmap
+    raw = synthetic_raw(n_channels=4, duration=60., bursts=[(2, 20., 5.)])
+    data = open_memmap(str(tmp_path / "data.npy"), mode="w+",
+                       shape=raw.get_data().shape)
+    data[:] = raw.get_data()
+    events = detection.detect(data, raw.info["sfreq"], raw.ch_names,
+                              picks=[0, 2])
+    assert [e["channel"] for e in events] == ["LA3"]
+    assert detection.detect(data, raw.info["sfreq"], raw.ch_names,
+                            picks=[0, 1, 3]) == []
+
+
+class Reads(object):
+    """Array recording the number of samples of every read"""
+
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.widths = []
+
+    def __getitem__(self, key):
+        out = self.data[key]
+        self.widths.append(out.shape[-1])
+        return out
+
+
+def test_detect_reads_blocks_of_windows(monkeypatch):
+    monkeypatch.setattr(detection, "window_block", 10)
+    raw = synthetic_raw(n_channels=3, duration=60.,
+                        bursts=[(1, 20., 5.)])
+    data = Reads(raw.get_data())
+    events = detection.detect(data, raw.info["sfreq"], raw.ch_names)
+    assert events == detection.detect(raw.get_data(), raw.info["sfreq"],
+                                      raw.ch_names)
+    sfreq = raw.info["sfreq"]
+    assert max(data.widths) == 9 * sfreq + 2 * sfreq  # 10 windows of 2 s
+    assert sum(data.widths) < 2 * raw.n_times
+
+
+def test_detect_onsets_use_whole_samples():
+    raw = synthetic_raw(n_channels=2, duration=60., bursts=[(0, 30., 5.)])
+    sfreq = raw.info["sfreq"]
+    events = detection.detect(raw.get_data(), sfreq, raw.ch_names,
+                              step=0.7)
+    n_step = int(round(0.7 * sfreq))
+    assert n_step / sfreq != 0.7
+    onset = events[0]["onset"]
+    assert np.isclose(onset * sfreq / n_step,
+                      round(onset * sfreq / n_step))
+    assert 25. <= onset <= 30.
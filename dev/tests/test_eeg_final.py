@@ -27,8 +27,9 @@ def test_databasing():  # raw, exp_database):
     raw1 = mne.io.read_raw_fif("raw_ieeg.fif", preload=True)
     databasing("raw_ieeg.fif")
     time1 = '07/24/1920, 19:35:19'
-    pat_data["sub-pt1"][time1].load_data()
-    assert pat_data == {"sub-pt1": {time1: raw1}}
+    assert list(pat_data.keys()) == ["sub-pt1"]
+    assert list(pat_data["sub-pt1"].keys()) == [time1]
+    assert (pat_data["sub-pt1"][time1].get_data() == raw1.get_data()).all()
 
     # adding second file to db
     misc_path = op.join(
@@ -36,8 +37,8 @@ def test_databasing():  # raw, exp_database):
     raw2 = mne.io.read_raw(misc_path, preload=True)
     databasing(misc_path)
     time2 = '10/18/2019, 11:09:44'
-    pat_data["sub-1"][time2].load_data()
-    assert pat_data == {"sub-pt1": {time1: raw1}, "sub-1": {time2: raw2}}
+    assert list(pat_data.keys()) == ["sub-pt1", "sub-1"]
+    assert (pat_data["sub-1"][time2].raw.get_data() == raw2.get_data()).all()
 
 
 """
@@ -80,3 +81,43 @@ def test_log_email():
             "root", "INFO", 'Patient Needing Help: patient id 1,'
                             ' status info nice, to nurse or doctor at '
                             'email cool@guy.com'))
+
+
+def test_read_upload(tmp_path):
+    import io
+    from dev.defaults import synthetic_raw
+    from dev.eeg_final import read_upload
+    raw = synthetic_raw("sub-7")
+    raw.save(op.join(tmp_path, "up_ieeg.fif"))
+    with open(op.join(tmp_path, "up_ieeg.fif"), "rb") as fobj:
+        data = fobj.read()
+
+    # small uploads are parsed from memory
+    small = read_upload(io.BytesIO(data))
+    assert small.preload
+    assert small.info["subject_info"]["his_id"] == "sub-7"
+
+    # large uploads are only read lazily from their own file
+    big_path = op.join(tmp_path, "big_ieeg.fif")
+    with open(big_path, "wb") as fobj:
+        fobj.write(data)
+    big = read_upload(open(big_path, "r+b"))
+    assert not big.preload
+    assert big.filenames[0] == big_path
+    assert (big.get_data() == small.get_data()).all()
+
+
+def test_upload_streams(tmp_path, monkeypatch):
+    import io
+    from dev import eeg_final
+    monkeypatch.setattr(eeg_final, "upload_dir", str(tmp_path))
+    for limit, kind in [(10 ** 6, io.BytesIO), (0, None)]:
+        monkeypatch.setattr(eeg_final, "in_memory_size", limit)
+        with eeg_final.app.test_request_context(
+                "/database", method="POST",
+                data={"raw_ieeg.fif": (io.BytesIO(b"fif"), "raw_ieeg.fif")}):
+            stream = eeg_final.request.files["raw_ieeg.fif"].stream
+            if kind is None:
+                assert op.dirname(stream.name) == str(tmp_path)
+            else:
+                assert isinstance(stream, kind)
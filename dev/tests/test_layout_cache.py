@@ -0,0 +1,59 @@
+import os
+import os.path as op
+
+import pytest
+from bids.layout.index import BIDSLayoutIndexer
+
+from dev.layout_cache import cached_layout, layout_fingerprint
+
+
+@pytest.fixture
+def indexed(monkeypatch):
+    """Counts how many times a dataset is indexed from scratch"""
+    calls = []
+    original = BIDSLayoutIndexer.__call__
+
+    def count(self, layout):
+        calls.append(layout.root)
+        return original(self, layout)
+    monkeypatch.setattr(BIDSLayoutIndexer, "__call__", count)
+    return calls
+
+
+def test_cached_layout(bids_root, tmp_path, indexed):
+    db = str(tmp_path / "db")
+    files = cached_layout(bids_root, db, validate=False).get(extension="fif")
+    assert len(files) == 4 and len(indexed) == 1
+
+    # unchanged datasets are loaded from the database
+    layout = cached_layout(bids_root, db, validate=False)
+    assert len(indexed) == 1
+    assert [f.path for f in layout.get(extension="fif")] == \
+        [f.path for f in files]
+    assert layout.get_subjects() == ["01", "02"]
+
+    # new files and edited sidecars are picked up
+    raw = bids_root.raws[("01", 1)]
+    path = op.join(bids_root, "sub-01", "ieeg",
+                   "sub-01_task-rest_run-03_ieeg.fif")
+    raw.save(path)
+    layout = cached_layout(bids_root, db, validate=False)
+    assert len(indexed) == 2
+    assert len(layout.get(extension="fif")) == 5
+    with open(op.join(bids_root, "participants.tsv"), "a") as fobj:
+        fobj.write("sub-03\n")
+    cached_layout(bids_root, db, validate=False)
+    assert len(indexed) == 3
+
+    # so are different arguments
+    cached_layout(bids_root, db, validate=False, regex_search=True)
+    assert len(indexed) == 4
+
+
+def test_layout_fingerprint(bids_root):
+    first = layout_fingerprint(bids_root)
+    assert first == layout_fingerprint(bids_root)
+    assert first != layout_fingerprint(bids_root, validate=False)
+    os.remove(op.join(bids_root, "sub-02", "ieeg",
+                      "sub-02_task-rest_run-02_ieeg.fif"))
+    assert first != layout_fingerprint(bids_root)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from dev import preview
+from dev.defaults import synthetic_raw
+from dev.preview import MinMaxPyramid, envelope_segments, reduce_minmax
+
+
+def brute_force(data, first, n_bin):
+    """Min and max of every n_bin samples of data from sample first"""
+    out = []
+    for start in range(first, data.shape[1], n_bin):
+        block = data[:, start:start + n_bin]
+        out.append((block.min(axis=1), block.max(axis=1)))
+    return np.array([o[0] for o in out]).T, np.array([o[1] for o in out]).T
+
+
+def test_reduce_minmax():
+    data = np.array([[1., 5., 2., 0., 3.]])
+    mins, maxs = reduce_minmax(data, data, 2)
+    assert mins.tolist() == [[1., 0., 3.]]
+    assert maxs.tolist() == [[5., 2., 3.]]
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((3, 100003))
+
+
+def test_levels(data, monkeypatch):
+    monkeypatch.setattr(preview, "chunk_samples", 1000)
+    pyramid = MinMaxPyramid.from_array(data, 1000., base_bin=16, factor=4,
+                                       min_bins=100)
+    assert [level[0] for level in pyramid.levels] == [16, 64, 256, 1024]
+    assert pyramid.levels[-1][1].shape == (3, 98)
+    for n_bin, mins, maxs in pyramid.levels:
+        lo, hi = brute_force(data, 0, n_bin)
+        assert np.allclose(mins, lo) and np.allclose(maxs, hi)
+    assert pyramid.nbytes < data.nbytes / 6
+
+
+@pytest.mark.parametrize("start, stop, width, n_bin", [
+    (0., 100., 100, 768), (10., 30., 200, 64), (20.008, 21., 50, 16),
+    (5., 5.5, 100, 5), (5., 5.05, 100, 1), (99.9, 200., 100, 1)])
+def test_window(data, start, stop, width, n_bin):
+    pyramid = MinMaxPyramid.from_array(data, 1000., base_bin=16, factor=4,
+                                       min_bins=100)
+    times, mins, maxs = pyramid.window(start, stop, width, [0, 2])
+    assert mins.shape == maxs.shape == (2, len(times))
+    assert len(times) <= 2 * width
+    assert np.allclose(np.diff(times), n_bin / 1000.)
+    first = int(round(times[0] * 1000))
+    assert first <= start * 1000 < first + n_bin
+    lo, hi = brute_force(data[[0, 2]], first, n_bin)
+    lo, hi = lo[:, :len(times)], hi[:, :len(times)]
+    assert np.allclose(mins, lo) and np.allclose(maxs, hi)
+
+
+def test_fine_windows_are_read_lazily():
+    raw = synthetic_raw(n_channels=2, duration=60.)
+    reads = []
+    pyramid = MinMaxPyramid(
+        lambda start, stop: reads.append((start, stop)) or
+        raw.get_data(start=start, stop=stop), 2, raw.n_times,
+        raw.info["sfreq"], base_bin=64, min_bins=10)
+    reads.clear()
+    pyramid.window(0., 60., 100)
+    assert reads == []
+    times, mins, maxs = pyramid.window(30., 31., 1000)
+    assert reads == [(30 * 256, 31 * 256)]
+    assert np.allclose(mins, raw.get_data(start=30 * 256, stop=31 * 256))
+
+
+@pytest.mark.parametrize("start, stop, width", [
+    (0., 100., 100), (10., 30., 200), (5., 5.05, 100)])
+def test_unbuilt_window(data, start, stop, width):
+    reads = []
+    pyramid = MinMaxPyramid(
+        lambda first, last: reads.append((first, last)) or
+        data[:, first:last], 3, data.shape[1], 1000., base_bin=16,
+        build=False)
+    assert pyramid.levels == [] and reads == []
+    times, mins, maxs = pyramid.window(start, stop, width, [0, 2])
+    assert reads == [(int(start * 1000), min(int(stop * 1000),
+                                             data.shape[1]))]
+    n_bin = max(int((reads[0][1] - reads[0][0]) / width), 1)
+    lo, hi = brute_force(data[[0, 2], :reads[0][1]], reads[0][0], n_bin)
+    assert np.allclose(mins, lo) and np.allclose(maxs, hi)
+    assert np.allclose(times[1:] - times[:-1], n_bin / 1000.)
+    assert pyramid.spacing() > 0
+
+
+def test_envelope_segments():
+    segments = envelope_segments(np.array([0., 1.]),
+                                 np.array([[0., 1.], [2., 3.]]),
+                                 np.array([[4., 5.], [6., 7.]]),
+                                 np.array([0., -10.]))
+    assert segments.shape == (2, 4, 2)
+    assert segments[0, :, 0].tolist() == [0., 0., 1., 1.]
+    assert segments[1, :, 1].tolist() == [-8., -4., -7., -3.]
@@ -0,0 +1,88 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from dev import recording_store
+from dev.defaults import synthetic_raw
+from dev.recording_store import RecordingStore
+
+
+def test_add_and_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(recording_store, "chunk_samples", 100)
+    store = RecordingStore(str(tmp_path))
+    folder = tmp_path / os.path.basename(store.directory)
+    raw = synthetic_raw("sub-1", duration=3.)
+    rec = store.add("sub-1", "t1", raw)
+    assert store == {"sub-1": {"t1": rec}}
+    assert isinstance(rec.get_data(), np.memmap)
+    assert (rec.get_data() == raw.get_data()).all()
+    assert rec.raw.ch_names == raw.ch_names
+    assert rec.raw.info["meas_date"] == raw.info["meas_date"]
+    assert (rec.raw.get_data() == raw.get_data()).all()
+
+    # same key replaces the recording and its file
+    old_file = rec.data_file
+    store.add("sub-1", "t1", synthetic_raw("sub-1", seed=1))
+    assert not (folder / old_file).exists()
+    assert len(list(folder.iterdir())) == 1
+    store.remove("sub-1", "t1")
+    assert store == {}
+    assert len(list(folder.iterdir())) == 0
+
+
+def test_memory_budget(tmp_path):
+    raws = [synthetic_raw("sub-{}".format(i), seed=i) for i in range(3)]
+    nbytes = raws[0].get_data().nbytes
+    store = RecordingStore(str(tmp_path), memory_budget=2 * nbytes)
+    recs = [store.add(raw.info["subject_info"]["his_id"], "t", raw)
+            for raw in raws]
+    assert store.memory_used == 0  # nothing is loaded by adding
+    recs[0].raw
+    recs[1].raw
+    recs[0].raw  # most recently used
+    recs[2].raw
+    assert store.memory_used == 2 * nbytes
+    assert set(store._loaded.keys()) == {recs[0].key, recs[2].key}
+
+
+def test_lazy_source(tmp_path):
+    raw = synthetic_raw("sub-9", meas_date=datetime(2021, 5, 1,
+                                                    tzinfo=timezone.utc))
+    raw.save(str(tmp_path / "src_ieeg.fif"))
+    import mne
+    lazy = mne.io.read_raw_fif(str(tmp_path / "src_ieeg.fif"), preload=False)
+    store = RecordingStore(str(tmp_path / "store"))
+    rec = store.add("sub-9", "t", lazy)
+    assert not lazy.preload
+    assert np.allclose(rec.get_data(), raw.get_data())
+
+
+def test_orphans_and_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    import subprocess
+    import sys
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    (tmp_path / "{}-old".format(exited.pid)).mkdir()
+    (tmp_path / "{}-old".format(exited.pid) / "a.npy").write_bytes(b"")
+    (tmp_path / "notes.npy").write_bytes(b"")
+    first = RecordingStore(str(tmp_path))
+    rec = first.add("sub-1", "t", synthetic_raw("sub-1"))
+    # another store (e.g. another server process) keeps the live files
+    store = RecordingStore(str(tmp_path))
+    assert os.path.isfile(rec.data_file)
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        [os.path.basename(first.directory),
+         os.path.basename(store.directory), "notes.npy"])
+    assert store.recordings("sub-1") == {}
+    assert first.recordings("sub-1") == {"t": rec}
+
+    raws = [synthetic_raw("sub-{}".format(i), seed=i) for i in range(8)]
+    store.memory_budget = 2 * raws[0].get_data().nbytes
+    recs = [store.add("sub-{}".format(i), "t", raw)
+            for i, raw in enumerate(raws)]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: recs[i % 8].raw, range(200)))
+    assert len(store._loaded) == 2
+    assert store.memory_used == store.memory_budget
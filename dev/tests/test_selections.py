@@ -0,0 +1,111 @@
+import pytest
+
+from dev.selections import SelectionStore, scan_time_key
+
+times = ["01/02/2022, 10:00:00", "12/30/2021, 09:00:00",
+         "01/10/2022, 08:30:00"]
+
+
+@pytest.fixture
+def store():
+    store = SelectionStore(":memory:")
+    store.add("p1", times[0], [{"channel": "LAMY1", "label": "soz"},
+                               {"channel": "LAMY2", "label": "soz"},
+                               {"channel": "LAMY2", "label": "spike",
+                                "onset": 12.5, "duration": 0.2}])
+    store.add("p1", times[1], [{"channel": "LAMY2", "label": "soz"},
+                               {"channel": "RHH3", "label": "soz",
+                                "note": "late spread"}], author="dr")
+    store.add("p1", times[2], [{"channel": "LAMY2", "label": "soz"}])
+    store.add("p2", times[0], [{"channel": "LAMY1", "label": "soz"}])
+    yield store
+    store.close()
+
+
+def test_scan_time_key():
+    assert scan_time_key(times[1]) < scan_time_key(times[0])
+    with pytest.raises(ValueError):
+        scan_time_key("2022-01-02")
+    with pytest.raises(ValueError):
+        scan_time_key(None)
+
+
+def test_query(store):
+    rows = store.query("p1")
+    assert [row["scan_time"] for row in rows] == \
+        [times[1]] * 2 + [times[0]] * 3 + [times[2]]
+    assert rows[1] == {"scan_time": times[1], "channel": "RHH3",
+                       "label": "soz", "onset": None, "duration": None,
+                       "note": "late spread", "author": "dr"}
+    assert len(store.query("p1", scan_time=times[0])) == 3
+    assert len(store.query("p1", channel="LAMY2", label="soz")) == 3
+    ranged = store.query("p1", start=times[0], stop=times[2])
+    assert {row["scan_time"] for row in ranged} == {times[0]}
+    assert store.query("p1", limit=2, offset=4) == rows[4:]
+    assert store.query("p3") == []
+
+
+def test_channels(store):
+    channels = store.channels("p1", label="soz")
+    assert [row["channel"] for row in channels] == ["LAMY2", "LAMY1",
+                                                    "RHH3"]
+    assert channels[0] == {"channel": "LAMY2", "selections": 3,
+                           "recordings": 3, "first": times[1],
+                           "last": times[2]}
+    lamy2 = store.channels("p1", start=times[0])[0]
+    assert (lamy2["selections"], lamy2["recordings"]) == (3, 2)
+
+
+def test_replace_and_delete(store):
+    store.add("p1", times[0], [{"channel": "LAMY3", "label": "soz"}],
+              replace=True)
+    assert [(row["channel"], row["label"]) for row in store.query(
+        "p1", scan_time=times[0])] == [("LAMY2", "spike"), ("LAMY3", "soz")]
+    assert store.delete("p1", times[0], label="spike") == 1
+    assert store.delete("p1", times[0]) == 1
+    assert store.query("p1", scan_time=times[0]) == []
+    with pytest.raises(ValueError):
+        store.add("p1", times[0], [{"channel": "LAMY1"}])
+
+
+@pytest.mark.parametrize("field", [
+    {"onset": "12.5"}, {"onset": [1.]}, {"duration": {"s": 1}},
+    {"duration": True}, {"note": 5}, {"note": ["late"]}])
+def test_add_checks_types(store, field):
+    selection = dict({"channel": "LAMY1", "label": "soz"}, **field)
+    with pytest.raises(ValueError):
+        store.add("p3", times[0], [selection])
+    assert store.query("p3") == []
+    store.add("p3", times[0], [{"channel": "LAMY1", "label": "soz",
+                                "onset": 1, "duration": 0.5, "note": None}])
+
+
+def test_endpoints(monkeypatch):
+    from dev import eeg_final
+    monkeypatch.setattr(eeg_final, "selections", SelectionStore(":memory:"))
+    client = eeg_final.app.test_client()
+    r = client.post("/selections/p1", json={
+        "scan_time": times[0], "author": "dr",
+        "selections": [{"channel": "LAMY1", "label": "soz"},
+                       {"channel": "LAMY2", "label": "soz"}]})
+    assert r.status_code == 200 and r.get_json()["stored"] == 2
+    client.post("/selections/p1", json={
+        "scan_time": times[1],
+        "selections": [{"channel": "LAMY1", "label": "soz"}]})
+    r = client.get("/selections/p1", query_string={"channel": "LAMY1"})
+    assert len(r.get_json()["selections"]) == 2
+    r = client.get("/selections/p1/channels", query_string={"label": "soz"})
+    assert [(row["channel"], row["recordings"]) for row in
+            r.get_json()["channels"]] == [("LAMY1", 2), ("LAMY2", 1)]
+    r = client.delete("/selections/p1", query_string={"scan_time": times[1]})
+    assert r.get_json() == {"deleted": 1}
+    assert client.post("/selections/p1", json={
+        "scan_time": "yesterday", "selections": []}).status_code == 400
+    assert client.post("/selections/p1", data="x").status_code == 400
+    assert client.post("/selections/p1", json={
+        "scan_time": times[0], "selections": [
+            {"channel": "LAMY1", "label": "soz", "onset": [1]}]}
+    ).status_code == 400
+    assert client.get("/selections/p1", query_string={
+        "start": "soon"}).status_code == 400
+    assert client.delete("/selections/p1").status_code == 400
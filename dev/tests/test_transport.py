@@ -0,0 +1,110 @@
+import json
+
+import mne
+import numpy as np
+import pytest
+import requests
+
+from dev import transport
+from dev.defaults import synthetic_raw
+
+
+@pytest.mark.parametrize("dtype, compression, tol", [
+    ("float32", None, 1e-6), ("float32", "gzip", 1e-6),
+    ("int16", None, 1e-4), ("int16", "gzip", 1e-4)])
+def test_round_trip(dtype, compression, tol):
+    raw = synthetic_raw("sub-39", duration=3.)
+    raw.info["bads"] = ["LA2"]
+    raw.set_annotations(mne.Annotations([1.], [.5], ["spike"],
+                                        orig_time=raw.info["meas_date"]))
+    header, data = transport.decode(transport.encode(raw, dtype,
+                                                     compression))
+    assert data.dtype == transport.dtypes[dtype]
+    back = transport.to_raw(header, data)
+    assert np.allclose(back.get_data(), raw.get_data(), rtol=0,
+                       atol=tol * np.abs(raw.get_data()).max())
+    assert back.ch_names == raw.ch_names
+    assert back.info["bads"] == ["LA2"]
+    assert back.info["meas_date"] == raw.info["meas_date"]
+    assert back.info["subject_info"]["his_id"] == "sub-39"
+    assert list(back.annotations.description) == ["spike"]
+    assert back.annotations.onset[0] == raw.annotations.onset[0]
+
+
+def test_zero_copy_and_size(tmp_path):
+    raw = synthetic_raw(duration=10.)
+    buffer = bytearray(transport.encode(raw))
+    _, data = transport.decode(buffer)
+    assert np.shares_memory(data, np.frombuffer(buffer, np.uint8))
+    raw.save(str(tmp_path / "raw.fif"))
+    fif_size = (tmp_path / "raw.fif").stat().st_size
+    assert len(transport.encode(raw)) < fif_size
+    assert len(transport.encode(raw, "int16")) < fif_size / 2
+
+
+@pytest.mark.parametrize("buffer", [
+    b"EEG", b"FIFF" + bytes(10), b"EEGB\x02" + bytes(4),
+    b"EEGB\x01\x02\x00\x00\x00{}",
+])
+def test_malformed(buffer):
+    with pytest.raises(transport.TransportError):
+        transport.decode(buffer)
+
+
+def _with_header(encoded, **changes):
+    """Re-encodes a binary recording with header fields changed or
+    removed (None as value removes a field)"""
+    length = transport.prefix.unpack_from(encoded)[2]
+    start = transport.prefix.size
+    header = json.loads(encoded[start:start + length])
+    for key, value in changes.items():
+        if value is None:
+            del header[key]
+        else:
+            header[key] = value
+    header = json.dumps(header).encode("utf-8")
+    return transport.prefix.pack(transport.magic, transport.version,
+                                 len(header)) + header + \
+        encoded[start + length:]
+
+
+@pytest.mark.parametrize("changes", [
+    {"sfreq": None}, {"sfreq": "fast"}, {"sfreq": 0}, {"sfreq": True},
+    {"ch_types": None}, {"ch_types": ["seeg"]}, {"ch_types": 4},
+    {"ch_types": ["seeg", "seeg", "seeg", "bogus"]},
+    {"bads": None}, {"bads": ["XX1"]}, {"bads": "LA1"},
+    {"scales": None}, {"scales": [1., 1.]}, {"scales": [1, 1, 1, "a"]},
+    {"first_samp": None}, {"first_samp": -1}, {"first_samp": 1.5},
+    {"annotations": None}, {"annotations": []},
+    {"annotations": {"onset": [1.], "duration": [],
+                     "description": ["x"]}},
+    {"meas_date": None}, {"meas_date": "yesterday"}, {"meas_date": 5},
+    {"his_id": 7}, {"compression": "rar"}, {"ch_names": ["LA1"]},
+])
+def test_invalid_header(changes):
+    encoded = transport.encode(synthetic_raw(n_channels=4))
+    transport.decode(_with_header(encoded))
+    with pytest.raises(transport.TransportError):
+        transport.decode(_with_header(encoded, **changes))
+
+
+def test_truncated():
+    encoded = transport.encode(synthetic_raw())
+    with pytest.raises(transport.TransportError):
+        transport.decode(encoded[:-2])
+
+
+def test_send_raw_binary(eeg_server):
+    from dev.client import send_raw_binary
+    from dev.eeg_final import pat_data
+    raw = synthetic_raw("sub-40", duration=4.)
+    answer = send_raw_binary(raw, eeg_server, "int16", "gzip")
+    assert '"subject":"sub-40"' in answer.replace(" ", "")
+    scan_time = raw.info["meas_date"].strftime("%m/%d/%Y, %H:%M:%S")
+    stored = pat_data["sub-40"][scan_time]
+    assert np.allclose(stored.get_data(), raw.get_data(), rtol=0,
+                       atol=1e-4 * np.abs(raw.get_data()).max())
+    assert stored.raw.info["sfreq"] == raw.info["sfreq"]
+    r = requests.post(eeg_server + "/database/binary",
+                      data=b"FIFF" + bytes(10))
+    assert r.status_code == 400 and "not a binary" in r.text
@@ -0,0 +1,305 @@
+import os
+import os.path as op
+
+import numpy as np
+import pytest
+import requests
+
+from dev.chunked_upload import ChunkedUploads, UploadError, sha256
+
+
+def test_chunked_uploads(tmp_path):
+    uploads = ChunkedUploads(str(tmp_path), max_size=100)
+    data = bytes(range(25))
+    session = uploads.create(25, sha256(data), 10)
+    upload_id = session["upload_id"]
+    assert session["n_chunks"] == 3
+    assert uploads.missing(upload_id) == [0, 1, 2]
+
+    uploads.put(upload_id, 2, data[20:], sha256(data[20:]))
+    uploads.put(upload_id, 0, data[:10], sha256(data[:10]))
+    assert uploads.session(upload_id)["received"] == [0, 2]
+    with pytest.raises(UploadError) as e:
+        uploads.complete(upload_id)
+    assert e.value.status == 409
+
+    # corrupted, truncated and misplaced chunks are refused
+    for index, chunk, checksum, status in [
+            (1, data[10:20], sha256(b"x"), 422),
+            (1, data[10:19], sha256(data[10:19]), 400),
+            (3, data[:5], sha256(data[:5]), 400)]:
+        with pytest.raises(UploadError) as e:
+            uploads.put(upload_id, index, chunk, checksum)
+        assert e.value.status == status
+    assert uploads.missing(upload_id) == [1]
+
+    # an upload survives a restart of the server
+    uploads = ChunkedUploads(str(tmp_path))
+    uploads.put(upload_id, 1, data[10:20], sha256(data[10:20]))
+    with open(uploads.complete(upload_id), "rb") as fobj:
+        assert fobj.read() == data
+    uploads.discard(upload_id)
+    assert not op.exists(op.join(str(tmp_path), upload_id))
+
+
+@pytest.mark.parametrize("upload_id, status", [
+    ("../" * 10, 400), ("0" * 32, 404)])
+def test_unknown_uploads(tmp_path, upload_id, status):
+    with pytest.raises(UploadError) as e:
+        ChunkedUploads(str(tmp_path)).session(upload_id)
+    assert e.value.status == status
+
+
+def test_create_errors(tmp_path):
+    uploads = ChunkedUploads(str(tmp_path), max_size=100)
+    for size, checksum, chunk_size, status in [
+            (101, "0" * 64, 10, 413), (0, "0" * 64, 10, 400),
+            (10, "abc", 10, 400), (10, "0" * 64, 0, 400)]:
+        with pytest.raises(UploadError) as e:
+            uploads.create(size, checksum, chunk_size)
+        assert e.value.status == status
+
+
+def test_expire_and_finish(tmp_path):
+    uploads = ChunkedUploads(str(tmp_path), ttl=60.)
+    data = bytes(range(25))
+    idle = uploads.create(25, sha256(data), 10)["upload_id"]
+    done = uploads.create(25, sha256(data), 10)["upload_id"]
+    for index in range(3):
+        chunk = data[index * 10:(index + 1) * 10]
+        uploads.put(done, index, chunk, sha256(chunk))
+    assert uploads.claim(done) and not uploads.claim(done)
+    uploads.release(done)
+    assert not uploads.session(done)["completing"]
+    assert uploads.claim(done)
+    uploads.complete(done)
+    uploads.finish(done, {"subject": "sub-36"})
+    assert uploads.completed(done) == {"subject": "sub-36"}
+    assert uploads.session(done)["completed"]
+    assert uploads.completed(idle) is None
+    assert sorted(os.listdir(op.join(str(tmp_path), done))) == [
+        "completing", "result.json", "session.json"]  # the data is gone
+    for call in [lambda: uploads.complete(done),
+                 lambda: uploads.put(done, 0, data[:10], sha256(data[:10]))]:
+        with pytest.raises(UploadError) as e:
+            call()
+        assert e.value.status == 409
+
+    # sessions untouched for longer than the ttl go when a new one starts
+    old = os.path.getmtime(op.join(str(tmp_path), idle, "session.json"))
+    os.utime(op.join(str(tmp_path), idle, "session.json"),
+             (old - 120., old - 120.))
+    uploads.create(25, sha256(data), 10)
+    assert not op.exists(op.join(str(tmp_path), idle))
+    assert uploads.completed(done) == {"subject": "sub-36"}
+
+
+def test_complete_retry_and_invalid(tmp_path, monkeypatch):
+    from dev import eeg_final
+    from dev.defaults import synthetic_raw
+    monkeypatch.setattr(eeg_final, "uploads",
+                        ChunkedUploads(str(tmp_path / "chunks")))
+    client = eeg_final.app.test_client()
+
+    def upload(data):
+        upload_id = client.post("/upload", json={
+            "size": len(data), "sha256": sha256(data),
+            "chunk_size": len(data)}).get_json()["upload_id"]
+        r = client.put("/upload/{}/0".format(upload_id), data=data,
+                       headers={"X-Chunk-Sha256": sha256(data)})
+        assert r.status_code == 200
+        return upload_id
+
+    # a whole upload that is not a fif file is the client's fault
+    upload_id = upload(b"not a fif file")
+    r = client.post("/upload/{}/complete".format(upload_id))
+    assert r.status_code == 400
+    assert "not a valid fif file" in r.get_data(as_text=True)
+    assert os.listdir(str(tmp_path / "chunks")) == []
+
+    # completing again after a lost answer gives the same answer
+    raw = synthetic_raw("sub-39", duration=5.)
+    raw.save(str(tmp_path / "raw_ieeg.fif"))
+    with open(str(tmp_path / "raw_ieeg.fif"), "rb") as fobj:
+        upload_id = upload(fobj.read())
+    first = client.post("/upload/{}/complete".format(upload_id))
+    assert first.status_code == 200
+    again = client.post("/upload/{}/complete".format(upload_id))
+    assert again.status_code == 200
+    assert again.get_json() == first.get_json()
+
+
+def test_concurrent_completes(tmp_path, monkeypatch):
+    import threading
+    import time
+    from dev import eeg_final
+    from dev.defaults import synthetic_raw
+    monkeypatch.setattr(eeg_final, "uploads",
+                        ChunkedUploads(str(tmp_path / "chunks")))
+    ingested = []
+
+    def slow_ingest(raw):
+        ingested.append(raw)
+        time.sleep(0.5)
+        return {"subject": "sub-41"}
+
+    monkeypatch.setattr(eeg_final, "ingest", slow_ingest)
+    raw = synthetic_raw("sub-41", duration=5.)
+    raw.save(str(tmp_path / "raw_ieeg.fif"))
+    with open(str(tmp_path / "raw_ieeg.fif"), "rb") as fobj:
+        data = fobj.read()
+    client = eeg_final.app.test_client()
+    upload_id = client.post("/upload", json={
+        "size": len(data), "sha256": sha256(data),
+        "chunk_size": len(data)}).get_json()["upload_id"]
+    client.put("/upload/{}/0".format(upload_id), data=data,
+               headers={"X-Chunk-Sha256": sha256(data)})
+
+    answers = []
+
+    def complete():
+        answers.append(eeg_final.app.test_client().post(
+            "/upload/{}/complete".format(upload_id)))
+
+    threads = [threading.Thread(target=complete) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+    session = client.get("/upload/{}".format(upload_id)).get_json()
+    assert session["completing"] and not session["completed"]
+    for thread in threads:
+        thread.join()
+    assert len(ingested) == 1
+    assert sorted(r.status_code for r in answers) == [200, 202]
+    r = client.post("/upload/{}/complete".format(upload_id))
+    assert (r.status_code, r.get_json()) == (200, {"subject": "sub-41"})
+    assert client.get("/upload/{}".format(upload_id)).get_json()[
+        "completed"]
+    eeg_final.uploads.finish(upload_id, {"subject": "sub-41"})  # no data
+
+
+class TimeoutSession(requests.Session):
+    """Session whose first POST to complete times out while it runs on"""
+
+    def __init__(self):
+        super(TimeoutSession, self).__init__()
+        self.posts = []
+        self.first = None
+
+    def request(self, method, url, **kwargs):
+        if method == "POST" and url.endswith("/complete"):
+            self.posts.append(url)
+            if self.first is None:
+                import threading
+                self.first = threading.Thread(
+                    target=super(TimeoutSession, self).request,
+                    args=(method, url), kwargs=kwargs)
+                self.first.start()
+                raise requests.ReadTimeout("read timed out")
+        return super(TimeoutSession, self).request(method, url, **kwargs)
+
+
+def test_complete_outlasts_timeout(eeg_server, tmp_path, monkeypatch):
+    import time
+    from dev import eeg_final
+    from dev.client import send_file_chunked
+    from dev.defaults import synthetic_raw
+    ingest = eeg_final.ingest
+    ingested = []
+
+    def slow_ingest(raw):
+        ingested.append(raw)
+        time.sleep(0.5)
+        return ingest(raw)
+
+    monkeypatch.setattr(eeg_final, "ingest", slow_ingest)
+    raw = synthetic_raw("sub-42", duration=5.)
+    path = str(tmp_path / "slow_ieeg.fif")
+    raw.save(path)
+    session = TimeoutSession()
+    answer = send_file_chunked(path, eeg_server, backoff=0.1, poll=0.05,
+                               session=session)
+    session.first.join()
+    assert '"subject":"sub-42"' in answer.replace(" ", "")
+    assert len(ingested) == 1
+    assert len(session.posts) == 3  # timed out, 202, the stored answer
+
+
+class FlakySession(requests.Session):
+    """Session whose PUTs fail after the first 'limit' ones"""
+
+    def __init__(self, limit):
+        super(FlakySession, self).__init__()
+        self.limit = limit
+        self.puts = 0
+
+    def request(self, method, url, **kwargs):
+        if method == "PUT":
+            self.puts += 1
+            if self.puts > self.limit:
+                raise requests.ConnectionError("link dropped")
+        return super(FlakySession, self).request(method, url, **kwargs)
+
+
+def test_send_raw_chunked(tmp_path, eeg_server):
+    from dev.client import UploadInterrupted, send_file_chunked, \
+        send_raw_chunked
+    from dev.defaults import synthetic_raw
+    from dev.eeg_final import pat_data
+    raw = synthetic_raw("sub-36", duration=10.)
+    answer = send_raw_chunked(raw, eeg_server, chunk_size=4096)
+    assert '"subject":"sub-36"' in answer.replace(" ", "")
+    scan_time = raw.info["meas_date"].strftime("%m/%d/%Y, %H:%M:%S")
+    assert np.allclose(pat_data["sub-36"][scan_time].get_data(),
+                       raw.get_data())
+
+    # an interrupted upload only sends its missing chunks when resumed
+    raw = synthetic_raw("sub-37", duration=10.)
+    path = str(tmp_path / "resume_ieeg.fif")
+    raw.save(path)
+    n_chunks = -(-op.getsize(path) // 4096)
+    flaky = FlakySession(3)
+    with pytest.raises(UploadInterrupted) as e:
+        send_file_chunked(path, eeg_server, 4096, retries=2, backoff=0.,
+                          session=flaky)
+    assert flaky.puts == 5
+    steady = FlakySession(n_chunks)
+    send_file_chunked(path, eeg_server, 4096, e.value.upload_id,
+                      session=steady)
+    assert steady.puts == n_chunks - 3
+    assert np.allclose(pat_data["sub-37"][scan_time].get_data(),
+                       raw.get_data())
+
+
+def test_failed_ingest_discards_upload(tmp_path, monkeypatch):
+    import io
+    from dev import eeg_final
+    from dev.defaults import synthetic_raw
+    monkeypatch.setattr(eeg_final, "upload_dir", str(tmp_path / "uploads"))
+    monkeypatch.setattr(eeg_final, "in_memory_size", 0)
+    raw = synthetic_raw("sub-38")
+    raw.info["subject_info"] = None  # databasing cannot find the patient
+    raw.save(op.join(str(tmp_path), "raw_ieeg.fif"))
+    with open(op.join(str(tmp_path), "raw_ieeg.fif"), "rb") as fobj:
+        data = fobj.read()
+    r = eeg_final.app.test_client().post("/database", data={
+        "raw_ieeg.fif": (io.BytesIO(data), "raw_ieeg.fif")})
+    assert r.status_code == 500
+    assert os.listdir(str(tmp_path / "uploads")) == []
+
+
+def test_rejected_upload_is_deleted(tmp_path, monkeypatch):
+    import io
+    from dev import eeg_final
+    monkeypatch.setattr(eeg_final, "upload_dir", str(tmp_path / "uploads"))
+    monkeypatch.setattr(eeg_final, "in_memory_size", 1024)
+    data = bytes(4096)
+    client = eeg_final.app.test_client()
+    r = client.post("/database", data={
+        "wrong_name.fif": (io.BytesIO(data), "raw_ieeg.fif")})
+    assert r.status_code == 400
+    r = client.post("/database", data={
+        "raw_ieeg.fif": (io.BytesIO(data), "raw_ieeg.fif"),
+        "extra.fif": (io.BytesIO(data), "extra.fif")})
+    assert r.status_code == 500  # zeros are not a fif file
+    assert os.listdir(str(tmp_path / "uploads")) == []
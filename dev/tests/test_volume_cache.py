@@ -0,0 +1,124 @@
+import json
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from dev import volume_cache
+from dev.volume_cache import (SliceCache, VolumeCache, load_image,
+                              volume_hash)
+
+
+@pytest.fixture
+def volumes(tmp_path):
+    rng = np.random.default_rng(0)
+    affine = np.diag([-1., 1., 1., 1.])  # LAS, reoriented by load_image
+    paths = []
+    for name in ("ct.mgz", "t1.mgz"):
+        data = rng.random((8, 9, 10)).astype(np.float32)
+        path = str(tmp_path / name)
+        nib.save(nib.MGHImage(data, affine), path)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = {"compute": 0, "apply": 0}
+
+    def compute(moving, static, pipeline):
+        calls["compute"] += 1
+        return np.eye(4) * 2, None
+
+    def apply(moving, static, affine):
+        calls["apply"] += 1
+        static = nib.load(static) if isinstance(static, str) else static
+        return nib.Nifti1Image(np.full(static.shape, 3.), static.affine)
+
+    monkeypatch.setattr(volume_cache, "compute_volume_registration", compute)
+    monkeypatch.setattr(volume_cache, "apply_volume_registration", apply)
+    return calls
+
+
+def test_volume_hash(volumes):
+    ct, t1 = volumes
+    assert volume_hash(ct) == volume_hash(nib.load(ct))
+    assert volume_hash(ct) != volume_hash(t1)
+    img = nib.load(ct)
+    copy = nib.MGHImage(np.asanyarray(img.dataobj), img.affine)
+    assert volume_hash(copy) == volume_hash(
+        nib.MGHImage(np.asanyarray(img.dataobj), img.affine))
+    assert volume_hash(copy) != volume_hash(
+        nib.MGHImage(np.asanyarray(img.dataobj), np.eye(4)))
+
+
+def test_registration_computed_once(tmp_path, volumes, calls):
+    ct, t1 = volumes
+    cache = VolumeCache(str(tmp_path / "cache"))
+    affine = cache.registration(ct, t1)
+    np.testing.assert_array_equal(affine, np.eye(4) * 2)
+    np.testing.assert_array_equal(
+        VolumeCache(str(tmp_path / "cache")).registration(
+            nib.load(ct), nib.load(t1)), affine)
+    assert calls["compute"] == 1
+    cache.registration(ct, t1, pipeline="all")
+    cache.registration(t1, ct)
+    assert calls["compute"] == 3
+
+
+def test_known_registrations(tmp_path, volumes, calls):
+    ct, t1 = volumes
+    known = [{"moving": "ct.mgz", "static": "t1.mgz", "pipeline": "rigids",
+              "affine": np.eye(4).tolist()},
+             {"moving": "missing.mgz", "static": "t1.mgz",
+              "pipeline": "rigids", "affine": np.eye(4).tolist()}]
+    fname = tmp_path / "known.json"
+    fname.write_text(json.dumps(known))
+    cache = VolumeCache(str(tmp_path / "cache"))
+    cache.add_known_registrations(str(tmp_path), str(fname))
+    np.testing.assert_array_equal(cache.registration(ct, t1), np.eye(4))
+    assert calls["compute"] == 0
+
+
+def test_aligned_is_memory_mapped(tmp_path, volumes, calls):
+    ct, t1 = volumes
+    cache = VolumeCache(str(tmp_path / "cache"))
+    first = cache.aligned(ct, t1, np.eye(4))
+    second = cache.aligned(ct, t1, np.eye(4))
+    assert calls["apply"] == 1
+    data = np.asanyarray(second.dataobj)
+    assert isinstance(data, np.memmap)
+    assert data.dtype == np.float32
+    np.testing.assert_array_equal(data, np.asanyarray(first.dataobj))
+    np.testing.assert_array_equal(second.affine, nib.load(t1).affine)
+    cache.aligned(ct, t1, np.eye(4) * 2)
+    assert calls["apply"] == 2
+
+
+def test_image(tmp_path, volumes):
+    ct, _ = volumes
+    cache = VolumeCache(str(tmp_path / "cache"))
+    expected, vox_ras_t = load_image(ct)
+    cache.image(ct)
+    data, cached_t = cache.image(nib.load(ct))
+    assert isinstance(data, np.memmap)
+    np.testing.assert_array_equal(data, expected)
+    np.testing.assert_array_equal(cached_t, vox_ras_t)
+    assert len(list((tmp_path / "cache").iterdir())) == 2
+
+
+def test_slice_cache():
+    volume = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+    slices = SliceCache(volume, maxsize=2)
+    for axis in range(3):
+        np.testing.assert_array_equal(slices.get(axis, 1),
+                                      np.take(volume, 1, axis=axis).T)
+    assert slices.misses == 3 and len(slices._slices) == 2
+    assert slices.nbytes == (4 * 5 + 4 * 6) * 4  # axis 0 was evicted
+    slices.get(2, 1)
+    slices.get(1, 1)
+    assert slices.hits == 2
+    slices.get(0, 2)
+    assert (1, 1) in slices._slices and (2, 1) not in slices._slices
+    with pytest.raises(ValueError):
+        slices.get(0, 2)[0, 0] = 1
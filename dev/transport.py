@@ -0,0 +1,230 @@
+import json
+import math
+import struct
+from datetime import datetime
+from typing import Tuple
+
+import mne
+import numpy as np
+
+from compression import compress, decompress
+
+magic = b"EEGB"
+version = 1
+prefix = struct.Struct("<4sBI")  # magic, version, header length
+dtypes = {"float32": np.dtype("<f4"), "int16": np.dtype("<i2")}
+content_type = "application/x-eeg-binary"
+
+
+class TransportError(ValueError):
+    """Raised when a binary recording is malformed"""
+
+
+def encode(raw: mne.io.BaseRaw, dtype: str = "float32",
+           compression: str = None) -> bytes:
+    """Packs a raw object into the compact binary format
+
+    The format is the 4 byte magic b"EEGB", a version byte, the length of
+    a json header as a little endian uint32, the json header and then the
+    samples as a little endian (n_channels, n_times) array. The header
+    holds what the server needs to rebuild the recording: sfreq, channel
+    names and types, bads, measurement date, his_id, first_samp and
+    annotations. Samples are sent as float32, or as int16 scaled per
+    channel so that the largest absolute value maps to 32767, which halves
+    the size again at a resolution of 1 / 65534 of each channel's range.
+    The samples can also be compressed with gzip or zstd.
+
+    raw: the raw object to encode
+    dtype: "float32" or "int16"
+    compression: None, "gzip" or "zstd"
+    """
+    if dtype not in dtypes:
+        raise ValueError("dtype must be one of {}".format(list(dtypes)))
+    data = raw.get_data()
+    if dtype == "int16":
+        scales = np.abs(data).max(axis=1) / 32767.
+        scales[scales == 0] = 1.
+        data = np.round(data / scales[:, np.newaxis])
+    else:
+        scales = np.ones(len(data))
+    payload = data.astype(dtypes[dtype]).tobytes()
+    if compression is not None:
+        payload = compress(payload, compression)
+    info = raw.info
+    meas_date = info["meas_date"]
+    annotations = raw.annotations
+    header = {"sfreq": float(info["sfreq"]), "ch_names": info["ch_names"],
+              "ch_types": raw.get_channel_types(), "bads": info["bads"],
+              "meas_date": None if meas_date is None
+              else meas_date.isoformat(),
+              "his_id": (info["subject_info"] or {}).get("his_id"),
+              "first_samp": int(raw.first_samp), "n_times": int(raw.n_times),
+              "dtype": dtype, "scales": scales.tolist(),
+              "compression": compression,
+              "annotations": {"onset": annotations.onset.tolist(),
+                              "duration": annotations.duration.tolist(),
+                              "description": list(
+                                  annotations.description)}}
+    header = json.dumps(header).encode("utf-8")
+    return prefix.pack(magic, version, len(header)) + header + payload
+
+
+def _number(value) -> bool:
+    """Whether a json value is a finite int or float (not a bool)"""
+    return isinstance(value, (int, float)) and \
+        not isinstance(value, bool) and \
+        (isinstance(value, int) or math.isfinite(value))
+
+
+def _strings(value) -> bool:
+    """Whether a json value is a list of strings"""
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def check_header(header) -> dict:
+    """Raises TransportError unless a header has every field, well typed
+
+    Only the fields are checked, not the samples: the number of channels
+    is the number of ch_names, and ch_types, scales and bads have to
+    agree with it.
+
+    header: decoded json header
+
+    returns: the header
+    """
+    if not isinstance(header, dict):
+        raise TransportError("invalid header: not a json object")
+    missing = [key for key in ["sfreq", "ch_names", "ch_types", "bads",
+                               "meas_date", "first_samp", "n_times",
+                               "dtype", "scales", "annotations"]
+               if key not in header]
+    if missing:
+        raise TransportError("invalid header: missing {}".format(
+            ", ".join(missing)))
+    if header["dtype"] not in dtypes:
+        raise TransportError("invalid header: unknown dtype {!r}".format(
+            header["dtype"]))
+    if not _number(header["sfreq"]) or header["sfreq"] <= 0:
+        raise TransportError("invalid header: sfreq must be positive")
+    for key in ["first_samp", "n_times"]:
+        if not isinstance(header[key], int) or \
+                isinstance(header[key], bool) or header[key] < 0:
+            raise TransportError(
+                "invalid header: {} must be a natural number".format(key))
+    ch_names = header["ch_names"]
+    if not _strings(ch_names) or not ch_names:
+        raise TransportError("invalid header: ch_names must be a list of "
+                             "channel names")
+    if not _strings(header["ch_types"]) or \
+            len(header["ch_types"]) != len(ch_names):
+        raise TransportError("invalid header: ch_types must have a type "
+                             "per channel")
+    try:  # MNE knows the channel types, not a public list of them
+        kinds = sorted(set(header["ch_types"]))
+        mne.create_info([str(i) for i in range(len(kinds))], 1., kinds)
+    except (KeyError, ValueError) as e:
+        raise TransportError("invalid header: {}".format(e))
+    if not isinstance(header["scales"], list) or \
+            len(header["scales"]) != len(ch_names) or \
+            not all(_number(scale) for scale in header["scales"]):
+        raise TransportError("invalid header: scales must have a number "
+                             "per channel")
+    if not _strings(header["bads"]) or \
+            not set(header["bads"]) <= set(ch_names):
+        raise TransportError("invalid header: bads must be channel names")
+    if header["meas_date"] is not None:
+        try:
+            datetime.fromisoformat(header["meas_date"])
+        except (TypeError, ValueError):
+            raise TransportError("invalid header: meas_date must be an iso "
+                                 "formatted date or null")
+    if header.get("compression") not in [None, "gzip", "zstd"]:
+        raise TransportError("invalid header: compression must be null, "
+                             "gzip or zstd")
+    if not isinstance(header.get("his_id"), (str, type(None))):
+        raise TransportError("invalid header: his_id must be a string or "
+                             "null")
+    annotations = header["annotations"]
+    if not isinstance(annotations, dict) or \
+            not all(isinstance(annotations.get(key), list) for key in
+                    ["onset", "duration", "description"]) or \
+            not all(_number(v) for v in annotations["onset"] +
+                    annotations["duration"]) or \
+            not _strings(annotations["description"]) or \
+            not len(annotations["onset"]) == len(annotations["duration"]) \
+            == len(annotations["description"]):
+        raise TransportError("invalid header: annotations must have as "
+                             "many onsets, durations and descriptions")
+    return header
+
+
+def decode(buffer) -> Tuple[dict, np.ndarray]:
+    """Reads the header and samples of the compact binary format
+
+    Uncompressed samples are not copied: the returned array is a read
+    only view into 'buffer'. Multiply it by header["scales"] (per channel)
+    to get the samples in volts. The header is checked by check_header,
+    so the recording can be rebuilt from it.
+
+    buffer: bytes (or any buffer) made by encode
+
+    returns: the header dictionary and the (n_channels, n_times) samples
+    in their wire dtype
+    """
+    view = memoryview(buffer)
+    if len(view) < prefix.size:
+        raise TransportError("binary recording is truncated")
+    tag, ver, length = prefix.unpack_from(view)
+    if tag != magic:
+        raise TransportError("not a binary recording")
+    if ver != version:
+        raise TransportError("unsupported version {}".format(ver))
+    try:
+        header = json.loads(bytes(view[prefix.size:prefix.size + length]))
+    except ValueError as e:
+        raise TransportError("invalid header: {}".format(e))
+    check_header(header)
+    dtype = dtypes[header["dtype"]]
+    shape = (len(header["ch_names"]), header["n_times"])
+    payload = view[prefix.size + length:]
+    size = shape[0] * shape[1] * dtype.itemsize
+    if header.get("compression"):
+        try:
+            payload = decompress(bytes(payload), header["compression"],
+                                 size)
+        except ValueError as e:
+            raise TransportError(str(e))
+    if len(payload) != size:
+        raise TransportError("expected {} bytes of samples, got {}".format(
+            size, len(payload)))
+    return header, np.frombuffer(payload, dtype).reshape(shape)
+
+
+def header_to_info(header: dict) -> mne.Info:
+    """Builds the measurement info described by a header"""
+    info = mne.create_info(header["ch_names"], header["sfreq"],
+                           header["ch_types"])
+    with info._unlock():
+        info["bads"] = list(header["bads"])
+        if header["meas_date"] is not None:
+            info["meas_date"] = datetime.fromisoformat(header["meas_date"])
+        info["subject_info"] = {"his_id": header["his_id"]}
+    return info
+
+
+def header_to_annotations(header: dict) -> mne.Annotations:
+    """Builds the annotations described by a header"""
+    annotations = header["annotations"]
+    orig_time = None if header["meas_date"] is None \
+        else datetime.fromisoformat(header["meas_date"])
+    return mne.Annotations(annotations["onset"], annotations["duration"],
+                           annotations["description"], orig_time=orig_time)
+
+
+def to_raw(header: dict, data: np.ndarray) -> mne.io.RawArray:
+    """Builds a raw object from decoded samples, e.g. on the client"""
+    samples = data * np.asarray(header["scales"])[:, np.newaxis]
+    raw = mne.io.RawArray(samples, header_to_info(header),
+                          first_samp=header["first_samp"], verbose=False)
+    raw.set_annotations(header_to_annotations(header))
+    return raw
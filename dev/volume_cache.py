@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple, Union
+
+import nibabel as nib
+import numpy as np
+from mne.transforms import (apply_volume_registration,
+                            compute_volume_registration)
+
+cache_dir = os.path.join(Path.home(), ".cache", "ieeg_volumes")
+known_registrations = os.path.join(os.path.dirname(__file__),
+                                   "registrations.json")
+
+Volume = Union[str, nib.spatialimages.SpatialImage]
+
+
+def volume_hash(img: Volume) -> str:
+    """Hex sha256 digest identifying a volume
+
+    Volumes read from a file are identified by the bytes of the file,
+    which is cheaper than decoding it. Volumes made in memory (e.g. by a
+    registration) are identified by their data, shape and affine.
+
+    img: path of a volume or a nibabel image
+    """
+    digest = hashlib.sha256()
+    fname = img if isinstance(img, (str, os.PathLike)) else \
+        img.get_filename()
+    if fname is not None:
+        with open(fname, "rb") as fobj:
+            for block in iter(lambda: fobj.read(2 ** 22), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    data = np.ascontiguousarray(np.asanyarray(img.dataobj))
+    digest.update(str((data.shape, data.dtype.str)).encode("utf-8"))
+    digest.update(np.ascontiguousarray(img.affine, np.float64).tobytes())
+    digest.update(data.tobytes())
+    return digest.hexdigest()
+
+
+def load_image(img: Volume) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads a volume reoriented to RAS, as the electrode locator shows it
+
+    Same as mne.gui._ieeg_locate_gui._load_image: the data as float32
+    reoriented to RAS, and the voxel to surface RAS transform.
+
+    img: path of a volume or a nibabel image
+
+    returns: the (x, y, z) data and the 4 x 4 vox to ras transform
+    """
+    if not isinstance(img, nib.spatialimages.SpatialImage):
+        img = nib.load(img)
+    orig_data = np.array(img.dataobj).astype(np.float32)
+    ornt = nib.orientations.axcodes2ornt(
+        nib.orientations.aff2axcodes(img.affine)).astype(int)
+    ras_ornt = nib.orientations.axcodes2ornt("RAS")
+    ornt_trans = nib.orientations.ornt_transform(ornt, ras_ornt)
+    img_data = nib.orientations.apply_orientation(orig_data, ornt_trans)
+    orig_mgh = nib.MGHImage(orig_data, img.affine)
+    aff_trans = nib.orientations.inv_ornt_aff(ornt_trans, img.shape)
+    vox_ras_t = np.dot(orig_mgh.header.get_vox2ras_tkr(), aff_trans)
+    return img_data, vox_ras_t
+
+
+class VolumeCache(object):
+    def __init__(self, directory: str = cache_dir):
+        """Registrations and resampled volumes computed once per input
+
+        Registering a CT to an MRI takes upward of 15 minutes and
+        resampling or reorienting the volumes takes seconds on every
+        launch of the electrode locator. This cache stores the results in
+        'directory', keyed by the hashes of the input volumes, so a subject
+        is only computed once. Volumes are stored as .npy files and memory
+        mapped when read, so a cache hit costs little more than hashing the
+        inputs.
+
+        directory: folder the results are stored in
+        """
+        super(VolumeCache, self).__init__()
+        self.directory = directory
+
+    def _key(self, kind: str, volumes: Tuple[Volume, ...], *params) -> str:
+        """Cache key of a result computed from volumes and parameters"""
+        return hashlib.sha256(json.dumps(
+            [kind, [volume_hash(img) for img in volumes], params],
+            default=str).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, name: str) -> str:
+        return os.path.join(self.directory, "{}_{}.npy".format(key, name))
+
+    def _save(self, key: str, name: str, array: np.ndarray):
+        """Writes an array atomically, so readers never see half a file"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key, name)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as fobj:
+            np.save(fobj, array)
+        os.replace(tmp, path)
+
+    def _load(self, key: str, name: str, mmap: bool = False):
+        """Reads a stored array, or None if it was never computed"""
+        path = self._path(key, name)
+        if not os.path.isfile(path):
+            return None
+        return np.load(path, mmap_mode="r" if mmap else None)
+
+    def registration(self, moving: Volume, static: Volume,
+                     pipeline: str = "rigids") -> np.ndarray:
+        """Affine registering moving to static, computed at most once
+
+        moving: the volume to register, e.g. the CT
+        static: the volume registered to, e.g. the T1 MRI
+        pipeline: see mne.transforms.compute_volume_registration
+
+        returns: the 4 x 4 registration affine
+        """
+        key = self._key("registration", (moving, static), pipeline)
+        affine = self._load(key, "affine")
+        if affine is None:
+            affine, _ = compute_volume_registration(moving, static,
+                                                    pipeline=pipeline)
+            self._save(key, "affine", np.asarray(affine))
+        return affine
+
+    def add_registration(self, moving: Volume, static: Volume,
+                         affine: np.ndarray, pipeline: str = "rigids"):
+        """Stores an affine registering moving to static computed before"""
+        key = self._key("registration", (moving, static), pipeline)
+        self._save(key, "affine", np.asarray(affine, np.float64))
+
+    def add_known_registrations(self, root: str,
+                                fname: str = known_registrations):
+        """Stores the registrations of a json file of known results
+
+        Each entry of the file gives the paths of the "moving" and
+        "static" volumes relative to 'root', the "pipeline" and the
+        resulting "affine". Entries whose volumes are missing are skipped.
+
+        root: folder the paths of the entries are relative to
+        fname: the json file
+        """
+        with open(fname) as fobj:
+            entries = json.load(fobj)
+        for entry in entries:
+            moving = os.path.join(root, entry["moving"])
+            static = os.path.join(root, entry["static"])
+            if os.path.isfile(moving) and os.path.isfile(static):
+                self.add_registration(moving, static, entry["affine"],
+                                      entry["pipeline"])
+
+    def aligned(self, moving: Volume, static: Volume,
+                affine: np.ndarray) -> nib.MGHImage:
+        """moving resampled into the space of static, computed once
+
+        moving: the volume to resample, e.g. the CT
+        static: the volume whose grid is used, e.g. the T1 MRI
+        affine: the registration of moving to static
+
+        returns: an image whose data is memory mapped from the cache
+        """
+        key = self._key("aligned", (moving, static),
+                        np.asarray(affine, np.float64).round(8).tolist())
+        data = self._load(key, "data", mmap=True)
+        if data is None:
+            img = apply_volume_registration(moving, static, affine)
+            data = np.asanyarray(img.dataobj)
+            if data.dtype.kind == "f":  # MGH images cannot hold float64
+                data = data.astype(np.float32)
+            self._save(key, "data", data)
+            self._save(key, "affine", img.affine)
+            data = self._load(key, "data", mmap=True)
+        return nib.MGHImage(data, self._load(key, "affine"))
+
+    def image(self, img: Volume) -> Tuple[np.ndarray, np.ndarray]:
+        """load_image of a volume, computed once
+
+        img: path of a volume or a nibabel image
+
+        returns: the memory mapped RAS data and the vox to ras transform
+        """
+        key = self._key("image", (img,))
+        data = self._load(key, "data", mmap=True)
+        if data is None:
+            data, vox_ras_t = load_image(img)
+            self._save(key, "data", data)
+            self._save(key, "vox_ras_t", vox_ras_t)
+            data = self._load(key, "data", mmap=True)
+        return data, self._load(key, "vox_ras_t")
+
+
+class SliceCache(object):
+    def __init__(self, volume: np.ndarray, maxsize: int = 64):
+        """The most recently viewed slices of a volume
+
+        Showing a position in the three plane viewer takes one slice of the
+        volume along each axis. Slices are read from 'volume', typically a
+        memory map from VolumeCache, only when they are first viewed and
+        the last 'maxsize' of them are kept, so stepping back and forth
+        between electrodes reads nothing again and the memory used is
+        bounded by maxsize slices whatever the size of the volume.
+
+        volume: the (x, y, z) volume
+        maxsize: number of slices kept
+        """
+        super(SliceCache, self).__init__()
+        self.volume = volume
+        self.maxsize = maxsize
+        self._slices = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, axis: int, index: int) -> np.ndarray:
+        """Slice 'index' along 'axis', transposed for imshow
+
+        returns: a read only 2D array, copy it before modifying it
+        """
+        key = (axis, int(index))
+        data = self._slices.get(key)
+        if data is not None:
+            self.hits += 1
+            self._slices.move_to_end(key)
+            return data
+        self.misses += 1
+        data = np.ascontiguousarray(np.take(self.volume, key[1],
+                                            axis=axis).T)
+        data.setflags(write=False)
+        self._slices[key] = data
+        if len(self._slices) > self.maxsize:
+            self._slices.popitem(last=False)
+        return data
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes taken by the slices kept"""
+        return sum(data.nbytes for data in self._slices.values())
@@ -6,8 +6,10 @@ from neurokit2 import ecg_peaks
 from pandas import DataFrame
 
 import ecg_analysis.ecg_reader as erd
+from ecg_analysis.profiling import profiled, stage
 
 
+@profiled()
 def get_metrics(data: DataFrame,
                 t_key: str = "time",
                 v_key: str = "voltage",
@@ -19,7 +21,9 @@ def get_metrics(data: DataFrame,
     with the duration, voltage extremes, filename, number of beats, beats per
     minute, anda list of beat times stored in it paired with the relevant key.
     Each numeric metric is rounded to three decimal places by default, which
-    can be changed by assigning an integer to the 'rounding' parameter
+    can be changed by assigning an integer to the 'rounding' parameter. The
+    time spent in ecg_peaks is recorded in the active profile, if any (see
+    profiling.profiling).
 
     :param data: A pandas dataframe that contains the fields t_key and v_key
     :type data: DataFrame
@@ -47,7 +51,8 @@ def get_metrics(data: DataFrame,
                            round(data[v_key].min(), rounding))
     logging.info("The {} extremes were {}".format(v_key, metrics["extremes"]))
 
-    _, peak_dict = ecg_peaks(data[v_key], len(data)/metrics["duration"])
+    with stage("ecg_peaks", len(data)):
+        _, peak_dict = ecg_peaks(data[v_key], len(data)/metrics["duration"])
     metrics["beats"] = data[t_key].iloc[peak_dict["ECG_R_Peaks"]].to_list()
     beats_str = [str(i) for i in metrics["beats"]]
     logging.info("The beat times were [" + ", ".join(beats_str) + "]")
@@ -99,13 +104,14 @@ def remove_dir(directory: str):
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
+    from mne import set_log_file
 
     # set logging parameters
     if os.path.isfile("info.log"):
         os.remove("info.log")
     logging.basicConfig(filename="info.log", level=logging.INFO, filemode="a")
-    erd.set_log_file("info.log", overwrite=False,  # set log output for mne
-                     output_format="%(levelname)s:%(name)s:%(message)s")
+    set_log_file("info.log", overwrite=False,  # set log output for mne
+                 output_format="%(levelname)s:%(name)s:%(message)s")
 
     # remove old data
     out_folder = "out_files"
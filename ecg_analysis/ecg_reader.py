@@ -1,11 +1,13 @@
 import logging
 import os
-from typing import Tuple, Union, List, Any
+from typing import Tuple, Union, List
 
 import numpy as np
-from mne import filter, set_log_file
 from pandas import DataFrame, Series, read_csv
 
+from ecg_analysis.numeric import is_num, is_nan, is_mt_str
+from ecg_analysis.profiling import profiled, stage
+
 
 def load_csv(local_file: str,
              cols: Union[List[str], Tuple[str]] = ("time", "voltage")
@@ -43,35 +45,6 @@ def load_csv(local_file: str,
                                " supported in this module")
 
 
-def is_num(num: Any) -> bool:
-    """Function that tests if object can be converted to number
-
-    A function that takes any input and detects if it is a number by
-    attempting to convert the input to a float. This function catches
-    convertable digit string cases.
-
-    Source:
-    https://stackoverflow.com/questions/354038
-
-    :param num: object data to determine if it is conceivably an number
-    :type num: Any
-    :return: a boolean determination if the input is a number
-    :rtype: bool
-    """
-    if isinstance(num, complex):
-        if num.imag == 0:
-            num = num.real
-        else:
-            return False
-    elif isinstance(num, bool):
-        return False
-    try:
-        float(num)
-        return True
-    except ValueError:
-        return False
-
-
 def apply_to_df(my_data: DataFrame, func: object, invert=False):
     """Applies given boolean function to DataFrame rows and removes False rows
 
@@ -106,48 +79,6 @@ def apply_to_df(my_data: DataFrame, func: object, invert=False):
     return new_data, inds
 
 
-def is_nan(x: Union[int, float, str]) -> bool:
-    """Check to see if x is an nan value
-
-    Check to see if the given parameter x is an nan value. Similar to np.isnan,
-    but with the capability to read strings as well as number types. Attempts
-    to convert strings to floats to do so.
-
-    :param x: Input to check if it is nan
-    :type x: Union[int, float, str]
-    :return: Boolean indicating the whether the input is nan
-    :rtype: bool
-    """
-    try:
-        y = float(x)
-    except Exception:
-        y = x
-
-    if y != y:
-        return True
-    else:
-        return False
-
-
-def is_mt_str(my_str) -> bool:
-    """Check to see if the given input is an empty string
-
-    Function that checks the given parameter my_str to see if it is an empty
-    string. Uses the innate identity __eq__ to check.
-
-    :param my_str: String to check if it is empty
-    :type my_str: str
-    :return: Boolean indicating if the input is an empty string
-    :rtype: bool
-    """
-    if not isinstance(my_str, str):
-        return False
-    elif "".__eq__(my_str):
-        return True
-    else:
-        return False
-
-
 def clean_data(my_data: DataFrame):
     """Cleans missing, nan, and non numeric values from a DataFrame
 
@@ -217,6 +148,10 @@ def filter_data(my_data: Series, first_samp: Union[float, int],
     :return: numpy array of the filtered data
     :rtype: np.ndarray
     """
+    # mne is only imported once filtering is needed since it dominates the
+    # import time of this module
+    from mne import filter as mne_filter
+
     assert isinstance(my_data, Series)
     numpy_data = my_data.to_numpy()
     sample_freq = len(my_data) / (last_samp - first_samp)
@@ -224,11 +159,11 @@ def filter_data(my_data: Series, first_samp: Union[float, int],
     cpus = os.cpu_count()
     if cpus is not None:
         kwargs["n_jobs"] = cpus
-    filtered = filter.filter_data(shaped, sample_freq, low, high,
-                                  verbose="info",
-                                  pad="reflect",
-                                  method="fir",
-                                  **kwargs)
+    filtered = mne_filter.filter_data(shaped, sample_freq, low, high,
+                                      verbose="info",
+                                      pad="reflect",
+                                      method="fir",
+                                      **kwargs)
     filtered = filtered - np.mean(filtered) + np.mean(my_data)
     return filtered
 
@@ -266,6 +201,7 @@ def check_range(data_set: Series, filename: str,
             break
 
 
+@profiled(samples=len)
 def preprocess_data(file_path: str,
                     tlabel: str = "time",
                     vlabel: str = "voltage",
@@ -282,7 +218,8 @@ def preprocess_data(file_path: str,
     clean_data(). It then logs whether an values are outside the range
     [raw_min, raw_max] and logs it. Lastly, it takes the vlabel column and
     filters it using the filter_data() function. Any mne keyword arguments may
-    be piped into the filter function through **kwargs
+    be piped into the filter function through **kwargs. Each of these stages
+    is recorded in the active profile, if any (see profiling.profiling).
 
     :param file_path: Path to the csv file the will be read into the DataFrame
     :type file_path: str
@@ -311,19 +248,25 @@ def preprocess_data(file_path: str,
     assert l_freq < h_freq  # band pass filter, not a notch
     assert l_freq > 0
 
-    raw = load_csv(file_path, [tlabel, vlabel])
-    cleaned = clean_data(raw)
+    with stage("load_csv") as st:
+        raw = load_csv(file_path, [tlabel, vlabel])
+        st.samples = len(raw)
+    with stage("clean_data") as st:
+        cleaned = clean_data(raw)
+        st.samples = len(cleaned)
     pre_data = cleaned
     pre_data.name = cleaned.name
-    check_range(cleaned[vlabel], raw.name, raw_max, raw_min)
+    with stage("check_range", len(cleaned)):
+        check_range(cleaned[vlabel], raw.name, raw_max, raw_min)
     if clean_only:
         return cleaned
-    voltage_filtered = filter_data(cleaned[vlabel],
-                                   cleaned[tlabel].iloc[0],
-                                   cleaned[tlabel].iloc[-1],
-                                   h_freq,
-                                   l_freq,
-                                   **kwargs)
+    with stage("filter_data", len(cleaned)):
+        voltage_filtered = filter_data(cleaned[vlabel],
+                                       cleaned[tlabel].iloc[0],
+                                       cleaned[tlabel].iloc[-1],
+                                       h_freq,
+                                       l_freq,
+                                       **kwargs)
     pre_data[vlabel] = np.reshape(voltage_filtered,
                                   (voltage_filtered.shape[1]))
     pre_data.reset_index(drop=True, inplace=True)
@@ -331,6 +274,7 @@ def preprocess_data(file_path: str,
 
 
 if __name__ == "__main__":
+    from mne import set_log_file
 
     # set logging parameters
     if os.path.isfile("info.log"):
@@ -0,0 +1,130 @@
+from typing import Any, Union
+
+
+def is_num(num: Any) -> bool:
+    """Function that tests if object can be converted to number
+
+    A function that takes any input and detects if it is a number by
+    attempting to convert the input to a float. This function catches
+    convertable digit string cases.
+
+    Source:
+    https://stackoverflow.com/questions/354038
+
+    :param num: object data to determine if it is conceivably an number
+    :type num: Any
+    :return: a boolean determination if the input is a number
+    :rtype: bool
+    """
+    if isinstance(num, complex):
+        if num.imag == 0:
+            num = num.real
+        else:
+            return False
+    elif isinstance(num, bool):
+        return False
+    try:
+        float(num)
+        return True
+    except ValueError:
+        return False
+
+
+def is_nan(x: Union[int, float, str]) -> bool:
+    """Check to see if x is an nan value
+
+    Check to see if the given parameter x is an nan value. Similar to np.isnan,
+    but with the capability to read strings as well as number types. Attempts
+    to convert strings to floats to do so.
+
+    :param x: Input to check if it is nan
+    :type x: Union[int, float, str]
+    :return: Boolean indicating the whether the input is nan
+    :rtype: bool
+    """
+    try:
+        y = float(x)
+    except Exception:
+        y = x
+
+    if y != y:
+        return True
+    else:
+        return False
+
+
+def is_mt_str(my_str) -> bool:
+    """Check to see if the given input is an empty string
+
+    Function that checks the given parameter my_str to see if it is an empty
+    string. Uses the innate identity __eq__ to check.
+
+    :param my_str: String to check if it is empty
+    :type my_str: str
+    :return: Boolean indicating if the input is an empty string
+    :rtype: bool
+    """
+    if not isinstance(my_str, str):
+        return False
+    elif "".__eq__(my_str):
+        return True
+    else:
+        return False
+
+
+def try_intify(num: Union[int, float, bool, str, complex]) -> Union[int, bool]:
+    """Tries to convert input to integer and if this is not possible,
+    then the func returns false.
+
+    The func runs the value through a series of statements that
+    determine if the value has an imaginary value of 0 (return only the
+    real integer value or otherwise to return False), if the value
+    is a float and if it is equal to the integer of that value
+    (returns the integer), if the value is a boolean (returns False),
+    or if there is any other error to return False.
+
+    :param num: single value can be int, float, bool, str, complex
+    :type num: Union[int, float, bool, str, complex]
+    :return: integer if it was convertable and a False if not
+    :rtype: Union[int, bool]
+    """
+    if isinstance(num, complex):  # TESTED
+        if num.imag == 0:
+            num = num.real
+        else:
+            return False
+    elif isinstance(num, bool):
+        return False
+    try:
+        if int(num) == float(num):
+            return int(num)
+        else:
+            return False
+    except ValueError:
+        return False
+
+
+def try_floatify(num: Union[int, float, bool, str, complex]
+                 ) -> Union[float, bool]:
+    """Function that tests if object can be converted to number
+
+    A function that takes any input and detects if it is a number by
+    attempting to convert the input to a float. This function catches
+    convertable digit string cases.
+
+    Source:
+    https://stackoverflow.com/questions/354038
+
+    :param num: object data to determine if it is conceivably a number
+    :type num: Union[int, float, bool, str, complex]
+    :return: a boolean determination if the input is a number, or the floating
+        point number itself
+    :rtype: Union[float, bool]
+    """
+
+    if is_num(num):
+        if isinstance(num, complex):
+            num = num.real
+        return float(num)
+    else:
+        return False
@@ -0,0 +1,204 @@
+import functools
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional
+
+_active: ContextVar[Optional["Profile"]] = ContextVar("profile", default=None)
+
+
+class Profile(object):
+    """Per-stage timings of one run of the ECG pipeline
+
+    A Profile is filled by the stage context managers run while it is active
+    (see profiling). Each record holds the 'stage' name, its wall time in
+    'seconds', the number of 'samples' it processed (None if unknown) and the
+    'memory' allocated and not freed during the stage in bytes (None unless
+    memory is traced).
+    """
+
+    def __init__(self, label: str = None, memory: bool = False):
+        """Initializes an empty profile
+
+        :param label: Name of what was profiled, e.g. the file or the device
+            it came from, used to group profiles in aggregate
+        :type label: str
+        :param memory: Whether memory deltas are recorded with tracemalloc
+        :type memory: bool
+        """
+        self.label = label
+        self.memory = memory
+        self.records: List[dict] = []
+
+    def add(self, stage: str, seconds: float, samples: int = None,
+            memory: int = None):
+        """Appends the record of a stage
+
+        :param stage: Name of the stage
+        :type stage: str
+        :param seconds: Wall time of the stage
+        :type seconds: float
+        :param samples: Number of samples processed by the stage
+        :type samples: int
+        :param memory: Bytes allocated and not freed by the stage
+        :type memory: int
+        """
+        self.records.append({"stage": stage, "seconds": seconds,
+                             "samples": samples, "memory": memory})
+
+    def seconds(self, stage: str) -> float:
+        """Total wall time of every record of a stage
+
+        :param stage: Name of the stage
+        :type stage: str
+        :return: Seconds spent in the stage, 0 if it never ran
+        :rtype: float
+        """
+        return sum(r["seconds"] for r in self.records if r["stage"] == stage)
+
+    def to_dict(self) -> dict:
+        """The label and records of the profile, e.g. to log it as json"""
+        return {"label": self.label, "records": list(self.records)}
+
+    def __repr__(self):
+        stages = ", ".join("{}={:.3f}s".format(r["stage"], r["seconds"])
+                           for r in self.records)
+        return "Profile({!r}: {})".format(self.label, stages)
+
+
+class stage(object):
+    """Context manager recording a stage in the active profile
+
+    When no profile is active it only costs a context variable lookup, so the
+    pipeline functions can be instrumented unconditionally. The number of
+    samples can be given upfront or set on the returned object once known::
+
+        with stage("clean_data") as st:
+            cleaned = clean(raw)
+            st.samples = len(cleaned)
+    """
+    __slots__ = ("name", "samples", "_profile", "_start", "_memory")
+
+    def __init__(self, name: str, samples: int = None):
+        """Names the stage
+
+        :param name: Name of the stage
+        :type name: str
+        :param samples: Number of samples processed by the stage
+        :type samples: int
+        """
+        self.name = name
+        self.samples = samples
+
+    def __enter__(self) -> "stage":
+        self._profile = _active.get()
+        if self._profile is not None:
+            self._memory = tracemalloc.get_traced_memory()[0] \
+                if self._profile.memory else None
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profile is not None:
+            seconds = time.perf_counter() - self._start
+            memory = None if self._memory is None else \
+                tracemalloc.get_traced_memory()[0] - self._memory
+            self._profile.add(self.name, seconds, self.samples, memory)
+        return False
+
+
+def profiled(name: str = None, samples: Callable = None) -> Callable:
+    """Decorator recording every call of a function as a stage
+
+    :param name: Name of the stage, the name of the function by default
+    :type name: str
+    :param samples: Function of the output of the decorated function that
+        returns the number of samples it processed, e.g. len
+    :type samples: Callable
+    :return: The decorator
+    :rtype: Callable
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active.get() is None:
+                return func(*args, **kwargs)
+            with stage(name or func.__name__) as st:
+                out = func(*args, **kwargs)
+                if samples is not None:
+                    st.samples = samples(out)
+            return out
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profiling(label: str = None, memory: bool = False):
+    """Activates a new Profile for the code run inside the block
+
+    The profile only sees the stages run in the same thread (or asyncio
+    task). Memory deltas need tracemalloc, which is started for the block if
+    it is not tracing already and slows the pipeline down noticeably::
+
+        with profiling("device_12.csv") as profile:
+            metrics = get_metrics(preprocess_data("device_12.csv"))
+        profile.seconds("filter_data")
+
+    :param label: Label of the profile, see Profile
+    :type label: str
+    :param memory: Whether memory deltas are recorded
+    :type memory: bool
+    :return: The active profile
+    :rtype: Profile
+    """
+    profile = Profile(label, memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _active.set(profile)
+    try:
+        yield profile
+    finally:
+        _active.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+def aggregate(profiles: Iterable[Profile],
+              by_label: bool = False) -> Dict[str, dict]:
+    """Sums the stages of a batch of profiles
+
+    :param profiles: Profiles of a batch of runs
+    :type profiles: Iterable[Profile]
+    :param by_label: Whether to aggregate the profiles of each label apart,
+        e.g. to compare devices
+    :type by_label: bool
+    :return: For each stage (or each label, then stage): the number of
+        'calls', the 'seconds' in total, 'mean' and 'max', the 'samples' in
+        total, the 'us_per_sample' and the 'memory' in total (None where
+        unknown)
+    :rtype: Dict[str, dict]
+    """
+    if by_label:
+        groups = {}
+        for profile in profiles:
+            groups.setdefault(profile.label, []).append(profile)
+        return {label: aggregate(group) for label, group in groups.items()}
+    out = {}
+    for profile in profiles:
+        for record in profile.records:
+            row = out.setdefault(record["stage"], {
+                "calls": 0, "seconds": 0., "max": 0., "samples": None,
+                "memory": None})
+            row["calls"] += 1
+            row["seconds"] += record["seconds"]
+            row["max"] = max(row["max"], record["seconds"])
+            for key in ("samples", "memory"):
+                if record[key] is not None:
+                    row[key] = (row[key] or 0) + record[key]
+    for row in out.values():
+        row["mean"] = row["seconds"] / row["calls"]
+        row["us_per_sample"] = None if not row["samples"] else \
+            row["seconds"] / row["samples"] * 1e6
+    return out
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from ecg_analysis import calculations as calc
+from ecg_analysis import ecg_reader as erd
+from ecg_analysis.profiling import (Profile, aggregate, profiled, profiling,
+                                    stage)
+
+
+def test_disabled_records_nothing():
+    with stage("outside") as st:
+        st.samples = 3
+
+    @profiled()
+    def double(x):
+        return 2 * x
+
+    assert double(2) == 4
+    with profiling() as profile:
+        pass
+    assert profile.records == []
+
+
+def test_stages_and_decorator():
+    @profiled("sleepy", samples=len)
+    def sleepy(n):
+        time.sleep(0.01)
+        return list(range(n))
+
+    with profiling("dev1") as profile:
+        with stage("block", 5) as st:
+            sleepy(7)
+            st.samples = 6
+        st.samples = 8  # too late, the stage was recorded
+    assert [r["stage"] for r in profile.records] == ["sleepy", "block"]
+    assert profile.records[0]["samples"] == 7
+    assert profile.records[1]["samples"] == 6
+    assert profile.seconds("block") >= profile.seconds("sleepy") >= 0.01
+    assert profile.records[0]["memory"] is None
+    assert profile.to_dict()["label"] == "dev1"
+    assert "sleepy" in repr(profile)
+
+
+def test_memory_and_threads():
+    with profiling(memory=True) as profile:
+        with stage("alloc"):
+            kept = np.ones(10 ** 6)
+        other = threading.Thread(target=lambda: stage("elsewhere").__enter__(
+        ).__exit__(None, None, None))
+        other.start()
+        other.join()
+    assert not tracemalloc.is_tracing()
+    assert [r["stage"] for r in profile.records] == ["alloc"]
+    assert profile.records[0]["memory"] >= kept.nbytes
+
+
+def test_pipeline_profile():
+    path = os.path.join("test_data", "test_data1.csv")
+    with profiling(path) as profile:
+        data = erd.preprocess_data(path, raw_max=300, l_freq=1, h_freq=50)
+        calc.get_metrics(data)
+    stages = [r["stage"] for r in profile.records]
+    assert stages == ["load_csv", "clean_data", "check_range", "filter_data",
+                      "preprocess_data", "ecg_peaks", "get_metrics"]
+    assert profile.records[0]["samples"] == 10000
+    assert profile.seconds("preprocess_data") >= profile.seconds(
+        "filter_data")
+
+
+def test_aggregate():
+    profiles = [Profile("a"), Profile("a"), Profile("b")]
+    profiles[0].add("load", 1., 100)
+    profiles[0].add("filter", 2.)
+    profiles[1].add("load", 3., 300, 10)
+    profiles[2].add("load", 5., 100)
+    out = aggregate(profiles)
+    assert out["load"]["calls"] == 3
+    assert out["load"]["seconds"] == 9.
+    assert out["load"]["max"] == 5.
+    assert out["load"]["mean"] == 3.
+    assert out["load"]["samples"] == 500
+    assert out["load"]["memory"] == 10
+    assert out["load"]["us_per_sample"] == 9. / 500 * 1e6
+    assert out["filter"]["samples"] is None
+    assert out["filter"]["us_per_sample"] is None
+    by_label = aggregate(profiles, by_label=True)
+    assert by_label["a"]["load"]["seconds"] == 4.
+    assert by_label["b"]["load"]["calls"] == 1
@@ -154,3 +154,26 @@ def test_apply(data, func, invert, expected1, expected2):
     expected1 = expected1.reset_index(drop=True)
     assert expected1.eq(answer).all(1).all(0)
     assert indices.tolist() == expected2
+
+
+def test_pipeline_benchmark(tmp_path):
+    from benchmarks.ecg_pipeline import (benchmark, find, load, report,
+                                         save, scale_csv, stages)
+    src = os.path.join("test_data", "test_data1.csv")
+    dst = str(tmp_path / "scaled.csv")
+    scale_csv(src, dst, 3, bad_fraction=0.01)
+    scaled = erd.load_csv(dst)
+    assert len(scaled) == 3 * len(erd.load_csv(src))
+    assert len(erd.clean_data(scaled)) == len(scaled) - len(scaled) // 100
+    assert erd.clean_data(scaled)["time"].is_monotonic_increasing
+
+    record = benchmark(["test_data1"], scales=[1], repeat=1)
+    result = record["results"]["test_data1x1"]
+    assert all(result[stage]["seconds"] > 0 and
+               result[stage]["peak_bytes"] > 0 for stage in stages)
+    fname = str(tmp_path / "results.jsonl")
+    save(record, fname)
+    save(record, fname)
+    assert len(load(fname)) == 2
+    assert find(load(fname), record["commit"][:4]) == record
+    assert report(record, record)[2].endswith("1.00x")
@@ -0,0 +1,162 @@
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class Task:
+    """Class that represents one background job submitted by the GUI
+
+    A Task wraps the Future of a job running in the BackgroundRunner thread
+    pool along with the callbacks that should receive its result on the tkinter
+    main loop. Cancelling a Task stops it from starting if it is still queued,
+    and otherwise discards its result once it finishes, since a running Python
+    thread cannot be interrupted.
+    """
+
+    def __init__(self, key: str, future: Future,
+                 on_done: Optional[Callable] = None,
+                 on_error: Optional[Callable] = None):
+        """Initializes the Task with its future and result callbacks
+
+        :param key: Name of the job, e.g. 'retrieve'
+        :type key: str
+        :param future: The future of the running job
+        :type future: Future
+        :param on_done: Called with the result of the job on the main loop
+        :type on_done: Optional[Callable]
+        :param on_error: Called with the exception raised by the job on the
+            main loop
+        :type on_error: Optional[Callable]
+        """
+        self.key = key
+        self.future = future
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancels the task so that its callbacks are never called"""
+        self.cancelled = True
+        self.future.cancel()
+
+
+class BackgroundRunner:
+    """Class that runs slow GUI work off of the tkinter main loop
+
+    BackgroundRunner runs functions (network requests, csv analysis) in a
+    thread pool so the GUI keeps responding while they run. Finished jobs are
+    put on a queue which is polled from the main loop with root.after, and
+    their callbacks are called there, since tkinter widgets may only be touched
+    from the thread running the main loop. Only one task per key is active:
+    submitting a new 'retrieve' task cancels the previous one. The optional
+    on_busy callback is called with True when work starts and False once every
+    task has finished, for driving a progress indicator.
+    """
+
+    def __init__(self, root, max_workers: int = 4, poll_ms: int = 50,
+                 on_busy: Optional[Callable[[bool], None]] = None):
+        """Initializes the BackgroundRunner and its thread pool
+
+        :param root: The tkinter root (any object with an 'after' method)
+        :param max_workers: Maximum number of jobs running at the same time
+        :type max_workers: int
+        :param poll_ms: Milliseconds between checks for finished jobs
+        :type poll_ms: int
+        :param on_busy: Called with whether any task is currently running
+        :type on_busy: Optional[Callable[[bool], None]]
+        """
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_busy = on_busy
+        self.tasks: Dict[str, Task] = dict()
+        self._finished = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._polling = False
+
+    @property
+    def busy(self) -> bool:
+        """Whether any submitted task has not been handled yet"""
+        return bool(self.tasks)
+
+    def submit(self, key: str, func: Callable, *args,
+               on_done: Optional[Callable] = None,
+               on_error: Optional[Callable] = None, **kwargs) -> Task:
+        """Runs func(*args, **kwargs) in the background
+
+        Any previous task with the same key is cancelled. Once func returns,
+        on_done is called with its return value on the main loop. If func
+        raises an exception, on_error is called with it instead.
+
+        :param key: Name of the job, used for cancellation
+        :type key: str
+        :param func: The function to run in the background
+        :type func: Callable
+        :param on_done: Called with the result of func on the main loop
+        :type on_done: Optional[Callable]
+        :param on_error: Called with the exception raised by func on the main
+            loop
+        :type on_error: Optional[Callable]
+        :return: The submitted task
+        :rtype: Task
+        """
+        previous = self.tasks.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+        future = self._executor.submit(func, *args, **kwargs)
+        task = Task(key, future, on_done, on_error)
+        self.tasks[key] = task
+        future.add_done_callback(lambda _: self._finished.put(task))
+        if self.on_busy is not None:
+            self.on_busy(True)
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+        return task
+
+    def cancel(self, key: str = None):
+        """Cancels the task with the given key, or every task if key is None
+
+        :param key: Name of the job to cancel
+        :type key: str
+        """
+        keys = list(self.tasks.keys()) if key is None else [key]
+        for k in keys:
+            if k in self.tasks:
+                self.tasks.pop(k).cancel()
+        if not self.tasks and self.on_busy is not None:
+            self.on_busy(False)
+
+    def _poll(self):
+        """Calls the callbacks of finished tasks on the main loop
+
+        This method is scheduled with root.after while tasks are running. It
+        empties the queue of finished tasks, calling the callbacks of every
+        task that was not cancelled, and reschedules itself until no tasks are
+        left.
+        """
+        while True:
+            try:
+                task = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            if task.cancelled:
+                continue
+            if self.tasks.get(task.key) is task:
+                del self.tasks[task.key]
+            error = task.future.exception()
+            if error is not None:
+                if task.on_error is not None:
+                    task.on_error(error)
+            elif task.on_done is not None:
+                task.on_done(task.future.result())
+        if self.tasks:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+            if self.on_busy is not None:
+                self.on_busy(False)
+
+    def shutdown(self):
+        """Cancels all tasks and stops the thread pool without waiting"""
+        self.cancel()
+        self._executor.shutdown(wait=False)
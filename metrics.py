@@ -0,0 +1,317 @@
+import bisect
+import threading
+import time
+from typing import (Callable, Dict, Iterable, List, Optional, Sequence, Tuple,
+                    Union)
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map
+
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+latency_buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5,
+                   5., 10.)
+size_buckets = tuple(4 ** i for i in range(4, 14))  # 256 B to 64 MB
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value for the Prometheus text format"""
+    return str(value).replace("\\", r"\\").replace('"', r'\"').replace(
+        "\n", r"\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str],
+            extra: str = "") -> str:
+    """Formats label names and values as {name="value",...}"""
+    pairs = ['{}="{}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    """Formats a sample value, with integers written without a decimal"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _size(length: str) -> Optional[int]:
+    """Parses a Content-Length header, None if it is missing or invalid"""
+    try:
+        return int(length) if length else None
+    except ValueError:
+        return None
+
+
+def route_of(url_map: Map, environ: dict) -> str:
+    """Returns the rule of the url map matching a request
+
+    :param url_map: The url map of the application
+    :type url_map: werkzeug.routing.Map
+    :param environ: The WSGI environment of the request
+    :type environ: dict
+    :return: The rule, e.g. '/get/<name_or_mrn>', or 'unmatched'
+    :rtype: str
+    """
+    try:
+        rule, _ = url_map.bind_to_environ(environ).match(return_rule=True)
+    except HTTPException:
+        return "unmatched"
+    return rule.rule
+
+
+class Metric:
+    """Base class of the metrics, a named family of labelled samples"""
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        """Initializes a metric without any samples
+
+        :param name: The name of the metric, e.g. 'http_requests_total'
+        :type name: str
+        :param doc: The help text of the metric
+        :type doc: str
+        :param labels: The names of the labels of every sample
+        :type labels: Sequence[str]
+        """
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def samples(self) -> List[str]:
+        """Returns the sample lines of the metric in the text format"""
+        with self._lock:
+            items = sorted(self._values.items())
+        return ["{}{} {}".format(self.name, _labels(self.labels, key),
+                                 _number(value)) for key, value in items]
+
+    def render(self) -> List[str]:
+        """Returns the help, type and sample lines of the metric"""
+        return ["# HELP {} {}".format(self.name, self.doc),
+                "# TYPE {} {}".format(self.name, self.kind)] + self.samples()
+
+
+class Counter(Metric):
+    """A value that only increases, e.g. the number of requests"""
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        """Adds amount to the sample with the given label values
+
+        :param labels: The value of each label, in order
+        :type labels: str
+        :param amount: The non negative amount to add
+        :type amount: float
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        """Returns the sample with the given label values, 0 if unset"""
+        with self._lock:
+            return self._values.get(labels, 0)
+
+
+class Gauge(Metric):
+    """A value read by a function every time the metrics are scraped
+
+    Gauges of the state of the server (e.g. the size of the database) are
+    computed when /metrics is requested instead of being updated on every
+    change, which costs nothing on the request paths.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str,
+                 read: Callable[[], Union[float, Dict[tuple, float]]],
+                 labels: Sequence[str] = ()):
+        """Initializes a gauge read from a function
+
+        :param name: The name of the metric
+        :type name: str
+        :param doc: The help text of the metric
+        :type doc: str
+        :param read: Function returning the value, or for a gauge with labels
+            a dictionary of label value tuples to values
+        :type read: Callable
+        :param labels: The names of the labels
+        :type labels: Sequence[str]
+        """
+        super().__init__(name, doc, labels)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        values = self.read()
+        if not self.labels:
+            values = {(): values}
+        with self._lock:
+            self._values = dict(values)
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Counts of observations (e.g. latencies) falling in each bucket"""
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = latency_buckets):
+        """Initializes a histogram without any observations
+
+        :param name: The name of the metric
+        :type name: str
+        :param doc: The help text of the metric
+        :type doc: str
+        :param labels: The names of the labels of every sample
+        :type labels: Sequence[str]
+        :param buckets: The increasing upper bounds of the buckets, to which
+            +Inf is added
+        :type buckets: Sequence[float]
+        """
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        """Adds an observation to the histogram of the given label values
+
+        :param value: The observed value
+        :type value: float
+        :param labels: The value of each label, in order
+        :type labels: str
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0., 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labels: str) -> int:
+        """Returns the number of observations with the given label values"""
+        with self._lock:
+            state = self._values.get(labels)
+            return 0 if state is None else state[2]
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, ([*counts], total, n))
+                           for key, (counts, total, n) in self._values.items())
+        lines = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _labels(self.labels, key,
+                                       'le="{}"'.format(_number(bound))),
+                    cumulative))
+            lines.append("{}_sum{} {}".format(
+                self.name, _labels(self.labels, key), _number(total)))
+            lines.append("{}_count{} {}".format(
+                self.name, _labels(self.labels, key), n))
+        return lines
+
+
+class Registry:
+    """The collection of metrics exposed by a server"""
+
+    def __init__(self):
+        """Initializes an empty registry"""
+        self.metrics = dict()
+
+    def register(self, metric: Metric) -> Metric:
+        """Adds a metric to the registry and returns it
+
+        :param metric: The metric to add
+        :type metric: Metric
+        :return: The same metric
+        :rtype: Metric
+        """
+        if metric.name in self.metrics:
+            raise ValueError("metric {} already registered".format(
+                metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """WSGI middleware recording the count, latency and sizes of requests
+
+    Wraps a WSGI application (e.g. app.wsgi_app) and records, per route
+    (the rule of the url map, e.g. '/get/<name_or_mrn>', so patients do not
+    each make a new sample), the number of requests by method and status,
+    their latency and the sizes of their bodies as sent over the wire. It
+    wraps everything below it, including compression, and the only work it
+    adds to a request is matching the url map and a few locked additions.
+    """
+
+    def __init__(self, wsgi_app: Callable, registry: Registry, url_map: Map):
+        """Initializes the middleware and registers its metrics
+
+        :param wsgi_app: The WSGI application to wrap
+        :type wsgi_app: Callable
+        :param registry: Where the request metrics are registered
+        :type registry: Registry
+        :param url_map: The url map of the application, used to find the
+            route of each request
+        :type url_map: werkzeug.routing.Map
+        """
+        self.wsgi_app = wsgi_app
+        self.url_map = url_map
+        self.requests = registry.register(Counter(
+            "http_requests_total", "Requests received.",
+            ("route", "method", "status")))
+        self.latency = registry.register(Histogram(
+            "http_request_duration_seconds",
+            "Time spent handling requests.", ("route", "method")))
+        self.request_size = registry.register(Histogram(
+            "http_request_size_bytes", "Size of request bodies.", ("route",),
+            size_buckets))
+        self.response_size = registry.register(Histogram(
+            "http_response_size_bytes", "Size of response bodies.",
+            ("route",), size_buckets))
+
+    def __call__(self, environ: dict, start_response: Callable
+                 ) -> Iterable[bytes]:
+        """Calls the app and records the request once it has answered
+
+        :param environ: The WSGI environment of the request
+        :type environ: dict
+        :param start_response: The WSGI start_response callable
+        :type start_response: Callable
+        :return: The body of the response
+        :rtype: Iterable[bytes]
+        """
+        # read before the app runs, since DecompressMiddleware rewrites it
+        length = _size(environ.get("CONTENT_LENGTH"))
+        tic = time.perf_counter()
+        sent: List[Tuple[str, list]] = []
+
+        def record_response(status, headers, exc_info=None):
+            sent.append((status, headers))
+            return start_response(status, headers, exc_info)
+
+        body = self.wsgi_app(environ, record_response)
+        seconds = time.perf_counter() - tic
+        route = route_of(self.url_map, environ)
+        method = environ.get("REQUEST_METHOD", "")
+        status, headers = sent[-1] if sent else ("500", [])
+        self.requests.inc(route, method, status.split(" ", 1)[0])
+        self.latency.observe(seconds, route, method)
+        if length is not None:
+            self.request_size.observe(length, route)
+        for name, value in headers:
+            if name.lower() == "content-length" and _size(value) is not None:
+                self.response_size.observe(_size(value), route)
+        return body
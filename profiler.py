@@ -0,0 +1,205 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from werkzeug.routing import Map
+
+from metrics import route_of
+
+header = "X-Profile"  # requests sent with this header set to 1 are profiled
+index_name = "index.json"
+
+
+class ProfilerMiddleware:
+    """WSGI middleware that cProfiles chosen requests into a ring on disk
+
+    Wraps a WSGI application (e.g. app.wsgi_app) and profiles the requests
+    sent with an 'X-Profile: 1' header, plus a random fraction of all the
+    requests if sample is set, so a slow route can be profiled under the
+    data of a running server. Each profile is dumped as a pstats file named
+    after its id, which is returned in the X-Profile-Id header of the
+    response, and listed with its route, status and duration in index.json.
+    Only the latest keep profiles are kept. A single request is profiled at a
+    time, since only one profiler can be active in a process; other requests
+    meanwhile run unprofiled, as do all requests when not chosen, which only
+    costs a header lookup.
+    """
+
+    def __init__(self, wsgi_app: Callable, url_map: Map, directory: str,
+                 keep: int = 200, sample: float = 0.):
+        """Initializes the middleware, resuming the ring found in directory
+
+        :param wsgi_app: The WSGI application to wrap
+        :type wsgi_app: Callable
+        :param url_map: The url map of the application, used to find the
+            route of each request
+        :type url_map: werkzeug.routing.Map
+        :param directory: Where the profiles are written
+        :type directory: str
+        :param keep: The number of profiles kept, at least 1
+        :type keep: int
+        :param sample: The fraction of requests profiled without the header
+        :type sample: float
+        :raises ValueError: If keep is less than 1
+        """
+        if keep < 1:
+            raise ValueError("keep must be at least 1, got {}".format(keep))
+        self.wsgi_app = wsgi_app
+        self.url_map = url_map
+        self.directory = directory
+        self.keep = keep
+        self.sample = sample
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index = self._read_index()
+        self._next_id = self.index[-1]["id"] + 1 if self.index else 1
+
+    @classmethod
+    def from_env(cls, wsgi_app: Callable, url_map: Map,
+                 environ: dict = os.environ
+                 ) -> Optional["ProfilerMiddleware"]:
+        """Makes the middleware configured by environment variables
+
+        Profiling is on if SERVER_PROFILE_DIR names the directory of the
+        profiles. SERVER_PROFILE_KEEP sets the number of profiles kept and
+        SERVER_PROFILE_SAMPLE the fraction of requests profiled at random.
+
+        :param wsgi_app: The WSGI application to wrap
+        :type wsgi_app: Callable
+        :param url_map: The url map of the application
+        :type url_map: werkzeug.routing.Map
+        :param environ: The environment variables
+        :type environ: dict
+        :return: The middleware, or None if profiling is off
+        :rtype: Optional[ProfilerMiddleware]
+        """
+        directory = environ.get("SERVER_PROFILE_DIR")
+        if not directory:
+            return None
+        return cls(wsgi_app, url_map, directory,
+                   int(environ.get("SERVER_PROFILE_KEEP", 200)),
+                   float(environ.get("SERVER_PROFILE_SAMPLE", 0)))
+
+    def path(self, profile_id: int) -> str:
+        """Returns the path of the pstats file of a profile"""
+        return os.path.join(self.directory, "{:08d}.prof".format(profile_id))
+
+    def _read_index(self) -> List[dict]:
+        """Returns the entries of index.json, empty if it is unreadable"""
+        try:
+            with open(os.path.join(self.directory, index_name)) as fobj:
+                return json.load(fobj)
+        except (OSError, ValueError):
+            return []
+
+    def _write_index(self):
+        """Atomically replaces index.json with the current entries"""
+        fname = os.path.join(self.directory, index_name)
+        with open(fname + ".tmp", "w") as fobj:
+            json.dump(self.index, fobj)
+        os.replace(fname + ".tmp", fname)
+
+    def chosen(self, environ: dict) -> bool:
+        """Returns whether a request asks for, or is sampled for, a profile"""
+        key = "HTTP_" + header.upper().replace("-", "_")
+        if environ.get(key, "").strip() in ("1", "true"):
+            return True
+        return self.sample > 0 and random.random() < self.sample
+
+    def __call__(self, environ: dict, start_response: Callable
+                 ) -> Iterable[bytes]:
+        """Calls the app, profiling the request if it was chosen
+
+        :param environ: The WSGI environment of the request
+        :type environ: dict
+        :param start_response: The WSGI start_response callable
+        :type start_response: Callable
+        :return: The body of the response
+        :rtype: Iterable[bytes]
+        """
+        if not self.chosen(environ) or not self._busy.acquire(False):
+            return self.wsgi_app(environ, start_response)
+        try:
+            with self._lock:
+                profile_id = self._next_id
+                self._next_id += 1
+            sent = []
+
+            def tag_response(status, headers, exc_info=None):
+                sent.append(status)
+                headers = list(headers) + [("X-Profile-Id", str(profile_id))]
+                return start_response(status, headers, exc_info)
+
+            profile = cProfile.Profile()
+            tic = time.perf_counter()
+            body = profile.runcall(self.wsgi_app, environ, tag_response)
+            seconds = time.perf_counter() - tic
+        finally:
+            self._busy.release()
+        profile.dump_stats(self.path(profile_id))
+        self._record({"id": profile_id, "route": route_of(self.url_map,
+                                                          environ),
+                      "method": environ.get("REQUEST_METHOD", ""),
+                      "status": int(sent[-1].split(" ", 1)[0]) if sent
+                      else 500, "seconds": seconds, "time": time.time()})
+        return body
+
+    def _record(self, entry: dict):
+        """Adds a profile to the index and drops the oldest beyond keep"""
+        with self._lock:
+            self.index.append(entry)
+            dropped = self.index[:-self.keep]
+            self.index = self.index[len(dropped):]
+            self._write_index()
+        for old in dropped:
+            try:
+                os.remove(self.path(old["id"]))
+            except OSError:
+                pass
+
+    def summary(self, route: str = None, sort: str = "tottime",
+                top: int = 20) -> Dict[str, dict]:
+        """Returns the hottest functions of the profiled requests per route
+
+        :param route: Only summarize this route, e.g. '/get'
+        :type route: str
+        :param sort: 'tottime' (time spent in the function itself) or
+            'cumtime' (including the functions it calls)
+        :type sort: str
+        :param top: The number of functions listed per route
+        :type top: int
+        :return: For each route, the number of profiled 'requests', their
+            'seconds' in total and the top 'functions', each a dictionary of
+            the 'function' ('file:line(name)'), its 'calls', 'tottime' and
+            'cumtime' summed over the requests
+        :rtype: Dict[str, dict]
+        """
+        if sort not in ("tottime", "cumtime"):
+            raise ValueError("sort must be 'tottime' or 'cumtime'")
+        with self._lock:
+            entries = list(self.index)
+        routes = dict()
+        for entry in entries:
+            if route is None or entry["route"] == route:
+                routes.setdefault(entry["route"], []).append(entry)
+        out = dict()
+        for name, group in routes.items():
+            paths = [self.path(entry["id"]) for entry in group]
+            paths = [path for path in paths if os.path.isfile(path)]
+            if not paths:
+                continue
+            stats = pstats.Stats(*paths).stats
+            rows = [{"function": pstats.func_std_string(func), "calls": nc,
+                     "tottime": tt, "cumtime": ct}
+                    for func, (_, nc, tt, ct, _) in stats.items()]
+            rows.sort(key=lambda row: row[sort], reverse=True)
+            out[name] = {"requests": len(group),
+                         "seconds": sum(entry["seconds"] for entry in group),
+                         "functions": rows[:top]}
+        return out
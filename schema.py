@@ -0,0 +1,200 @@
+import functools
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from ecg_analysis.numeric import try_floatify, try_intify
+
+_invalid = object()  # returned by the converters for unconvertable values
+_exact = 2 ** 53  # integers up to this size are exactly equal to a float
+
+
+class SchemaError(ValueError):
+    """Raised when data does not match a Schema
+
+    The message is the one returned to the client, and reason names the kind
+    of failure: 'not_dict', 'unknown_key', 'missing_key', 'conversion' or
+    'type'.
+    """
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _to_int(value: Any) -> Any:
+    """Converts a value like try_intify, with fast paths for int and str
+
+    Values try_intify raises TypeError for, like the None, lists and dicts
+    of a json body, are invalid too.
+    """
+    if type(value) is int and -_exact <= value <= _exact:
+        return value
+    if type(value) is str:
+        try:
+            number = int(value)
+            return number if number == float(number) else _invalid
+        except (ValueError, OverflowError):
+            return _invalid
+    try:
+        number = try_intify(value)
+    except TypeError:
+        return _invalid
+    return _invalid if number is False else number
+
+
+def _to_float(value: Any) -> Any:
+    """Converts a value like try_floatify, with fast paths for numbers
+
+    Values try_floatify raises TypeError for are invalid, as in _to_int.
+    """
+    if type(value) is float:
+        return value
+    if type(value) in (int, str):
+        try:
+            return float(value)
+        except ValueError:
+            return _invalid
+    try:
+        number = try_floatify(value)
+    except TypeError:
+        return _invalid
+    return _invalid if number is False else number
+
+
+_converters = {int: (_to_int, "key {} is not convertable to an integer"),
+               float: (_to_float, "key {} is not convertable to a float")}
+
+
+class Schema:
+    """Validator of dictionaries compiled once from the expected key types
+
+    The expected types (e.g. server.db_keys) are turned into one converter
+    per key when the schema is made, so each dictionary is converted and
+    checked in a single pass over its items: int and float values are
+    converted as try_intify and try_floatify would (so the strings sent by
+    the GUI are accepted), and the values of other keys must be instances of
+    their type.
+    """
+
+    def __init__(self, expected: Dict[str, type], required: Sequence[str] = (),
+                 unknown: str = "keep"):
+        """Compiles a schema
+
+        :param expected: The type of each key
+        :type expected: Dict[str, type]
+        :param required: Keys that every dictionary must hold
+        :type required: Sequence[str]
+        :param unknown: What to do with keys not in expected: 'keep' them
+            unchanged, 'drop' them or 'reject' the dictionary
+        :type unknown: str
+        """
+        if unknown not in ("keep", "drop", "reject"):
+            raise ValueError("unknown must be 'keep', 'drop' or 'reject'")
+        self.expected = dict(expected)
+        self.required = tuple(required)
+        self.unknown = unknown
+        self._fields: Dict[str, Tuple[Callable, str, type]] = dict()
+        for key, kind in self.expected.items():
+            convert, message = _converters.get(kind, (None, None))
+            self._fields[key] = (convert, message and message.format(key),
+                                 kind)
+
+    def coerce(self, data: Any, check: bool = True) -> dict:
+        """Converts the values of a dictionary to their expected types
+
+        :param data: The dictionary, e.g. the json of a POST request
+        :type data: Any
+        :param check: Whether the values of keys that are not converted
+            (those not expected to be int or float) must be of their type
+        :type check: bool
+        :return: A new dictionary with the converted values
+        :rtype: dict
+        :raises SchemaError: If the data does not match the schema
+        """
+        if not isinstance(data, dict):
+            raise SchemaError("The input was not a dictionary.", "not_dict")
+        fields = self._fields
+        out = dict()
+        for key, value in data.items():
+            field = fields.get(key)
+            if field is None:
+                if self.unknown == "reject":
+                    raise SchemaError("key {} is not one of {}".format(
+                        key, ", ".join(self.expected)), "unknown_key")
+                if self.unknown == "keep":
+                    out[key] = value
+                continue
+            convert, message, kind = field
+            if convert is not None:
+                value = convert(value)
+                if value is _invalid:
+                    raise SchemaError(message, "conversion")
+            elif check and not isinstance(value, kind):
+                raise SchemaError("the key '{}' is a {}, should be {}".format(
+                    key, type(value), kind), "type")
+            out[key] = value
+        for key in self.required:
+            if key not in out:
+                raise SchemaError("key {} is required".format(key),
+                                  "missing_key")
+        return out
+
+    def validate(self, data: Any):
+        """Checks the types of the values of a dictionary, without converting
+
+        :param data: The dictionary
+        :type data: Any
+        :raises SchemaError: If the data does not match the schema
+        """
+        if not isinstance(data, dict):
+            raise SchemaError("The input was not a dictionary.", "not_dict")
+        for key, (_, _, kind) in self._fields.items():
+            if key in data and not isinstance(data[key], kind):
+                raise SchemaError("the key '{}' is a {}, should be {}".format(
+                    key, type(data[key]), kind), "type")
+        for key in self.required:
+            if key not in data:
+                raise SchemaError("key {} is required".format(key),
+                                  "missing_key")
+        if self.unknown == "reject":
+            for key in data:
+                if key not in self._fields:
+                    raise SchemaError("key {} is not one of {}".format(
+                        key, ", ".join(self.expected)), "unknown_key")
+
+    def coerce_many(self, batch: Iterable[Any]
+                    ) -> Tuple[List[dict], List[Tuple[int, SchemaError]]]:
+        """Converts a batch of dictionaries, collecting the failures
+
+        :param batch: The dictionaries, e.g. the rows of a bulk upload
+        :type batch: Iterable[Any]
+        :return: The converted dictionaries that match the schema, in order,
+            and the position in the batch and error of each that does not
+        :rtype: Tuple[List[dict], List[Tuple[int, SchemaError]]]
+        """
+        valid, errors = [], []
+        coerce = self.coerce
+        for ii, data in enumerate(batch):
+            try:
+                valid.append(coerce(data))
+            except SchemaError as e:
+                errors.append((ii, e))
+        return valid, errors
+
+
+@functools.lru_cache(maxsize=32)
+def _compiled(fields: Tuple[Tuple[str, type], ...]) -> Schema:
+    return Schema(dict(fields))
+
+
+def schema_of(expected: Dict[str, type]) -> Schema:
+    """Returns the schema compiled from a dictionary of key types
+
+    Schemas are cached, so calling this for every request compiles each
+    dictionary of key types only once.
+
+    :param expected: The type of each key
+    :type expected: Dict[str, type]
+    :return: The schema, keeping unknown keys and requiring none
+    :rtype: Schema
+    """
+    return _compiled(tuple(expected.items()))
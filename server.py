@@ -1,16 +1,86 @@
+import os
 from datetime import datetime
 from typing import Union, Dict, Tuple, TypedDict
 
 from flask import Flask, request, render_template_string
 
+from compression import DecompressMiddleware, compress_response
 from database import Database
-from ecg_analysis.ecg_reader import is_num
+from ecg_analysis.numeric import try_intify, try_floatify
+from metrics import Counter, Gauge, MetricsMiddleware, Registry, content_type
+from profiler import ProfilerMiddleware
+from schema import Schema, SchemaError, schema_of
 
 app = Flask(__name__)
+registry = Registry()
+app.wsgi_app = DecompressMiddleware(app.wsgi_app)
+profiler = ProfilerMiddleware.from_env(app.wsgi_app, app.url_map, os.environ)
+if profiler is not None:
+    app.wsgi_app = profiler
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, registry, app.url_map)
 db_keys = {"patient_id": int, "patient_name": str, "hr": float, "image": list}
 db = Database(index="patient_id")
+revisions = dict()  # revision counter of each patient_id, for ETags
+epoch = os.urandom(4).hex()  # new for every process, as revisions restart
 t_format = "%m-%d-%Y %H:%M:%S"
 db_entry = TypedDict("db_entry", **db_keys)
+patient_schema = Schema(db_keys, required=("patient_id",), unknown="reject")
+validation_failures = registry.register(Counter(
+    "validation_failures_total", "Rejected /new_patient posts.",
+    ("reason",)))
+
+
+def index_sizes() -> Dict[Tuple[str], int]:
+    """Returns the number of values held in each attribute of the database
+
+    :return: The number of values that are not None of each key of db_keys
+    :rtype: Dict[Tuple[str], int]
+    """
+    sizes = dict()
+    for key in db_keys:
+        values = vars(db).get(key, ())
+        sizes[(key,)] = len(values) - values.count(None)
+    return sizes
+
+
+def image_store() -> Dict[Tuple[str], int]:
+    """Returns the number of images stored and their size as b64 strings
+
+    :return: The number of 'images' and of 'bytes' of b64 text
+    :rtype: Dict[Tuple[str], int]
+    """
+    images = [img for entry in db for img in entry.get("image", ())]
+    return {("images",): len(images),
+            ("bytes",): sum(len(img) for img in images)}
+
+
+registry.register(Gauge("database_patients", "Patients in the database.",
+                        lambda: len(db)))
+registry.register(Gauge("database_index_size",
+                        "Values held for each key of the database.",
+                        index_sizes, ("key",)))
+registry.register(Gauge("image_store", "Images held by the database.",
+                        image_store, ("quantity",)))
+registry.register(Gauge("patient_revisions",
+                        "Successful /new_patient posts since start.",
+                        lambda: sum(revisions.values())))
+
+
+@app.after_request
+def compress(response):
+    """Compresses response bodies for clients that accept gzip or zstd
+
+    Runs after every route. Request bodies sent with a Content-Encoding header
+    are decompressed before they reach the routes by DecompressMiddleware, so
+    both directions of the image and listing transfers can be compressed.
+
+    :param response: The response returned by the route
+    :type response: flask.Response
+    :return: The response, compressed if it is large enough and accepted
+    :rtype: flask.Response
+    """
+    return compress_response(response,
+                             request.headers.get("Accept-Encoding", ""))
 
 
 @app.route("/", methods=["GET"])
@@ -27,6 +97,51 @@ def get_status():  # no test needed!
     return "Server is on", 200
 
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics() -> Tuple[str, int, dict]:
+    """Applies route for exposing the metrics of the server to Prometheus
+
+    This function is a GET request that returns, in the Prometheus text
+    format, the number of requests and the distributions of their latencies
+    and body sizes for each route (recorded by MetricsMiddleware), the number
+    of rejected posts to /new_patient by reason, and the sizes of the
+    database, of its attributes and of the stored images, which are computed
+    at every request of this route.
+
+    :return: The metrics, status code and content type
+    :rtype: Tuple[str, int, dict]
+    """
+    return registry.render(), 200, {"Content-Type": content_type}
+
+
+@app.route("/profiles", methods=["GET"])
+def get_profiles() -> Tuple[Union[dict, str], int]:
+    """Applies route for showing the hottest functions of profiled requests
+
+    Profiling is turned on by starting the server with the SERVER_PROFILE_DIR
+    environment variable set (see ProfilerMiddleware.from_env). Requests sent
+    with an 'X-Profile: 1' header are then profiled, and this GET request
+    returns, for each route, the number of profiled requests, their total
+    duration and the functions that took the most time. The optional query
+    parameters 'route', 'sort' ('tottime' or 'cumtime') and 'top' select the
+    route, the order and the number of functions listed.
+
+    :return: Dictionary of the summary of each route, or string + error code
+    :rtype: Tuple[Union[dict, str], int]
+    """
+    if profiler is None:
+        return "Profiling is off, set SERVER_PROFILE_DIR to turn it on", 404
+    top = try_intify(request.args.get("top", 20))
+    if top is False or top < 1:
+        return "top must be a positive integer", 400
+    try:
+        return profiler.summary(request.args.get("route"),
+                                request.args.get("sort", "tottime"),
+                                top), 200
+    except ValueError as e:
+        return str(e), 400
+
+
 @app.route("/new_patient", methods=["POST"])
 def new_patient():
     """This applies the new_patient route to post new patient information to a
@@ -52,15 +167,13 @@ def new_patient():
     and hr; string + error code or string + completion code
     :rtype: Tuple[dict, int]
     """
-    data = request.get_json()
-    data = correct_input(data, db_keys)
-    if not isinstance(data, dict):
-        return data, 400
-    error_msg, status_code = validate_input(data, db_keys)
-    if status_code != 200:
-        return error_msg, status_code
-    data: db_entry
+    try:
+        data: db_entry = patient_schema.coerce(request.get_json())
+    except SchemaError as e:
+        validation_failures.inc(e.reason)
+        return str(e), 400
     added = db.add_entry(data, time=datetime.now().strftime(t_format))
+    revisions[added["patient_id"]] = revisions.get(added["patient_id"], 0) + 1
     return added, 200
 
 
@@ -73,12 +186,15 @@ def get_all():
     jsonified string that states all the data contained in the database defined
     in database.py. The jsonified string, when parsed, is a dictionary with
     index values as keys and all data (except the image data) associated with
-    those MRNs as values. If the database is empty, returns an empty dict.
+    those MRNs as values. If the database is empty, returns an empty dict. The
+    response carries an ETag that changes whenever any patient is updated, so
+    clients may revalidate their copy with If-None-Match (see etag_response).
 
 
     :return: Dictionary with mrns as keys and data as values
-    :rtype: Tuple[dict, int]
+    :rtype: Tuple[dict, int, dict]
     """
+    tag = "{}.db.{}".format(epoch, sum(revisions.values()))
     all_dict = dict()
     if db.Index in db.__dict__.keys():
         for item in db.__dict__[db.Index]:
@@ -86,11 +202,11 @@ def get_all():
             if "image" in db_item.keys():
                 del db_item["image"]
             all_dict[item] = db_item
-    return all_dict, 200
+    return etag_response(all_dict, tag)
 
 
 @app.route("/get/<name_or_mrn>", methods=["GET"])
-def get_data(name_or_mrn: str) -> Tuple[Union[dict, str], int]:
+def get_data(name_or_mrn: str) -> Tuple[Union[dict, str], ...]:
     """Applies route for showing all data associated with name or mrn
 
     This function is a GET request that when the address
@@ -99,24 +215,52 @@ def get_data(name_or_mrn: str) -> Tuple[Union[dict, str], int]:
     associated with the name or MRN inputted. If there is more than one MRN
     associated with the name given, then the most recent mrn is returned, and
     other data can only be retrieved by inputting the mrn of the older data.
+    The response carries an ETag of the patient's revision (see etag_response).
 
     :param name_or_mrn: name or mrn of the relevant data to be retrieved
     :type name_or_mrn: str
     :return: data associated with that name or mrn
-    :rtype: Tuple[dict, int]
+    :rtype: Tuple[dict, int, dict]
     """
     try:
         mrn = try_intify(name_or_mrn)
         match = db.search(patient_id=mrn, patient_name=name_or_mrn)
         if "image" in match.keys():
             del match["image"]
-        return match, 200
+        return etag_response(match, patient_tag(match["patient_id"]))
+    except IndexError as e:
+        return str(e), 405
+
+
+@app.route("/get/<name_or_mrn>/full", methods=["GET"])
+def get_full(name_or_mrn: str) -> Tuple[Union[dict, str], ...]:
+    """Applies route for showing the data and latest image of a name or mrn
+
+    This function is a GET request that when the address
+    http://vcm-23126.vm.duke.edu/get/<name_or_mrn>/full is inputted online,
+    returns a jsonified string of the same data as /get/<name_or_mrn>, with
+    the addition of the 'image' key holding a list of only the most recent b64
+    image, if one was uploaded. This lets a client retrieve a patient in a
+    single request instead of also requesting /get/<name_or_mrn>/image. The
+    response carries an ETag of the patient's revision (see etag_response).
+
+    :param name_or_mrn: name or mrn of the relevant data to be retrieved
+    :type name_or_mrn: str
+    :return: data and latest image associated with that name or mrn
+    :rtype: Tuple[dict, int, dict]
+    """
+    try:
+        mrn = try_intify(name_or_mrn)
+        match = db.search(patient_id=mrn, patient_name=name_or_mrn)
     except IndexError as e:
         return str(e), 405
+    if "image" in match.keys():
+        match["image"] = match["image"][-1:]
+    return etag_response(match, patient_tag(match["patient_id"]))
 
 
 @app.route("/get/<name_or_mrn>/image", methods=["GET"])
-def get_image(name_or_mrn: str) -> Tuple[str, int]:
+def get_image(name_or_mrn: str) -> Tuple[str, ...]:
     """Applies route for showing image associated with the given name or mrn
 
     This function is a GET request that when the address
@@ -125,12 +269,13 @@ def get_image(name_or_mrn: str) -> Tuple[str, int]:
     and associated name on a webpage associated with the name or MRN inputted.
     If there is more than one MRN associated with the name given, then the most
     recent mrn is returned, and other images can only be retrieved by inputting
-    the mrn of the older data.
+    the mrn of the older data. The response carries an ETag of the patient's
+    revision (see etag_response).
 
     :param name_or_mrn: name or mrn of the relevant data to be retrieved
     :type name_or_mrn: str
     :return: html string of rendered image and name
-    :rtype: Tuple[str, int]
+    :rtype: Tuple[str, int, dict]
     """
     try:
         mrn = try_intify(name_or_mrn)
@@ -146,7 +291,56 @@ def get_image(name_or_mrn: str) -> Tuple[str, int]:
     else:
         name = ""
     page = render_image(b64_img, name)
-    return page, 200
+    return etag_response(page, patient_tag(data["patient_id"]))
+
+
+def patient_tag(patient_id: int) -> str:
+    """Returns the ETag of the current revision of a patient's data
+
+    Every successful POST to /new_patient increments the revision counter of
+    that patient. The tag includes the patient id so that a name which later
+    refers to another patient never matches a stale tag, and the epoch of the
+    server process, since the counters start again from 0 when the server
+    restarts and a client could otherwise hold a tag of different data.
+
+    :param patient_id: The MRN of the patient
+    :type patient_id: int
+    :return: The (unquoted) ETag of the patient's data
+    :rtype: str
+    """
+    return "{}.{}.{}".format(epoch, patient_id, revisions.get(patient_id, 0))
+
+
+def etag_response(payload: Union[dict, str], tag: str
+                  ) -> Tuple[Union[dict, str], int, dict]:
+    """Adds an ETag to a response, or returns 304 if the client has it
+
+    If the If-None-Match header of the current request contains the tag, the
+    client already holds this revision of the data and an empty 304 (Not
+    Modified) response is returned instead of the payload. Otherwise the
+    payload is returned with status 200 and the ETag header set.
+
+    :param payload: The body of the response
+    :type payload: Union[dict, str]
+    :param tag: The (unquoted) ETag of the payload
+    :type tag: str
+    :return: The body, status code and headers of the response
+    :rtype: Tuple[Union[dict, str], int, dict]
+    """
+    if request.if_none_match.contains_weak(tag):
+        return not_modified(tag)
+    return payload, 200, {"ETag": '"{}"'.format(tag)}
+
+
+def not_modified(tag: str) -> Tuple[str, int, dict]:
+    """Returns an empty 304 (Not Modified) response with the given ETag
+
+    :param tag: The (unquoted) ETag of the data the client holds
+    :type tag: str
+    :return: The body, status code and headers of the response
+    :rtype: Tuple[str, int, dict]
+    """
+    return "", 304, {"ETag": '"{}"'.format(tag)}
 
 
 def render_image(b64_img: str, name: str) -> str:
@@ -174,64 +368,6 @@ def render_image(b64_img: str, name: str) -> str:
     return page
 
 
-def try_intify(num: Union[int, float, bool, str, complex]) -> Union[int, bool]:
-    """Tries to convert input to integer and if this is not possible,
-    then the func returns false.
-
-    The func runs the value through a series of statements that
-    determine if the value has an imaginary value of 0 (return only the
-    real integer value or otherwise to return False), if the value
-    is a float and if it is equal to the integer of that value
-    (returns the integer), if the value is a boolean (returns False),
-    or if there is any other error to return False.
-
-    :param num: single value can be int, float, bool, str, complex
-    :type num: Union[int, float, bool, str, complex]
-    :return: integer if it was convertable and a False if not
-    :rtype: Union[int, bool]
-    """
-    if isinstance(num, complex):  # TESTED
-        if num.imag == 0:
-            num = num.real
-        else:
-            return False
-    elif isinstance(num, bool):
-        return False
-    try:
-        if int(num) == float(num):
-            return int(num)
-        else:
-            return False
-    except ValueError:
-        return False
-
-
-def try_floatify(num: Union[int, float, bool, str, complex]
-                 ) -> Union[float, bool]:
-    """Function that tests if object can be converted to number
-
-    A function that takes any input and detects if it is a number by
-    attempting to convert the input to a float. This function catches
-    convertable digit string cases.
-
-    Source:
-    https://stackoverflow.com/questions/354038
-
-    :param num: object data to determine if it is conceivably a number
-    :type num: Union[int, float, bool, str, complex]
-    :return: a boolean determination if the input is a number, or the floating
-        point number itself
-    :rtype: Union[float, bool]
-    """
-
-    if is_num(num):
-        if isinstance(num, complex):
-            num = num.real
-        return float(num)
-    else:
-        return False
-
-
 def validate_input(in_data: dict,  # TESTED
                    expected: Dict[str, type]) -> Tuple[Union[str, bool], int]:
     """Determines if the data given is a dictionary, if the key exsists in
@@ -240,9 +376,9 @@ def validate_input(in_data: dict,  # TESTED
     An expectation of the type of data in each key is established
     and fed into this function along with a dictionary data set.
     The Validate input funx then checks if the input was a dictionary(if not,
-    return string and 400 error), if the key specified is missing(if missing
     return string and 400 error), and if the data type of each key is correct
-    (if not return str and 400).
+    (if not return str and 400). Keys that are missing or not expected are
+    ignored.
 
     :param in_data: dictionary of data
     :param expected: dictionary data key types expectations (tuple)
@@ -252,14 +388,10 @@ def validate_input(in_data: dict,  # TESTED
     :rtype: Tuple[Union[str, bool], int]
 
     """
-    if not isinstance(in_data, dict):
-        return "The input was not a dictionary.", 400
-    for key, value in expected.items():
-        if key not in in_data.keys():
-            continue
-        elif not isinstance(in_data[key], value):
-            return "the key '{}' is a {}, should be {}".format(
-                key, type(in_data[key]), expected[key]), 400
+    try:
+        schema_of(expected).validate(in_data)
+    except SchemaError as e:
+        return str(e), 400
     return True, 200
 
 
@@ -270,8 +402,10 @@ def correct_input(in_data: Dict[str, Union[str, list]],
     Takes the dictionary in_data from the post request and converts the values
     to the data types indicated in the expected type dictionary. If the
     conversion fails, the function returns a string indicating where the error
-    occurred. The internal conversions are handled by try_intify and
-    try_floatify for int and float types respectively.
+    occurred. The conversions are those of try_intify and try_floatify for int
+    and float types respectively, and keys missing from expected are kept
+    unchanged. The schema of expected is compiled once and cached (see
+    schema.schema_of).
 
     :param in_data: Data received to the server by the POST request
     :type in_data: Dict[str, Union[str, list]]
@@ -281,23 +415,10 @@ def correct_input(in_data: Dict[str, Union[str, list]],
         types match the expected types
     :rtype: Union[db_entry, str]
     """
-    out_data = dict()
-    for key, val in in_data.items():
-        if expected[key] is int:
-            i = try_intify(val)
-            if i is False:
-                return "key {} is not convertable to an integer".format(key)
-            else:
-                out_data[key] = i
-        elif expected[key] is float:
-            i = try_floatify(val)
-            if i is False:
-                return "key {} is not convertable to a float".format(key)
-            else:
-                out_data[key] = i
-        else:
-            out_data[key] = val
-    return out_data
+    try:
+        return schema_of(expected).coerce(in_data, check=False)
+    except SchemaError as e:
+        return str(e)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+import os
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from api_client import ServerClient, make_session
+
+with open(os.path.join("tests", "b64.txt"), "r") as fobj:
+    txt = fobj.read()
+
+
+@pytest.fixture(scope="module")
+def client():
+    from server import app
+    httpd = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    api = ServerClient("http://127.0.0.1:{}".format(httpd.server_port))
+    yield api
+    api.close()
+    httpd.shutdown()
+
+
+def test_make_session():
+    session = make_session(retries=5, backoff=0.5, pool_size=4)
+    adapter = session.get_adapter("http://localhost:5000")
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.backoff_factor == 0.5
+    assert "POST" not in adapter.max_retries.allowed_methods
+    assert adapter._pool_maxsize == 4
+
+
+def test_round_trip(client):
+    added = client.new_patient({"patient_id": "9101", "patient_name": "Ann",
+                                "image": [txt], "hr": "72"})
+    assert added["patient_id"] == 9101
+    assert 9101 in [row["patient_id"] for row in client.get_all().values()]
+    record = client.get_record("9101")
+    assert "image" not in record
+    assert record["hr"] == 72.0
+    full = client.get_full("9101")
+    assert full["image"] == [txt]
+    assert full["patient_name"] == "Ann"
+
+
+def test_errors(client):
+    assert client.new_patient({"patient_id": "one"}) == \
+        "key patient_id is not convertable to an integer"
+    assert client.get_full("9199").startswith("No patient_id or patient_name")
+
+
+def test_cache(client):
+    client.cache.invalidate()
+    client.new_patient({"patient_id": "9102", "hr": "60"})
+    hits, misses = client.cache.hits, client.cache.misses
+    assert client.get_full("9102")["hr"] == 60.0
+    assert (client.cache.hits, client.cache.misses) == (hits, misses + 1)
+    # unchanged record is revalidated and served from the cache
+    assert client.get_full("9102")["hr"] == 60.0
+    assert (client.cache.hits, client.cache.misses) == (hits + 1, misses + 1)
+    # changed record is downloaded again
+    client.new_patient({"patient_id": "9102", "hr": "80"})
+    assert client.get_full("9102")["hr"] == 80.0
+    assert client.cache.misses == misses + 2
+    assert client.cache.stats()["hits"] == hits + 1
+
+
+def test_cache_max_age(client):
+    from api_client import ServerClient
+    fresh = ServerClient(client.base_url, max_age=60)
+    fresh.get_all()
+    fresh.session.close()
+    fresh.session = None  # a hit must not touch the network
+    fresh.get_all()
+    assert fresh.cache.stats()["hits"] == 1
+    assert fresh.cache.stats()["misses"] == 1
@@ -58,3 +58,10 @@ def test_html_search():
     assert answer == txt
     bad_answer = img_from_html("")
     assert bad_answer == ""
+
+
+def test_import_is_lightweight():
+    from benchmarks.import_time import measure
+    times = measure("GUI_client", repeat=1)
+    for module in ["mne", "neurokit2", "matplotlib", "flask", "server"]:
+        assert module not in times
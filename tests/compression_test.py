@@ -0,0 +1,48 @@
+import gzip
+import os
+
+import pytest
+
+import compression as comp
+
+with open(os.path.join("tests", "b64.txt"), "r") as fobj:
+    txt = fobj.read()
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip, deflate", "gzip"),
+    ("deflate", None),
+    ("", None),
+    ("gzip;q=0", None),
+    ("*", comp.supported_encodings()[0]),
+    ("gzip;q=1.0, *;q=0", "gzip"),
+    ("GZIP;q=0.5", "gzip")
+])
+def test_choose_encoding(header, expected):
+    assert comp.choose_encoding(header) == expected
+
+
+@pytest.mark.parametrize("encoding", comp.supported_encodings())
+def test_round_trip(encoding):
+    data = txt.encode("utf-8")
+    packed = comp.compress(data, encoding)
+    assert len(packed) < len(data)
+    assert comp.decompress(packed, encoding) == data
+
+
+def test_decompress_limits():
+    bomb = gzip.compress(b"0" * 10000)
+    with pytest.raises(comp.DecompressionError):
+        comp.decompress(bomb, "gzip", max_size=9999)
+    assert comp.decompress(bomb, "gzip", max_size=10000) == b"0" * 10000
+    with pytest.raises(comp.DecompressionError):
+        comp.decompress(bomb[:-20], "gzip")
+    with pytest.raises(comp.DecompressionError):
+        comp.decompress(b"not gzip", "gzip")
+
+
+def test_zstd_choice():
+    pytest.importorskip("zstandard")
+    assert comp.choose_encoding("gzip, zstd") == "zstd"
+    assert comp.choose_encoding("gzip, zstd;q=0.5") == "gzip"
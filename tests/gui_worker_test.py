@@ -0,0 +1,63 @@
+import threading
+import time
+
+from gui_worker import BackgroundRunner
+
+
+class FakeRoot:
+    """Stands in for tk.Tk by running 'after' callbacks when pumped"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, ms, func):
+        self.callbacks.append(func)
+
+    def pump(self, timeout=5.0):
+        end = time.time() + timeout
+        while self.callbacks and time.time() < end:
+            self.callbacks.pop(0)()
+            time.sleep(0.001)
+
+
+def test_result_on_main_loop():
+    root = FakeRoot()
+    busy = []
+    results = []
+    runner = BackgroundRunner(root, on_busy=busy.append)
+    runner.submit("add", lambda a, b: (a + b, threading.get_ident()), 1, 2,
+                  on_done=results.append)
+    assert runner.busy
+    root.pump()
+    assert results[0][0] == 3
+    assert results[0][1] != threading.get_ident()  # ran in the background
+    assert not runner.busy
+    assert busy[0] is True and busy[-1] is False
+    runner.shutdown()
+
+
+def test_error_callback():
+    root = FakeRoot()
+    errors = []
+    runner = BackgroundRunner(root)
+    runner.submit("bad", lambda: 1 / 0, on_done=errors.append,
+                  on_error=errors.append)
+    root.pump()
+    assert isinstance(errors[0], ZeroDivisionError)
+    runner.shutdown()
+
+
+def test_cancel_and_supersede():
+    root = FakeRoot()
+    results = []
+    release = threading.Event()
+    runner = BackgroundRunner(root, max_workers=1)
+    runner.submit("slow", lambda: release.wait(5) and "slow",
+                  on_done=results.append)
+    runner.submit("get", lambda: "old", on_done=results.append)
+    runner.submit("get", lambda: "new", on_done=results.append)
+    runner.cancel("slow")
+    release.set()
+    root.pump()
+    assert results == ["new"]
+    runner.shutdown()
@@ -0,0 +1,37 @@
+import pytest
+
+import metrics as met
+
+
+def test_counter_and_gauge():
+    registry = met.Registry()
+    counter = registry.register(met.Counter("hits_total", "Hits.", ("path",)))
+    counter.inc("/a")
+    counter.inc("/a", amount=2)
+    counter.inc('say "hi"\n')
+    registry.register(met.Gauge("size", "Size.", lambda: 1.5))
+    assert counter.value("/a") == 3
+    assert registry.render().splitlines() == [
+        "# HELP hits_total Hits.", "# TYPE hits_total counter",
+        'hits_total{path="/a"} 3', r'hits_total{path="say \"hi\"\n"} 1',
+        "# HELP size Size.", "# TYPE size gauge", "size 1.5"]
+    with pytest.raises(ValueError):
+        registry.register(met.Counter("size", "Again."))
+
+
+def test_histogram():
+    hist = met.Histogram("latency", "Latency.", ("route",), buckets=(1, 2))
+    for value in (0.5, 1, 1.5, 3):
+        hist.observe(value, "/")
+    assert hist.count("/") == 4
+    assert hist.samples() == [
+        'latency_bucket{route="/",le="1"} 2',
+        'latency_bucket{route="/",le="2"} 3',
+        'latency_bucket{route="/",le="+Inf"} 4',
+        'latency_sum{route="/"} 6', 'latency_count{route="/"} 4']
+
+
+@pytest.mark.parametrize("length, expected", [
+    ("12", 12), ("", None), (None, None), ("x", None)])
+def test_size(length, expected):
+    assert met._size(length) == expected
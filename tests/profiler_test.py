@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+from werkzeug.test import Client
+
+import profiler as prof
+import server as serv
+
+
+@pytest.fixture
+def middleware(tmp_path, monkeypatch):
+    middleware = prof.ProfilerMiddleware(serv.app.wsgi_app, serv.app.url_map,
+                                         str(tmp_path), keep=3)
+    monkeypatch.setattr(serv, "profiler", middleware)
+    return middleware
+
+
+def test_from_env(tmp_path):
+    assert prof.ProfilerMiddleware.from_env(None, None, {}) is None
+    middleware = prof.ProfilerMiddleware.from_env(
+        None, None, {"SERVER_PROFILE_DIR": str(tmp_path),
+                     "SERVER_PROFILE_KEEP": "5"})
+    assert middleware.keep == 5
+    assert middleware.sample == 0
+    with pytest.raises(ValueError):
+        prof.ProfilerMiddleware.from_env(
+            None, None, {"SERVER_PROFILE_DIR": str(tmp_path),
+                         "SERVER_PROFILE_KEEP": "0"})
+
+
+def test_ring(middleware, tmp_path):
+    client = Client(middleware)
+    serv.db.add_entry({"patient_id": 9041})
+    assert "X-Profile-Id" not in client.get("/get/9041").headers
+    ids = [client.get("/get/9041", headers={"X-Profile": "1"}
+                      ).headers["X-Profile-Id"] for _ in range(5)]
+    assert ids == ["1", "2", "3", "4", "5"]
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "00000003.prof", "00000004.prof", "00000005.prof", "index.json"]
+    with open(str(tmp_path / "index.json")) as fobj:
+        index = json.load(fobj)
+    assert [entry["route"] for entry in index] == ["/get/<name_or_mrn>"] * 3
+    resumed = prof.ProfilerMiddleware(serv.app.wsgi_app, serv.app.url_map,
+                                      str(tmp_path))
+    assert resumed._next_id == 6
+
+
+def test_summary_route(middleware):
+    client = Client(middleware)
+    client.get("/get", headers={"X-Profile": "1"})
+    r = serv.app.test_client().get("/profiles?sort=cumtime&top=50")
+    assert r.status_code == 200
+    summary = r.get_json()["/get"]
+    assert summary["requests"] == 1
+    assert len(summary["functions"]) == 50
+    assert any("get_all" in row["function"] for row in summary["functions"])
+    times = [row["cumtime"] for row in summary["functions"]]
+    assert times == sorted(times, reverse=True)
+    assert serv.app.test_client().get("/profiles?sort=x").status_code == 400
+
+
+def test_profiling_off(monkeypatch):
+    monkeypatch.setattr(serv, "profiler", None)
+    assert serv.app.test_client().get("/profiles").status_code == 404
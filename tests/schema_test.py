@@ -0,0 +1,61 @@
+import pytest
+
+import schema as sch
+from ecg_analysis.numeric import try_floatify, try_intify
+
+keys = {"a": int, "b": float, "c": str, "d": list}
+
+
+@pytest.mark.parametrize("value", [
+    1, "1", "one", 0j + 1, 1j + 1, 1.4, 1.0, "1.4", "12a", " 123 ", True,
+    2 ** 53 + 1, str(2 ** 53 + 1), "9" * 400, "nan", "inf", -0.0, "-7"])
+def test_matches_try_numify(value):
+    number = sch._to_int(value)
+    assert (False if number is sch._invalid else number) == try_intify(value)
+    number = sch._to_float(value)
+    expected = try_floatify(value)
+    if expected is False:
+        assert number is sch._invalid
+    elif expected == expected:  # not nan
+        assert number == expected and type(number) is float
+
+
+def test_coerce():
+    schema = sch.Schema(keys, required=("a",), unknown="reject")
+    assert schema.coerce({"a": "1", "b": "1.5", "c": "x", "d": []}) == {
+        "a": 1, "b": 1.5, "c": "x", "d": []}
+    for data, reason in [([], "not_dict"), ({"a": 1, "e": 2}, "unknown_key"),
+                         ({"b": 1.}, "missing_key"),
+                         ({"a": "x"}, "conversion"),
+                         ({"a": 1, "d": "x"}, "type")]:
+        with pytest.raises(sch.SchemaError) as e:
+            schema.coerce(data)
+        assert e.value.reason == reason
+    assert sch.Schema(keys, unknown="drop").coerce({"e": 1}) == {}
+    assert sch.Schema(keys).coerce({"e": 1, "d": "x"}, check=False) == {
+        "e": 1, "d": "x"}
+
+
+@pytest.mark.parametrize("value", [None, [1], [], {"a": 1}])
+def test_json_values_are_invalid(value):
+    assert sch._to_int(value) is sch._invalid
+    assert sch._to_float(value) is sch._invalid
+    for key in ("a", "b"):
+        with pytest.raises(sch.SchemaError) as e:
+            sch.Schema(keys).coerce({key: value})
+        assert e.value.reason == "conversion"
+
+
+def test_coerce_many():
+    valid, errors = sch.Schema(keys).coerce_many(
+        [{"a": "1"}, {"a": "x"}, None, {"b": 2}, {"a": None}, {"b": [1]},
+         {"a": 3}])
+    assert valid == [{"a": 1}, {"b": 2.}, {"a": 3}]
+    assert [(ii, e.reason) for ii, e in errors] == [
+        (1, "conversion"), (2, "not_dict"), (4, "conversion"),
+        (5, "conversion")]
+
+
+def test_schema_of():
+    assert sch.schema_of(dict(keys)) is sch.schema_of(keys)
+    assert sch.schema_of({"a": int}) is not sch.schema_of(keys)
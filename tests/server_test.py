@@ -71,9 +71,169 @@ def test_rendering():
     ({"a": "1", "b": "1.1", "c": "word", "d": ["1"]}, type_keys,
      {"a": 1, "b": 1.1, "c": "word", "d": ["1"]}),
     ({"a": "1.1"}, type_keys, "key a is not convertable to an integer"),
-    ({"b": "one"}, type_keys, "key b is not convertable to a float")
+    ({"b": "one"}, type_keys, "key b is not convertable to a float"),
+    ({"a": 1, "e": "1"}, type_keys, {"a": 1, "e": "1"}),
+    ([], type_keys, "The input was not a dictionary.")
 ])
 def test_correction(my_in, types, expected):
     from server import correct_input
     answer = correct_input(my_in, types)
     assert answer == expected
+
+
+def test_new_patient_validation():
+    client = serv.app.test_client()
+    r = client.post("/new_patient", json={"patient_id": "9051", "hr": "61.5",
+                                          "patient_name": "Ann"})
+    assert r.status_code == 200
+    assert r.get_json()["patient_id"] == 9051
+    assert r.get_json()["hr"] == 61.5
+    for body, message in [({"hr": 60}, "key patient_id is required"),
+                          ({"patient_id": 9051, "pulse": 60},
+                           "key pulse is not one of patient_id, "
+                           "patient_name, hr, image"),
+                          ([1], "The input was not a dictionary."),
+                          ({"patient_id": None},
+                           "key patient_id is not convertable to an "
+                           "integer"),
+                          ({"patient_id": [1]},
+                           "key patient_id is not convertable to an "
+                           "integer"),
+                          ({"patient_id": 1, "hr": None},
+                           "key hr is not convertable to a float"),
+                          ({"patient_id": 1, "hr": [60]},
+                           "key hr is not convertable to a float")]:
+        r = client.post("/new_patient", json=body)
+        assert r.status_code == 400
+        assert r.get_data(as_text=True) == message
+
+
+def test_import_is_lightweight():
+    from benchmarks.import_time import measure
+    times = measure("server", repeat=1)
+    assert "mne" not in times
+    assert "pandas" not in times
+
+
+def test_get_full():
+    client = serv.app.test_client()
+    client.post("/new_patient", json={"patient_id": 9001, "image": ["a"]})
+    client.post("/new_patient", json={"patient_id": 9001, "image": ["b"]})
+    r = client.get("/get/9001/full")
+    assert r.status_code == 200
+    assert r.get_json() == {"patient_id": 9001, "image": ["b"],
+                            "time": r.get_json()["time"]}
+    assert client.get("/get/9002/full").status_code == 405
+
+
+def test_etags():
+    client = serv.app.test_client()
+    client.post("/new_patient", json={"patient_id": 9011, "hr": 60})
+    r = client.get("/get/9011")
+    tag = r.headers["ETag"]
+    assert tag == '"{}.9011.1"'.format(serv.epoch)
+    assert client.get("/get/9011", headers={"If-None-Match": tag}
+                      ).status_code == 304
+    listing = client.get("/get").headers["ETag"]
+    assert client.get("/get", headers={"If-None-Match": listing}
+                      ).status_code == 304
+
+    client.post("/new_patient", json={"patient_id": 9011, "hr": 70})
+    r = client.get("/get/9011", headers={"If-None-Match": tag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] == '"{}.9011.2"'.format(serv.epoch)
+    assert r.get_json()["hr"] == 70
+    assert client.get("/get", headers={"If-None-Match": listing}
+                      ).status_code == 200
+
+    current = r.headers["ETag"]
+    assert client.get("/get/9011", headers={"If-None-Match": current}
+                      ).status_code == 304
+    restarted = current.replace(serv.epoch, "0" * len(serv.epoch))
+    assert client.get("/get/9011", headers={"If-None-Match": restarted}
+                      ).status_code == 200
+
+
+def test_compressed_bodies():
+    import gzip
+    import json
+    client = serv.app.test_client()
+    body = gzip.compress(json.dumps({"patient_id": 9021,
+                                     "image": [b64_str]}).encode())
+    r = client.post("/new_patient", data=body,
+                    headers={"Content-Encoding": "gzip",
+                             "Content-Type": "application/json"})
+    assert r.status_code == 200
+
+    r = client.get("/get/9021/full", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert r.headers["ETag"].startswith("W/")
+    assert len(r.data) < len(b64_str)
+    assert json.loads(gzip.decompress(r.data))["image"] == [b64_str]
+
+    small = client.get("/get/9021", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+
+    r = client.post("/new_patient", data=b"garbage",
+                    headers={"Content-Encoding": "gzip"})
+    assert r.status_code == 400
+    r = client.post("/new_patient", data=b"{}",
+                    headers={"Content-Encoding": "br"})
+    assert r.status_code == 415
+
+
+def test_load_benchmark():
+    from benchmarks.server_load import benchmark, plan, report
+    requests_plan = plan(100, 10, {"get": 1., "new_patient": 1.}, "img")
+    assert {item[0] for item in requests_plan} == {"get", "new_patient"}
+    assert all(item[2] == "/new_patient" for item in requests_plan
+               if item[0] == "new_patient")
+    summary = benchmark("dev", 20, n_requests=30, concurrency=2,
+                        mix={"get": 2., "image": 1., "get_all": 0.2})
+    assert summary.pop("seed_seconds") >= 0
+    assert summary["all"]["n"] == 30
+    assert summary["all"]["errors"] == 0
+    assert summary["all"]["p50"] <= summary["all"]["p99"]
+    assert len(report("dev", summary)) == len(summary) + 2
+
+
+def test_metrics():
+    client = serv.app.test_client()
+    client.post("/new_patient", json={"patient_id": 9031, "image": ["abcd"]})
+    client.post("/new_patient", json={"patient_id": "x"})
+    client.post("/new_patient", json={"patient_id": 9032, "image": "abcd"})
+    client.get("/get/9031")
+    client.get("/nowhere")
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = r.get_data(as_text=True)
+    assert 'http_requests_total{route="/get/<name_or_mrn>",method="GET",' \
+           'status="200"}' in text
+    assert 'http_requests_total{route="unmatched",method="GET",' \
+           'status="404"}' in text
+    assert 'http_request_duration_seconds_bucket{route="/new_patient",' \
+           'method="POST",le="+Inf"}' in text
+    assert 'http_request_size_bytes_count{route="/new_patient"}' in text
+    assert 'validation_failures_total{reason="conversion"}' in text
+    assert 'validation_failures_total{reason="type"}' in text
+    assert "database_patients {}".format(len(serv.db)) in text
+    images = serv.image_store()
+    assert 'image_store{quantity="bytes"} ' + str(images[("bytes",)]) in text
+    assert serv.index_sizes()[("patient_id",)] == len(serv.db)
+
+
+def test_metrics_request_size():
+    import gzip
+    import json
+    from werkzeug.test import Client
+    from metrics import MetricsMiddleware, Registry
+    middleware = MetricsMiddleware(serv.app.wsgi_app.wsgi_app, Registry(),
+                                   serv.app.url_map)
+    body = gzip.compress(json.dumps({"patient_id": 9061,
+                                     "image": [b64_str]}).encode())
+    r = Client(middleware).post("/new_patient", data=body, headers={
+        "Content-Encoding": "gzip", "Content-Type": "application/json"})
+    assert r.status_code == 200
+    assert middleware.request_size.count("/new_patient") == 1
+    assert middleware.request_size._values[("/new_patient",)][1] == len(body)